@@ -0,0 +1,17 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+benchmarks
+Reproducible benchmark suite: microbenchmarks of the codec and history store, and end to end loopback scenarios
+
+python3 -m benchmarks run --out results.json
+python3 -m benchmarks compare baseline.json results.json
+"""
+
+import os
+import sys
+
+# the app modules live flat in src/, same as when running runner.py from there
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
@@ -0,0 +1,110 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+__main__.py
+Command line entry for the benchmark suite
+
+python3 -m benchmarks run [--suite micro,e2e,shards,flood,hol,sim,lossy,analytics,inbox,replay,restart,backup,archive,attachment,metrics] [--sizes 1000,10000] [--shards 1,2,4] [--out results.json]
+python3 -m benchmarks compare baseline.json results.json [--threshold 0.1]
+"""
+
+import argparse
+import sys
+
+from benchmarks import micro, e2e, shards, flood, hol, sim, lossy, analytics, inbox, capture_replay, restart, backup, archive, attachment, metrics
+from benchmarks.common import write_results, load_results, compare
+
+def parse_sizes(text : str) -> list:
+    return [int(size.replace("_", "")) for size in text.split(",") if size]
+
+def run(args) -> int:
+    suites = args.suite.split(",")
+    results = []
+    if "micro" in suites:
+        results += micro.run(parse_sizes(args.sizes))
+    if "e2e" in suites:
+        results += e2e.run(parse_sizes(args.e2e_sizes), args.peers)
+    if "shards" in suites:
+        results += shards.run(parse_sizes(args.shards), args.shard_peers, args.shard_messages)
+    if "flood" in suites:
+        results += flood.run(args.flood_seconds, args.flooders)
+    if "hol" in suites:
+        results += hol.run(args.bulk_bytes)
+    if "sim" in suites:
+        results += sim.run(parse_sizes(args.sim_nodes), args.sim_latency, args.sim_loss, args.seed)
+    if "lossy" in suites:
+        results += lossy.run(args.loss, args.lossy_messages)
+    if "analytics" in suites:
+        results += analytics.run(parse_sizes(args.analytics_rows))
+    if "inbox" in suites:
+        results += inbox.run(parse_sizes(args.inbox_peers))
+    if "replay" in suites:
+        results += capture_replay.run(parse_sizes(args.e2e_sizes))
+    if "restart" in suites:
+        results += restart.run()
+    if "backup" in suites:
+        results += backup.run(parse_sizes(args.backup_messages))
+    if "archive" in suites:
+        results += archive.run(parse_sizes(args.archive_messages))
+    if "attachment" in suites:
+        results += attachment.run(parse_sizes(args.attachment_sizes), args.attachment_dir)
+    if "metrics" in suites:
+        results += metrics.run(parse_sizes(args.metrics_messages))
+    for entry in results:
+        print(f"{entry['name']:<36} n={entry['n']:<9} {entry['seconds'] * 1e3:12.3f} ms")
+    write_results(args.out, results)
+    print(f"wrote {args.out}")
+    return 0
+
+def run_compare(args) -> int:
+    rows = compare(load_results(args.baseline), load_results(args.current), args.threshold)
+    regressions = 0
+    for row in rows:
+        flag = "REGRESSION" if row["regression"] else ""
+        regressions += row["regression"]
+        print(f"{row['name']:<36} n={row['n']:<9} {row['baseline'] * 1e3:10.3f} ms -> {row['current'] * 1e3:10.3f} ms {row['change'] * 100:+7.1f}% {flag}")
+    print(f"{regressions} regressions over {args.threshold * 100:.0f}%")
+    return 1 if regressions else 0
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="benchmarks", description="P2PMessaging benchmark suite")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="run benchmarks and write JSON results")
+    run_parser.add_argument("--suite", default="micro,e2e", help="comma separated suites: micro, e2e, shards, flood, hol, sim, lossy, analytics, inbox, replay, restart, backup, archive, attachment, metrics")
+    run_parser.add_argument("--sizes", default="1000,10000,100000", help="message counts for microbenchmarks (up to 1000000)")
+    run_parser.add_argument("--e2e-sizes", default="1000,10000", help="message counts for throughput and history sync")
+    run_parser.add_argument("--peers", type=int, default=20, help="clients dialing the hub in the handshake scenario")
+    run_parser.add_argument("--shards", default="1,2,4", help="shard counts for the sharded listener scaling scenario")
+    run_parser.add_argument("--shard-peers", dest="shard_peers", type=int, default=200, help="connections held against the sharded listener")
+    run_parser.add_argument("--shard-messages", dest="shard_messages", type=int, default=20, help="text messages each of those connections sends")
+    run_parser.add_argument("--flood-seconds", dest="flood_seconds", type=float, default=5.0, help="how long the connection flood lasts")
+    run_parser.add_argument("--flooders", type=int, default=4, help="processes opening connections during the flood")
+    run_parser.add_argument("--bulk-bytes", dest="bulk_bytes", type=int, default=8 * 1024 * 1024, help="size of the bulk frames text has to get past in the hol scenario")
+    run_parser.add_argument("--sim-nodes", dest="sim_nodes", default="100,1000", help="Client counts on the simulated network (10000 fits in one process)")
+    run_parser.add_argument("--sim-latency", dest="sim_latency", type=float, default=0.02, help="one way latency of simulated links, seconds")
+    run_parser.add_argument("--sim-loss", dest="sim_loss", type=float, default=0.01, help="segment loss rate of simulated links")
+    run_parser.add_argument("--seed", type=int, default=1, help="seed for simulated delays and losses")
+    run_parser.add_argument("--loss", type=float, default=0.02, help="packet loss injected in the lossy scenario")
+    run_parser.add_argument("--lossy-messages", dest="lossy_messages", type=int, default=500, help="texts sent in the lossy scenario, 2 ms apart")
+    run_parser.add_argument("--analytics-rows", dest="analytics_rows", default="100000,1000000", help="messages across 100 histories for the analytics queries")
+    run_parser.add_argument("--inbox-peers", dest="inbox_peers", default="100,1000", help="peers with 100 messages each for the unified inbox")
+    run_parser.add_argument("--backup-messages", dest="backup_messages", default="10000,100000", help="messages across 10 histories pushed to and restored from 3 friends")
+    run_parser.add_argument("--archive-messages", dest="archive_messages", default="100000,1000000", help="messages across 10 histories kept as JSON and then archived")
+    run_parser.add_argument("--attachment-sizes", dest="attachment_sizes", default="1_048_576,16_777_216,268_435_456", help="file sizes in bytes sent as attachments over loopback (4_294_967_296 needs about 8 GB free)")
+    run_parser.add_argument("--attachment-dir", dest="attachment_dir", default=None, help="directory for the attachment files, default is the system temp directory")
+    run_parser.add_argument("--metrics-messages", dest="metrics_messages", default="10000", help="messages sent and received through one Client with stage tracing off and on")
+    run_parser.add_argument("--out", default="benchmark_results.json")
+
+    compare_parser = sub.add_parser("compare", help="flag regressions against a stored baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown as a fraction")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        return run(args)
+    return run_compare(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+analytics.py
+Per peer volume, hourly activity, and size distribution over every history: deserializing each message (what it took
+before HistoryColumns) against grouped queries over the columns, vectorized with numpy and in the plain loop fallback
+"""
+
+import tempfile
+from datetime import datetime, timedelta
+
+import columns
+from hash_table import HashTable
+from identification import Identification
+from message import Message
+
+from benchmarks.common import measure, result
+from benchmarks.micro import HOST
+
+PEERS = 100
+SIZE_EDGES = [16, 64, 256, 1024, 4096]
+
+def fill(table : HashTable, rows : int):
+    """
+    rows texts spread over PEERS histories, a minute apart, with varied lengths
+    """
+    base = datetime(2024, 1, 1)
+    per_peer = rows // PEERS
+    for p in range(PEERS):
+        peer = Identification(f"peer{p}", f"an:{p:04x}", "127.0.0.1", str(6000 + p))
+        history = []
+        for i in range(per_peer):
+            sender, receiver = (HOST, peer) if i % 2 == 0 else (peer, HOST)
+            dt = (base + timedelta(minutes=i * 7 + p)).strftime("%Y-%m-%d %H:%M:%S")
+            history.append(Message(sender, receiver, "x" * (i * 37 % 300), "TEXT_MESSAGE_REQUEST", dt).serialize())
+        table.overwrite_history(peer, history)
+
+def deserialized_by_peer(table : HashTable) -> dict:
+    """
+    the old way: every history read back into Message objects and tallied in python
+    """
+    volume = {}
+    hours = [0] * 24
+    for peer_id, entry in table.peers().items():
+        for message in table.read_history(Identification.from_string(entry["receiver"])):
+            volume[peer_id] = volume.get(peer_id, 0) + len(message.get_content())
+            hours[datetime.strptime(message.get_datetime(), "%Y-%m-%d %H:%M:%S").hour] += 1
+    return volume
+
+def run(sizes : list) -> list:
+    results = []
+    for n in sizes:
+        r = 5 if n < 1_000_000 else 3
+        with tempfile.TemporaryDirectory() as data_dir:
+            table = HashTable(HOST, data_dir)
+            fill(table, n)
+            table.save()
+
+            # reopened, so the columns are the memory mapped files and every history is on disk
+            table = HashTable(HOST, data_dir)
+            results.append(result("analytics.deserialize_by_peer", n, measure(lambda: deserialized_by_peer(table), 1)))
+            col = table.analytics()
+            # numpy when it is installed, then the plain loops HistoryColumns falls back to without it
+            for vectorized in ((True, False) if columns.np is not None else (False,)):
+                col.vectorized = vectorized
+                suffix = "" if vectorized else ".loop"
+                results.append(result(f"analytics.by_peer{suffix}", n, measure(lambda: col.aggregate("peer", "bytes"), r), numpy=vectorized))
+                results.append(result(f"analytics.hourly{suffix}", n, measure(lambda: col.aggregate("hour"), r), numpy=vectorized))
+                results.append(result(f"analytics.daily_buckets{suffix}", n, measure(lambda: col.aggregate("bucket", bucket=86400, inbound=True), r), numpy=vectorized))
+                results.append(result(f"analytics.size_histogram{suffix}", n, measure(lambda: col.size_histogram(SIZE_EDGES), r), numpy=vectorized))
+                results.append(result(f"analytics.by_type{suffix}", n, measure(lambda: col.aggregate("type", types=["TEXT_MESSAGE_REQUEST"]), r), numpy=vectorized))
+
+            # first query after upgrading, every peer rebuilt from its history
+            def stale_table():
+                fresh = HashTable(HOST, data_dir)
+                fresh.stale = set(fresh.manifest)
+                return fresh
+            results.append(result("analytics.rebuild", n, measure(lambda fresh: fresh.analytics(), 1, setup=stale_table)))
+    return results
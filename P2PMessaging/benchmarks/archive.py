@@ -0,0 +1,68 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+archive.py
+History kept whole as JSON against the same history after a Compactor moved all but the hot window into the compressed
+archive: bytes on disk, loading every history (only the hot part once archived, time and peak memory), a save after
+one new message, and a text search over everything
+"""
+
+import os
+import tempfile
+import tracemalloc
+
+from archive import Compactor
+from hash_table import HashTable
+from identification import Identification
+from message import Message
+
+from benchmarks.common import measure, result
+from benchmarks.inbox import fill
+from benchmarks.micro import HOST
+
+PEERS = 10
+HOT = 1000
+
+def disk_bytes(data_dir : str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(data_dir) for name in names)
+
+def read_all(table : HashTable) -> int:
+    return sum(len(table.read_history(Identification.from_string(entry["receiver"]))) for entry in table.peers().values())
+
+def peak_memory(func) -> int:
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def measure_layout(name : str, n : int, data_dir : str) -> list:
+    reopen = lambda: HashTable(HOST, data_dir)
+    table = reopen()
+    peer = Identification.from_string(next(iter(table.peers().values()))["receiver"])
+    extra = {"disk_bytes" : disk_bytes(data_dir), "peak_bytes" : peak_memory(lambda: read_all(reopen())), "hot" : HOT}
+
+    def save_one(fresh):
+        fresh.write_message(Message(HOST, peer, "one more", "TEXT_MESSAGE_REQUEST", "2030-01-01 00:00:00"), False)
+        fresh.save()
+    return [
+        result(f"archive.{name}.read_all", n, measure(read_all, 3, setup=reopen), **extra),
+        result(f"archive.{name}.save_one", n, measure(save_one, 3, setup=reopen)),
+        result(f"archive.{name}.search", n, measure(lambda: table.search_history("message 7 ", limit=50), 3)),
+    ]
+
+def run(sizes : list) -> list:
+    results = []
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as data_dir:
+            table = HashTable(HOST, data_dir)
+            fill(table, PEERS, n // PEERS)
+            table.save()
+            results += measure_layout("json", n, data_dir)
+
+            table = HashTable(HOST, data_dir)
+            summary = Compactor(table, hot_messages=HOT).run()
+            results.append(result("archive.compact", n, {"seconds" : summary["seconds"]}, archived=summary["archived"]))
+            results += measure_layout("archived", n, data_dir)
+    return results
@@ -0,0 +1,63 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+attachment.py
+Attachment transfers over loopback: hashing the file into chunk checksums when it is offered, and the download from
+the side data socket into a part file, for files of 1 MB and up (4 GB needs about 8 GB of free disk)
+"""
+
+import os
+import tempfile
+import time
+
+from attachment import IncomingTransfer, OutgoingTransfer
+
+from benchmarks.common import result
+
+MB = 2 ** 20
+
+def make_file(path : str, size : int):
+    """
+    write a file of random-ish data without holding it in memory
+    """
+    block = os.urandom(MB)
+    with open(path, 'wb') as file:
+        left = size
+        while left > 0:
+            n = min(left, len(block))
+            file.write(block[:n])
+            left -= n
+
+def measure_size(tmp_dir : str, size : int) -> list:
+    src_path = os.path.join(tmp_dir, f"src_{size}")
+    dest_path = os.path.join(tmp_dir, f"dest_{size}")
+    make_file(src_path, size)
+    try:
+        start = time.perf_counter()
+        outgoing = OutgoingTransfer(src_path, "bench")
+        checksum_seconds = time.perf_counter() - start
+        outgoing.start("127.0.0.1")
+        try:
+            incoming = IncomingTransfer(outgoing.get_offer(), "bench", dest_path)
+            start = time.perf_counter()
+            ok = incoming.run("127.0.0.1")
+            transfer_seconds = time.perf_counter() - start
+        finally:
+            outgoing.stop()
+        if not ok:
+            raise RuntimeError(f"Attachment of {size} bytes did not complete")
+    finally:
+        for path in (src_path, dest_path, dest_path + ".part", dest_path + ".part.json"):
+            if os.path.exists(path):
+                os.remove(path)
+    return [
+        result("attachment.checksum", size, {"seconds" : checksum_seconds}, mb_per_s=size / MB / checksum_seconds),
+        result("attachment.transfer", size, {"seconds" : transfer_seconds}, mb_per_s=size / MB / transfer_seconds),
+    ]
+
+def run(sizes : list, tmp_dir : str = None) -> list:
+    results = []
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as data_dir:
+        for size in sizes:
+            results += measure_size(data_dir, size)
+    return results
@@ -0,0 +1,79 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+backup.py
+Encrypted history backups on loopback friends: the first full push, the push after one new message (only the last
+segment and the index move), and a restore into an empty client with one friend offline
+"""
+
+import tempfile
+import time
+
+from client import Client
+from identification import Identification
+from message import Message
+
+from benchmarks.common import result
+from benchmarks.e2e import free_port, shutdown, wait_for
+
+FRIENDS = 3
+PEERS = 10
+
+def make_client(name : str, data_dir : str, **options) -> Client:
+    client = Client(Identification(name, f"backup-{name}", "127.0.0.1", str(free_port())), data_dir, **options)
+    client.start_listening()
+    return client
+
+def connect_all(owner : Client, friends : list):
+    for friend in friends:
+        owner.start_conn(friend.binding)
+    wait_for(lambda: len(owner.connections) == len(friends) and all(friend.connections for friend in friends))
+
+def fill(client : Client, messages : int):
+    per_peer = messages // PEERS
+    for p in range(PEERS):
+        peer = Identification(f"peer{p}", f"backup-peer{p}", "127.0.0.1", str(7000 + p))
+        client.hash_table.overwrite_history(peer, [
+            Message(client.identification, peer, f"message {i} " + "x" * (i % 200), "TEXT_MESSAGE_REQUEST",
+                    f"2024-01-{1 + i // 86400 % 28:02d} {i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}").serialize()
+            for i in range(per_peer)
+        ])
+
+def confirmed(owner : Client) -> int:
+    return sum(len(names) for names in owner.backups.state["held"].values())
+
+def run(sizes : list) -> list:
+    results = []
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as data_dir:
+            friends = [make_client(f"friend{i}", data_dir) for i in range(FRIENDS)]
+            options = {"passphrase" : "benchmark", "friends" : [f.identification.get_id() for f in friends], "interval" : 3600, "rate" : 1e9}
+            owner = make_client("owner", data_dir, backup=options)
+            for friend in friends:
+                friend.friends.add(owner.identification)
+            fill(owner, n)
+            connect_all(owner, friends)
+
+            start = time.perf_counter()
+            sent = owner.backups.push_round()
+            wait_for(lambda: confirmed(owner) >= sent["segments"])
+            results.append(result("backup.push_full", n, {"seconds" : time.perf_counter() - start}, **sent))
+
+            peer = Identification("peer0", "backup-peer0", "127.0.0.1", "7000")
+            owner.hash_table.write_message(Message(owner.identification, peer, "one more", "TEXT_MESSAGE_REQUEST", "2024-02-01 00:00:00"), False)
+            before = confirmed(owner)
+            start = time.perf_counter()
+            sent = owner.backups.push_round()
+            wait_for(lambda: confirmed(owner) >= before) # replaced names do not add to the count
+            results.append(result("backup.push_delta", n, {"seconds" : time.perf_counter() - start}, **sent))
+            owner.stop()
+            friends[-1].stop()
+
+            with tempfile.TemporaryDirectory() as empty_dir:
+                restored = Client(Identification("owner", "backup-owner", "127.0.0.1", str(free_port())), empty_dir, backup=options)
+                restored.start_listening()
+                connect_all(restored, friends[:-1])
+                summary = restored.backups.restore()
+                results.append(result("backup.restore", n, {"seconds" : summary["seconds"]}, **summary))
+                shutdown([restored] + friends[:-1])
+    return results
@@ -0,0 +1,54 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+capture_replay.py
+What capture costs on the receive path, and how fast replay.py pushes a captured text stream back through a Client
+"""
+
+import os
+import tempfile
+import time
+
+from capture import TrafficCapture, INBOUND, read_capture
+from replay import replay
+
+from benchmarks.common import measure, result
+from benchmarks.e2e import make_client, connect, shutdown, wait_for, text_received
+from benchmarks.micro import HOST
+
+def received(n : int, data_dir : str, capture : int) -> tuple:
+    """
+    n texts into a hub with or without capture, seconds until all arrived and the hub
+    """
+    hub = make_client("hub", data_dir, capture=capture)
+    peer = make_client("peer", data_dir)
+    connect(peer, hub)
+    start = time.perf_counter()
+    for i in range(n):
+        peer.send_to(hub.identification, f"captured message {i}")
+    wait_for(lambda: text_received(hub) >= n)
+    elapsed = time.perf_counter() - start
+    return elapsed, hub, peer
+
+def run(sizes : list, capacity : int = 64 * 1024 * 1024) -> list:
+    results = []
+    for n in sizes:
+        frame = b'{"content": "%d"}' % n * 8
+        ring = TrafficCapture(HOST, capacity=len(frame) * n // 2) # half of them fall off the ring
+        results.append(result("capture.record", n, measure(lambda: [ring.record(None, INBOUND, frame) for _ in range(n)], 3)))
+
+        with tempfile.TemporaryDirectory() as data_dir:
+            elapsed, hub, peer = received(n, data_dir, 0)
+            shutdown([hub, peer])
+            results.append(result("capture.receive_off", n, {"seconds" : elapsed}))
+
+        with tempfile.TemporaryDirectory() as data_dir:
+            elapsed, hub, peer = received(n, data_dir, capacity)
+            fp = hub.save_capture(f"{data_dir}/bench.p2pcap")
+            shutdown([hub, peer])
+            results.append(result("capture.receive_on", n, {"seconds" : elapsed}, capture_bytes=os.path.getsize(fp)))
+            frames = len(read_capture(fp)[1])
+            with tempfile.TemporaryDirectory() as replay_dir:
+                summary = replay(fp, replay_dir, speed=0)
+            results.append(result("replay.fastest", n, {"seconds" : summary["seconds"]}, frames=summary["frames"], captured_frames=frames, frames_per_s=summary["frames_per_s"]))
+    return results
@@ -0,0 +1,87 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+common.py
+Timing helpers, environment metadata, and result file handling shared by the benchmark suites
+"""
+
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+def environment() -> dict:
+    """
+    what the numbers were measured on
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, timeout=5).stdout.strip()
+    except Exception:
+        commit = ""
+    return {
+        "python" : sys.version.split()[0],
+        "implementation" : platform.python_implementation(),
+        "platform" : platform.platform(),
+        "machine" : platform.machine(),
+        "cpu_count" : os.cpu_count(),
+        "hostname" : socket.gethostname(),
+        "commit" : commit,
+        "timestamp" : time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+def measure(func, repeat : int = 5, setup = None) -> dict:
+    """
+    run func repeat times, setup (if given) runs before each and its result is passed in, untimed
+    """
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        func(arg) if setup else func()
+        times.append(time.perf_counter() - start)
+    return {
+        "seconds" : min(times),
+        "median" : statistics.median(times),
+        "repeat" : repeat,
+    }
+
+def result(name : str, n : int, timing : dict, **extra) -> dict:
+    entry = {"name" : name, "n" : n}
+    entry.update(timing)
+    if timing.get("seconds"):
+        entry["per_op_us"] = timing["seconds"] / max(n, 1) * 1e6
+    entry.update(extra)
+    return entry
+
+def write_results(path : str, results : list):
+    with open(path, 'w') as file:
+        json.dump({"environment" : environment(), "results" : results}, file, indent=2)
+
+def load_results(path : str) -> dict:
+    with open(path, 'r') as file:
+        return json.load(file)
+
+def compare(baseline : dict, current : dict, threshold : float = 0.10) -> list:
+    """
+    every benchmark whose best time got worse than baseline by more than threshold (fraction)
+    """
+    base = {(entry["name"], entry["n"]) : entry for entry in baseline["results"]}
+    rows = []
+    for entry in current["results"]:
+        old = base.get((entry["name"], entry["n"]))
+        if not old or not old.get("seconds") or entry.get("seconds") is None:
+            continue
+        change = entry["seconds"] / old["seconds"] - 1
+        rows.append({
+            "name" : entry["name"],
+            "n" : entry["n"],
+            "baseline" : old["seconds"],
+            "current" : entry["seconds"],
+            "change" : change,
+            "regression" : change > threshold,
+        })
+    return rows
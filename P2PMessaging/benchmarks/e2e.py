@@ -0,0 +1,155 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+e2e.py
+End to end scenarios with real Client instances on 127.0.0.1: handshake latency, shutdown time, message throughput, and
+history sync time
+"""
+
+import socket
+import tempfile
+import threading
+import time
+
+from client import Client
+from admission import AdmissionPolicy
+from identification import Identification
+from hash_table import HashTable
+
+from benchmarks.common import result
+from benchmarks.micro import make_messages
+
+WAIT_TIMEOUT = 60
+
+def free_port() -> int:
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+def make_client(name : str, data_dir : str, **options) -> Client:
+    identification = Identification(name, f"bench-{name}", "127.0.0.1", str(free_port()))
+    client = Client(identification, data_dir, **options)
+    client.start_listening()
+    return client
+
+def shutdown(clients : list):
+    """
+    stop clients in parallel
+    """
+    threads = [threading.Thread(target=client.stop) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def wait_for(predicate, timeout : float = WAIT_TIMEOUT) -> bool:
+    end = time.perf_counter() + timeout
+    while time.perf_counter() < end:
+        if predicate():
+            return True
+        time.sleep(0.0005)
+    return False
+
+def loopback_admission(peers : int) -> AdmissionPolicy:
+    """
+    every dial in a benchmark comes from 127.0.0.1, so one source ip has to be allowed `peers` connections at once
+    """
+    return AdmissionPolicy(max_connections=2 * peers + 16, max_handshakes=peers + 16, burst=peers + 16)
+
+def connect(a : Client, b : Client) -> float:
+    """
+    dial b from a, seconds until both sides finished handshake and history sync
+    """
+    before_a = a.metrics.snapshot()["history_sync_seconds"]["count"]
+    before_b = b.metrics.snapshot()["history_sync_seconds"]["count"]
+    start = time.perf_counter()
+    a.start_conn(b.binding)
+    if not wait_for(lambda: a.metrics.snapshot()["history_sync_seconds"]["count"] > before_a
+                    and b.metrics.snapshot()["history_sync_seconds"]["count"] > before_b):
+        raise RuntimeError(f"{a.identification.get_id()} never finished connecting to {b.identification.get_id()}")
+    return time.perf_counter() - start
+
+def text_received(client : Client) -> int:
+    traffic = client.received_traffic.children.get(("TEXT_MESSAGE_REQUEST",))
+    return traffic.messages if traffic else 0
+
+def handshake(peers : int) -> dict:
+    """
+    one hub, `peers` clients dial it one after another
+    """
+    with tempfile.TemporaryDirectory() as data_dir:
+        hub = make_client("hub", data_dir, admission=loopback_admission(peers))
+        clients = [make_client(f"peer{i}", data_dir) for i in range(peers)]
+        times = [connect(client, hub) for client in clients]
+        shutdown([hub] + clients)
+    times.sort()
+    return result("e2e.handshake", peers, {
+        "seconds" : sum(times) / len(times),
+        "p50" : times[len(times) // 2],
+        "max" : times[-1],
+    })
+
+def throughput(n : int) -> dict:
+    """
+    n text messages from one client to another over one connection
+    """
+    with tempfile.TemporaryDirectory() as data_dir:
+        a = make_client("sender", data_dir)
+        b = make_client("receiver", data_dir)
+        connect(a, b)
+        start = time.perf_counter()
+        for i in range(n):
+            a.send_to(b.identification, f"throughput message {i}")
+        delivered = wait_for(lambda: text_received(b) >= n)
+        elapsed = time.perf_counter() - start
+        shutdown([a, b])
+    return result("e2e.throughput", n, {"seconds" : elapsed}, messages_per_s=n / elapsed, complete=delivered)
+
+def history_sync(n : int) -> dict:
+    """
+    receiver already has n messages with the sender, sender has none and requests them on connect
+    """
+    with tempfile.TemporaryDirectory() as data_dir:
+        a = make_client("syncer", data_dir)
+        b = make_client("holder", data_dir)
+        history = make_messages(n)
+        for msg in history:
+            msg.sender, msg.receiver = (b.identification, a.identification) if msg.sender.get_name() == "bench_host" else (a.identification, b.identification)
+        b.hash_table.overwrite_history(a.identification, history)
+        connect(a, b)
+        sync = a.metrics.snapshot()["history_sync_seconds"]
+        synced = len(a.hash_table.read_history(b.identification))
+        shutdown([a, b])
+    return result("e2e.history_sync", n, {"seconds" : sync["max"]}, synced_messages=synced)
+
+def stop_hub(peers : int, churned : int = 50) -> dict:
+    """
+    hub with `peers` live connections, after `churned` earlier ones came and went, time for hub.stop() alone and
+    how many histories it left on disk
+    """
+    with tempfile.TemporaryDirectory() as data_dir:
+        hub = make_client("hub", data_dir, admission=loopback_admission(churned + peers))
+        for i in range(churned):
+            gone = make_client(f"gone{i}", data_dir)
+            connect(gone, hub)
+            gone.stop()
+        clients = [make_client(f"peer{i}", data_dir) for i in range(peers)]
+        for client in clients:
+            connect(client, hub)
+            client.send_to(hub.identification, "last words")
+        wait_for(lambda: text_received(hub) >= peers)
+        start = time.perf_counter()
+        hub.stop()
+        elapsed = time.perf_counter() - start
+        saved = len(HashTable(hub.identification, data_dir).peers())
+        shutdown(clients)
+    return result("e2e.shutdown", peers, {"seconds" : elapsed}, churned=churned, saved_histories=saved)
+
+def run(sizes : list, peers : int = 20) -> list:
+    results = [handshake(peers), stop_hub(peers)]
+    for n in sizes:
+        results.append(throughput(n))
+        results.append(history_sync(n))
+    return results
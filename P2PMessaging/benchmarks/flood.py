@@ -0,0 +1,92 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+flood.py
+Loopback connection flood against one client: how much a peer that is already connected notices while other processes hammer the listener
+"""
+
+import multiprocessing
+import socket
+import tempfile
+import time
+
+from benchmarks.e2e import make_client, connect, shutdown, wait_for, text_received
+
+def flooder(target : tuple, seconds : float, hold : int, counts):
+    """
+    open connections as fast as possible, keep up to `hold` of them open and silent (slowloris), close the oldest
+    """
+    held = []
+    attempts = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(1)
+        attempts += 1
+        try:
+            sock.connect(target)
+            held.append(sock)
+        except OSError:
+            sock.close()
+        if len(held) > hold:
+            held.pop(0).close()
+    for sock in held:
+        sock.close()
+    with counts.get_lock():
+        counts.value += attempts
+
+def latencies(sender, receiver, n : int) -> list:
+    """
+    one message at a time, seconds until the receiver has it
+    """
+    times = []
+    for i in range(n):
+        before = text_received(receiver)
+        start = time.perf_counter()
+        sender.send_to(receiver.identification, f"latency probe {i}")
+        wait_for(lambda: text_received(receiver) > before, timeout=10)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times
+
+def flood(seconds : float = 5.0, flooders : int = 4, hold : int = 200, probes : int = 50) -> list:
+    context = multiprocessing.get_context("fork")
+    with tempfile.TemporaryDirectory() as data_dir:
+        hub = make_client("hub", data_dir)
+        peer = make_client("peer", data_dir)
+        connect(peer, hub)
+        baseline = latencies(peer, hub, probes)
+
+        counts = context.Value("l", 0)
+        procs = [context.Process(target=flooder, args=(hub.binding, seconds, hold, counts)) for _ in range(flooders)]
+        for proc in procs:
+            proc.start()
+        time.sleep(min(1.0, seconds / 4)) # let the flood build up
+        max_threads = 0
+        under = []
+        end = time.perf_counter() + seconds * 0.6
+        while time.perf_counter() < end and len(under) < probes:
+            under += latencies(peer, hub, 1)
+            max_threads = max(max_threads, len([t for t in hub.threads if t.is_alive()]))
+        under.sort()
+        for proc in procs:
+            proc.join()
+        shed = hub.metrics.snapshot()["connections_shed"]
+        shutdown([hub, peer])
+
+    def entry(name, times, **extra):
+        return {
+            "name" : name,
+            "n" : len(times),
+            "seconds" : times[len(times) // 2],
+            "p99" : times[min(int(len(times) * 0.99), len(times) - 1)],
+            "per_op_us" : times[len(times) // 2] * 1e6,
+            **extra,
+        }
+    return [
+        entry("flood.latency_idle", baseline),
+        entry("flood.latency_under_flood", under, connect_attempts=counts.value, shed=shed, max_live_threads=max_threads),
+    ]
+
+def run(seconds : float = 5.0, flooders : int = 4) -> list:
+    return flood(seconds, flooders)
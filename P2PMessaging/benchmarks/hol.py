@@ -0,0 +1,69 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+hol.py
+Head of line blocking: text message latency on a connection that is busy streaming bulk frames, chunked on streams vs sent whole
+"""
+
+import tempfile
+import threading
+
+from message import Message
+from streams import CHUNK_SIZE
+from client import STREAM_PRIORITIES
+
+from benchmarks.e2e import make_client, connect, shutdown
+from benchmarks.flood import latencies
+
+UNCHUNKED = 1 << 31 # bigger than any frame, every frame goes out as one chunk like before streams
+
+def behind_bulk(sender, receiver, chunk_size : int, bulk_bytes : int, probes : int) -> list:
+    """
+    keep HISTORY_RESPONSE frames of bulk_bytes flowing from sender while probing text latency
+    the frame is encoded once so the pump measures the connection, not json on a shared GIL
+    """
+    conn = sender.get_conn(receiver.identification.get_id())
+    conn.streams.chunk_size = chunk_size
+    bulk = Message(sender.identification, receiver.identification, "x" * bulk_bytes, "HISTORY_RESPONSE").prepare_send()
+    stop = threading.Event()
+
+    def pump():
+        while not stop.is_set():
+            conn.streams.send(bulk, STREAM_PRIORITIES["bulk"], 1)
+
+    pump_thread = threading.Thread(target=pump, daemon=True)
+    pump_thread.start()
+    try:
+        return latencies(sender, receiver, probes)
+    finally:
+        stop.set()
+        pump_thread.join()
+        conn.streams.chunk_size = CHUNK_SIZE
+
+def hol(bulk_bytes : int = 8 * 1024 * 1024, probes : int = 30) -> list:
+    with tempfile.TemporaryDirectory() as data_dir:
+        hub = make_client("hub", data_dir)
+        peer = make_client("peer", data_dir)
+        connect(peer, hub)
+        idle = latencies(peer, hub, probes)
+        chunked = behind_bulk(peer, hub, CHUNK_SIZE, bulk_bytes, probes)
+        unchunked = behind_bulk(peer, hub, UNCHUNKED, bulk_bytes, probes)
+        shutdown([hub, peer])
+
+    def entry(name, times):
+        return {
+            "name" : name,
+            "n" : len(times),
+            "seconds" : times[len(times) // 2],
+            "p99" : times[min(int(len(times) * 0.99), len(times) - 1)],
+            "per_op_us" : times[len(times) // 2] * 1e6,
+            "bulk_bytes" : bulk_bytes,
+        }
+    return [
+        entry("hol.latency_idle", idle),
+        entry("hol.latency_behind_bulk", chunked),
+        entry("hol.latency_behind_bulk_unchunked", unchunked),
+    ]
+
+def run(bulk_bytes : int = 8 * 1024 * 1024) -> list:
+    return hol(bulk_bytes)
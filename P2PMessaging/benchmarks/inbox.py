@@ -0,0 +1,63 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+inbox.py
+Newest messages across every peer: HashTable.inbox (k-way merge from the ends of the histories) against reading every
+history and sorting them together
+"""
+
+import tempfile
+from datetime import datetime, timedelta
+
+from hash_table import HashTable
+from identification import Identification
+from message import Message
+
+from benchmarks.common import measure, result
+from benchmarks.micro import HOST
+
+PAGE = 50
+
+def fill(table : HashTable, peers : int, per_peer : int):
+    """
+    per_peer texts with each of peers peers, interleaved in time so every page draws from many of them
+    """
+    base = datetime(2024, 1, 1)
+    for p in range(peers):
+        peer = Identification(f"peer{p}", f"ib:{p:05x}", "127.0.0.1", str(7000 + p))
+        history = [
+            Message(HOST, peer, f"message {i} with {p}", "TEXT_MESSAGE_REQUEST", (base + timedelta(seconds=i * peers + p)).strftime("%Y-%m-%d %H:%M:%S")).serialize()
+            for i in range(per_peer)
+        ]
+        table.overwrite_history(peer, history)
+
+def read_and_sort(table : HashTable) -> list:
+    everything = []
+    for entry in table.peers().values():
+        everything += table.read_history(Identification.from_string(entry["receiver"]))
+    everything.sort(key=lambda message: message.get_datetime(), reverse=True)
+    return everything[:PAGE]
+
+def run(peer_counts : list, per_peer : int = 100) -> list:
+    results = []
+    for peers in peer_counts:
+        with tempfile.TemporaryDirectory() as data_dir:
+            table = HashTable(HOST, data_dir)
+            fill(table, peers, per_peer)
+            table.save()
+
+            def reopen():
+                return HashTable(HOST, data_dir)
+            extra = {"per_peer" : per_peer, "page" : PAGE}
+            results.append(result("inbox.read_and_sort", peers, measure(read_and_sort, 3, setup=reopen), **extra))
+            loaded = []
+
+            def first_page(fresh):
+                fresh.inbox(PAGE)
+                loaded.append(len(fresh.table["histories"]))
+            results.append(result("inbox.first_page_cold", peers, measure(first_page, 3, setup=reopen), histories_read=loaded[-1], **extra))
+            table = reopen()
+            _, cursor = table.inbox(PAGE)
+            results.append(result("inbox.first_page_warm", peers, measure(lambda: table.inbox(PAGE), 5), **extra))
+            results.append(result("inbox.next_page", peers, measure(lambda: table.inbox(PAGE, cursor), 5), **extra))
+    return results
@@ -0,0 +1,136 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+lossy.py
+Text latency under packet loss on loopback, stream path vs datagram path
+
+loopback never drops anything, so loss is injected: the datagram path drops packets itself (DatagramChannel.loss) and
+the stream path goes through LossyProxy, which holds a lost chunk and everything behind it for one TCP retransmit
+timeout, the way a real TCP stream stalls behind a lost segment
+"""
+
+import random
+import socket
+import tempfile
+import threading
+import time
+
+from client import Client
+from identification import Identification
+
+from benchmarks.e2e import free_port, shutdown, wait_for
+
+TCP_RTO = 0.2 # Linux minimum retransmit timeout, what a lost tail segment costs an interactive stream
+
+class LossyProxy:
+    """
+    TCP relay that makes a share of chunks late by rto, in order, in both directions
+    """
+
+    def __init__(self, target : tuple, loss : float, rto : float = TCP_RTO, seed : int = 1):
+        self.target = target
+        self.loss = loss
+        self.rto = rto
+        self.rng = random.Random(seed)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(8)
+        self.binding = self.sock.getsockname()
+        self.sockets = []
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+
+    def accept_loop(self):
+        while True:
+            try:
+                inbound, _ = self.sock.accept()
+            except OSError:
+                return
+            outbound = socket.create_connection(self.target)
+            for sock in (inbound, outbound):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.sockets += [inbound, outbound]
+            threading.Thread(target=self.pump, args=(inbound, outbound), daemon=True).start()
+            threading.Thread(target=self.pump, args=(outbound, inbound), daemon=True).start()
+
+    def pump(self, src : socket.socket, dst : socket.socket):
+        release = 0.0
+        try:
+            while True:
+                data = src.recv(1460)
+                if not data:
+                    break
+                if self.rng.random() < self.loss:
+                    release = max(release, time.perf_counter() + self.rto)
+                wait = release - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+                dst.sendall(data)
+        except OSError:
+            pass
+        for sock in (src, dst):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def close(self):
+        self.sock.close()
+        for sock in self.sockets:
+            sock.close()
+
+def stream_latencies(sender : Client, receiver : Client, count : int, interval : float) -> list:
+    """
+    send count texts interval apart without waiting for each, seconds from send to arrival for each one
+    """
+    arrived = {}
+
+    def on_event(event, **data):
+        if event == "message" and data["message"].type == "TEXT_MESSAGE_REQUEST":
+            arrived[data["message"].get_content()] = time.perf_counter()
+
+    receiver.subscribe(on_event)
+    sent = {}
+    for i in range(count):
+        content = f"probe {i}"
+        sent[content] = time.perf_counter()
+        sender.send_to(receiver.identification, content)
+        time.sleep(interval)
+    wait_for(lambda: len(arrived) >= count, timeout=30)
+    receiver.unsubscribe(on_event)
+    return sorted(arrived[content] - sent[content] for content in sent if content in arrived)
+
+def make_client(name : str, data_dir : str, datagrams : bool) -> Client:
+    identification = Identification(name, f"lossy-{name}", "127.0.0.1", str(free_port()))
+    client = Client(identification, data_dir, datagrams=datagrams)
+    client.start_listening()
+    return client
+
+def scenario(datagrams : bool, loss : float, count : int, interval : float, rto : float) -> list:
+    with tempfile.TemporaryDirectory() as data_dir:
+        hub = make_client("hub", data_dir, datagrams)
+        peer = make_client("peer", data_dir, datagrams)
+        proxy = LossyProxy(hub.binding, 0.0 if datagrams else loss, rto)
+        peer.start_conn(proxy.binding)
+        wait_for(lambda: all(client.metrics.snapshot()["history_sync_seconds"]["count"] for client in (hub, peer)))
+        if datagrams:
+            hub.datagrams.loss = peer.datagrams.loss = loss
+        times = stream_latencies(peer, hub, count, interval)
+        shutdown([hub, peer])
+        proxy.close()
+    return times
+
+def run(loss : float = 0.02, count : int = 500, interval : float = 0.002, rto : float = TCP_RTO) -> list:
+    results = []
+    for name, datagrams in (("lossy.stream", False), ("lossy.datagram", True)):
+        times = scenario(datagrams, loss, count, interval, rto)
+        results.append({
+            "name" : name,
+            "n" : len(times),
+            "seconds" : times[len(times) // 2],
+            "p99" : times[min(int(len(times) * 0.99), len(times) - 1)],
+            "max" : times[-1],
+            "per_op_us" : times[len(times) // 2] * 1e6,
+            "loss" : loss,
+            "sent" : count,
+        })
+    return results
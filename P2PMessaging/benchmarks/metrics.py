@@ -0,0 +1,103 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+metrics.py
+What instrumentation costs per message: the whole send_message / accept_message path of a Client (encode, write,
+traffic accounting, the profiler.call layers, storing) with stage tracing off and on, next to the traffic record and
+histogram observe it is built from on their own
+"""
+
+import itertools
+import socket
+import tempfile
+import threading
+
+from client import Client
+from live_connection import LiveConnection
+from message import Message
+from metrics import MetricsRegistry
+from profiling import Profiler
+
+from benchmarks.common import measure, result
+from benchmarks.micro import HOST, PEER
+
+def drain(sock : socket.socket):
+    """
+    read and drop everything until the other end closes, so sends never block on a full buffer
+    """
+    while sock.recv(1 << 16):
+        pass
+
+ROUNDS = itertools.count() # every measured round gets new contents, so no key is seen twice on the conn
+
+def outgoing(n : int) -> list:
+    batch = next(ROUNDS)
+    return [Message(HOST, PEER, f"metrics message {batch}.{i}", "TEXT_MESSAGE_REQUEST", "2024-01-01 00:00:00") for i in range(n)]
+
+def incoming(n : int) -> list:
+    batch = next(ROUNDS)
+    return [Message(PEER, HOST, f"metrics message {batch}.{i}", "TEXT_MESSAGE_REQUEST", "2024-01-01 00:00:00").prepare_send() for i in range(n)]
+
+def measure_path(n : int, tracing : bool) -> list:
+    suffix = ".traced" if tracing else ""
+    with tempfile.TemporaryDirectory() as data_dir:
+        client = Client(HOST, data_dir)
+        client.profiler.set_tracing(tracing)
+        writer, reader = socket.socketpair()
+        conn = LiveConnection(HOST, PEER, writer)
+        thread = threading.Thread(target=drain, args=(reader,), daemon=True)
+        thread.start()
+        try:
+            def send_all(messages):
+                for message in messages:
+                    client.send_message(message, writer, conn)
+
+            def accept_all(frames):
+                for frame in frames:
+                    client.accept_message(frame, conn, len(frame))
+            return [
+                result(f"metrics.send_message{suffix}", n, measure(send_all, 3, setup=lambda: outgoing(n))),
+                result(f"metrics.accept_message{suffix}", n, measure(accept_all, 3, setup=lambda: incoming(n))),
+            ]
+        finally:
+            writer.close()
+            thread.join()
+            reader.close()
+            client.stop()
+
+def measure_parts(n : int) -> list:
+    registry = MetricsRegistry()
+    sent = registry.traffic("sent")
+    stage = registry.histogram("stage_seconds", labels=("stage", "type")).labels("encode", "TEXT_MESSAGE_REQUEST")
+    profiler = Profiler(HOST.get_id(), registry, tempfile.gettempdir())
+    noop = lambda: None # what a stage costs on top of its own work
+
+    def record_all():
+        for _ in range(n):
+            sent.record("TEXT_MESSAGE_REQUEST", 120)
+
+    def observe_all():
+        for _ in range(n):
+            stage.observe(0.00001)
+
+    def call_all():
+        for _ in range(n):
+            profiler.call("encode", "TEXT_MESSAGE_REQUEST", noop)
+
+    def loop_all():
+        for _ in range(n):
+            noop()
+    return [
+        result("metrics.empty_loop", n, measure(loop_all, 5)),
+        result("metrics.traffic_record", n, measure(record_all, 5)),
+        result("metrics.histogram_observe", n, measure(observe_all, 5)),
+        result("metrics.profiler_call_off", n, measure(call_all, 5)),
+    ]
+
+def run(sizes : list) -> list:
+    results = []
+    for n in sizes:
+        results += measure_parts(n)
+        for tracing in (False, True):
+            results += measure_path(n, tracing)
+    return results
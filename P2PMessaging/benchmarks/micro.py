@@ -0,0 +1,69 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+micro.py
+Microbenchmarks for Message serialize/deserialize, merge_message_histories, and HashTable operations
+"""
+
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from message import Message
+from identification import Identification
+from hash_table import HashTable
+
+from benchmarks.common import measure, result
+
+HOST = Identification("bench_host", "be:00", "127.0.0.1", "1")
+PEER = Identification("bench_peer", "be:01", "127.0.0.1", "2")
+
+def make_messages(n : int, start : int = 0) -> list:
+    """
+    n text messages alternating direction, one second apart so the history is time ordered
+    """
+    base = datetime(2024, 1, 1)
+    messages = []
+    for i in range(start, start + n):
+        sender, receiver = (HOST, PEER) if i % 2 == 0 else (PEER, HOST)
+        dt = (base + timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S")
+        messages.append(Message(sender, receiver, f"benchmark message number {i}", "TEXT_MESSAGE_REQUEST", dt))
+    return messages
+
+def repeats(n : int) -> int:
+    return 5 if n < 100_000 else 3 if n < 1_000_000 else 1
+
+def run(sizes : list) -> list:
+    results = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        for n in sizes:
+            messages = make_messages(n)
+            serialized = [msg.serialize() for msg in messages]
+            r = repeats(n)
+
+            results.append(result("message.serialize", n, measure(lambda: [msg.serialize() for msg in messages], r)))
+            results.append(result("message.deserialize", n, measure(lambda: [Message.deserialize(text) for text in serialized], r)))
+
+            # two histories overlapping by a fifth, as after a partial sync
+            overlap = n // 5
+            hist_a = messages[: (n + overlap) // 2]
+            hist_b = messages[(n - overlap) // 2 :]
+            results.append(result("message.merge_message_histories", n, measure(lambda: Message.merge_message_histories(hist_a, hist_b), r)))
+
+            def fresh_table():
+                return HashTable(HOST, tempfile.mkdtemp(dir=data_dir))
+
+            def write_all(table):
+                for msg in messages:
+                    table.write_message(msg, msg.get_sender() != HOST)
+            results.append(result("hash_table.write_message", n, measure(write_all, r, setup=fresh_table)))
+
+            full_table = fresh_table()
+            write_all(full_table)
+            results.append(result("hash_table.read_history", n, measure(lambda: full_table.read_history(PEER), r)))
+            results.append(result("hash_table.save", n, measure(lambda _: full_table.save(), r, setup=lambda: full_table.dirty.add(PEER.get_id()))))
+            # startup only reads the manifest, the history is read on first touch
+            table_dir = os.path.dirname(full_table.dir)
+            results.append(result("hash_table.open", n, measure(lambda: HashTable(HOST, table_dir), r)))
+            results.append(result("hash_table.first_read", n, measure(lambda table: table.read_history(PEER), r, setup=lambda: HashTable(HOST, table_dir))))
+    return results
@@ -0,0 +1,99 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+restart.py
+Restarting a daemon under traffic with --handoff / --takeover: how long a peer's texts wait for their acks while the
+new process takes over, and whether the peer had to reconnect
+
+a cold restart on the same port is not measured, the old listening socket's connections sit in TIME_WAIT and the new
+process cannot bind for up to a minute
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from control import ControlClient
+from handoff import handoff_path
+
+from benchmarks import SRC_DIR
+from benchmarks.e2e import free_port, make_client, shutdown, wait_for
+
+def launch(data_dir : str, port : int, *flags) -> subprocess.Popen:
+    command = [sys.executable, "daemon.py", "--name", "restart", "--id", "restart-hub", "--ip", "127.0.0.1",
+               "--port", str(port), "--data-dir", data_dir, "--handoff", *flags]
+    return subprocess.Popen(command, cwd=SRC_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def run(interval : float = 0.005, before : float = 1.0, after : float = 2.0) -> list:
+    with tempfile.TemporaryDirectory() as data_dir:
+        port = free_port()
+        old = launch(data_dir, port)
+        wait_for(lambda: os.path.exists(handoff_path(data_dir, "restart-hub")), timeout=10)
+        peer = make_client("restart-peer", data_dir)
+
+        sent = {} # key -> when send_to was called
+        sending = {} # content -> when send_to was called, the key is only known once the sent event fires
+        acked = {}
+        connects = []
+        def on_event(event, **data):
+            if event == "sent":
+                sent[data["message"].get_key()] = sending.pop(data["message"].get_content())
+            elif event == "connected":
+                connects.append(time.perf_counter())
+        peer.subscribe(on_event)
+        def timed_ack(msg, conn):
+            now = time.perf_counter()
+            for key in msg.get_content():
+                acked.setdefault(key, now)
+            peer.ack_handler(msg, conn)
+        peer.register_handler("ACK", timed_ack)
+
+        peer.start_conn(("127.0.0.1", port))
+        wait_for(lambda: connects, timeout=10)
+        hub = peer.connections[0].get_receiver()
+
+        running = threading.Event()
+        running.set()
+        def send_loop():
+            i = 0
+            while running.is_set():
+                content = f"restart {i}"
+                sending[content] = time.perf_counter()
+                peer.send_to(hub, content)
+                i += 1
+                time.sleep(interval)
+        sender = threading.Thread(target=send_loop)
+        sender.start()
+
+        time.sleep(before)
+        steady = len(sent)
+        started = time.perf_counter()
+        new = launch(data_dir, port, "--takeover")
+        old.wait(timeout=30)
+        took_over = time.perf_counter() - started
+        time.sleep(after)
+        running.clear()
+        sender.join()
+        wait_for(lambda: len(acked) >= len(sent), timeout=10)
+
+        waits = {key : acked[key] - at for key, at in sent.items() if key in acked}
+        steady_waits = sorted(wait for key, wait in waits.items() if sent[key] < started)
+        restart_waits = sorted(wait for key, wait in waits.items() if sent[key] >= started)
+        ControlClient(f"{data_dir}/restart-hub.sock").call("shutdown")
+        new.wait(timeout=30)
+        shutdown([peer])
+
+    return [{
+        "name" : "restart.handoff",
+        "n" : len(sent),
+        "seconds" : restart_waits[-1] if restart_waits else 0.0,
+        "steady_p50" : steady_waits[len(steady_waits) // 2] if steady_waits else 0.0,
+        "restart_p50" : restart_waits[len(restart_waits) // 2] if restart_waits else 0.0,
+        "takeover_seconds" : took_over,
+        "sent_before" : steady,
+        "acked" : len(waits),
+        "reconnects" : len(connects) - 1,
+    }]
@@ -0,0 +1,97 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+shards.py
+Scaling scenario for the sharded listener: load processes hold hundreds of peer connections to one ShardSupervisor and flood it with text messages
+"""
+
+import multiprocessing
+import os
+import tempfile
+import time
+
+from client import Client
+from identification import Identification
+from shard import ShardSupervisor
+
+from benchmarks.e2e import free_port, loopback_admission, shutdown, wait_for, WAIT_TIMEOUT
+
+def text_total(stats : list) -> int:
+    """
+    text messages received across every shard
+    """
+    return sum(shard["received"].get("TEXT_MESSAGE_REQUEST", {}).get("messages", 0) for shard in stats)
+
+def load_process(index : int, peers : int, messages : int, hub : tuple, data_dir : str, ready, go):
+    """
+    one load generator: dial the hub `peers` times, wait for the go signal, then send
+    """
+    hub_id = Identification.from_string(hub)
+    clients = []
+    for i in range(peers):
+        identification = Identification(f"load{index}_{i}", f"load-{index}-{i}", "127.0.0.1", "0")
+        client = Client(identification, data_dir, bind=False)
+        client.start_conn((hub_id.get_ip(), int(hub_id.get_port())))
+        clients.append(client)
+    if not wait_for(lambda: all(client.connections for client in clients)):
+        ready.abort() # the parent fails now instead of timing a partial run
+        raise RuntimeError(f"load generator {index} connected {sum(1 for c in clients if c.connections)} of {peers}")
+    ready.wait()
+    go.wait()
+    for m in range(messages):
+        for client in clients:
+            client.send_to(hub_id, f"load message {m}")
+    go.wait() # parent says everything arrived
+    shutdown(clients)
+
+def scaling(shards : int, peers : int, messages : int, generators : int) -> dict:
+    """
+    messages/s into one supervisor with `shards` workers from `peers` connections
+    """
+    context = multiprocessing.get_context("fork")
+    with tempfile.TemporaryDirectory() as data_dir:
+        hub = Identification("hub", "bench-hub", "127.0.0.1", str(free_port()))
+        supervisor = ShardSupervisor(hub, data_dir, shards, admission=loopback_admission(peers))
+        supervisor.start()
+
+        ready = context.Barrier(generators + 1)
+        go = context.Barrier(generators + 1)
+        per_generator = max(peers // generators, 1)
+        load_dir = os.path.join(data_dir, "load")
+        os.makedirs(load_dir)
+        procs = [
+            context.Process(target=load_process, args=(g, per_generator, messages, hub.to_string(), load_dir, ready, go))
+            for g in range(generators)
+        ]
+        for proc in procs:
+            proc.start()
+        ready.wait(timeout=WAIT_TIMEOUT)
+        expected = per_generator * generators * messages
+        start = time.perf_counter()
+        go.wait()
+        delivered = False
+        end = start + WAIT_TIMEOUT
+        while time.perf_counter() < end:
+            # stats is a round trip to every shard, so poll it gently
+            if text_total(supervisor.stats()) >= expected:
+                delivered = True
+                break
+            time.sleep(0.02)
+        elapsed = time.perf_counter() - start
+        go.wait()
+        for proc in procs:
+            proc.join(timeout=WAIT_TIMEOUT)
+        supervisor.stop()
+    return {
+        "name" : f"shards.scaling.{shards}",
+        "n" : expected,
+        "seconds" : elapsed,
+        "per_op_us" : elapsed / max(expected, 1) * 1e6,
+        "messages_per_s" : expected / elapsed,
+        "shards" : shards,
+        "peers" : per_generator * generators,
+        "complete" : delivered,
+    }
+
+def run(shard_counts : list, peers : int = 200, messages : int = 20, generators : int = 4) -> list:
+    return [scaling(shards, peers, messages, generators) for shards in shard_counts]
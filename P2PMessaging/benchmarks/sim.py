@@ -0,0 +1,95 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+sim.py
+Thousands of Clients in one process on a SimNetwork: handshake and history sync over a ring, then one text per link,
+reported in virtual seconds (what the network would take) next to the real seconds the simulation took
+"""
+
+import hashlib
+import tempfile
+import threading
+import time
+
+from client import Client
+from identification import Identification
+from simnet import SimNetwork
+
+from benchmarks.common import result
+
+PORT = 5000
+STACK_SIZE = 1024 * 1024 # every connection is two threads, keep their reserved stacks small
+
+def node_ip(index : int) -> str:
+    return f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}"
+
+def synced(client : Client) -> int:
+    return client.sync_duration.children[()].count
+
+def simulate(nodes : int, latency : float, loss : float, seed : int) -> dict:
+    """
+    node i dials node i+1, wait until every handshake and sync is done, then every node texts the node it dialed
+    """
+    previous_stack = threading.stack_size(STACK_SIZE)
+    net = SimNetwork(latency=latency, loss=loss, jitter=latency / 10, seed=seed)
+    with tempfile.TemporaryDirectory() as data_dir:
+        start = time.perf_counter()
+        ids = [Identification(f"n{i}", f"sim-{i}", node_ip(i), str(PORT)) for i in range(nodes)]
+        clients = [Client(ids[i], data_dir, transport=net.transport(node_ip(i))) for i in range(nodes)]
+        for client in clients:
+            client.start_listening()
+        built = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i, client in enumerate(clients):
+            client.start_conn((node_ip((i + 1) % nodes), PORT))
+        net.run(until=lambda: all(synced(client) >= 2 for client in clients), timeout=600)
+        handshake_virtual = net.now()
+        handshake_real = time.perf_counter() - start
+
+        start = time.perf_counter()
+        sent_at = net.now()
+        for i, client in enumerate(clients):
+            client.send_to(ids[(i + 1) % nodes], f"hello from {i}")
+        net.run(until=lambda: all(client.received_traffic.children.get(("TEXT_MESSAGE_REQUEST",)) for client in clients), timeout=600)
+        text_virtual = net.now() - sent_at
+        text_real = time.perf_counter() - start
+
+        stats = net.get_stats()
+        digest = hashlib.sha1(repr((handshake_virtual, text_virtual, stats["bytes"], stats["segments_lost"])).encode()).hexdigest()[:12]
+        net.start() # closing connections needs the clock running
+        for client in clients:
+            client.stop()
+        net.stop()
+    threading.stack_size(previous_stack)
+    return {
+        "built" : built,
+        "handshake_virtual" : handshake_virtual,
+        "handshake_real" : handshake_real,
+        "text_virtual" : text_virtual,
+        "text_real" : text_real,
+        "steps" : stats["steps"],
+        "bytes" : stats["bytes"],
+        "segments_lost" : stats["segments_lost"],
+        "digest" : digest, # same seed and node count, same digest
+    }
+
+def run(sizes : list, latency : float = 0.02, loss : float = 0.01, seed : int = 1) -> list:
+    results = []
+    for nodes in sizes:
+        outcome = simulate(nodes, latency, loss, seed)
+        common = {"latency" : latency, "loss" : loss, "seed" : seed, "digest" : outcome["digest"], "steps" : outcome["steps"]}
+        results.append(result("sim.build", nodes, {"seconds" : outcome["built"]}))
+        results.append(result("sim.handshake_sync", nodes, {
+            "seconds" : outcome["handshake_real"],
+            "virtual_seconds" : outcome["handshake_virtual"],
+            **common,
+        }))
+        results.append(result("sim.text", nodes, {
+            "seconds" : outcome["text_real"],
+            "virtual_seconds" : outcome["text_virtual"],
+            "bytes" : outcome["bytes"],
+            "segments_lost" : outcome["segments_lost"],
+            **common,
+        }))
+    return results
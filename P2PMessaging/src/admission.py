@@ -0,0 +1,121 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+admission.py
+AdmissionPolicy and AdmissionControl classes that decide, right after accept() and before anything is read, whether an inbound connection gets a thread
+"""
+
+import socket
+import struct
+import threading
+import time
+
+MAX_BUCKETS = 4096 # per ip buckets kept before idle ones are dropped
+
+class AdmissionPolicy:
+    """
+    limits for inbound connections, every one can be changed on a running client
+    """
+
+    def __init__(
+            self,
+            backlog : int = 128,
+            max_connections : int = 256,
+            max_handshakes : int = 32,
+            rate : float = 5.0,
+            burst : int = 20,
+            handshake_timeout : float = 5.0,
+            accept_backoff : float = 0.05,
+            max_accept_backoff : float = 2.0,
+        ):
+        self.backlog = backlog # kernel accept queue, set when the listening socket is made
+        self.max_connections = max_connections # live connections plus handshakes in flight
+        self.max_handshakes = max_handshakes # accepted sockets that have not finished init_conn
+        self.rate = rate # new connections per second per source ip
+        self.burst = burst # how many a source ip can open at once before rate applies
+        self.handshake_timeout = handshake_timeout # seconds for a peer to finish the begin conversation exchange
+        self.accept_backoff = accept_backoff # first sleep after accept() fails, doubles up to max_accept_backoff
+        self.max_accept_backoff = max_accept_backoff
+
+
+class TokenBucket:
+    """
+    refills at rate tokens per second up to burst, one token per connection
+    """
+
+    __slots__ = ("tokens", "last")
+
+    def __init__(self, burst : int, now : float):
+        self.tokens = float(burst)
+        self.last = now
+
+    def take(self, rate : float, burst : int, now : float) -> bool:
+        self.tokens = min(burst, self.tokens + (now - self.last) * rate)
+        self.last = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class AdmissionControl:
+    """
+    admit() is called on the accepting thread for every new socket, so it only does arithmetic and dict lookups
+    """
+
+    def __init__(self, policy : AdmissionPolicy = None, clock = time.monotonic):
+        self.policy = policy if policy else AdmissionPolicy()
+        self.clock = clock # seconds buckets refill by, a transport's now() so a simulated client runs on virtual time
+        self.buckets = {} # source ip -> TokenBucket
+        self.handshakes = 0
+        self.lock = threading.Lock()
+        self.shed = None # counter family labeled by reason, set by the client
+
+    def admit(self, ip : str, live_connections : int) -> str:
+        """
+        None if the connection may start a handshake (call handshake_done after), otherwise why it was shed
+        """
+        policy = self.policy
+        now = self.clock()
+        with self.lock:
+            if live_connections + self.handshakes >= policy.max_connections:
+                return self._shed("max_connections")
+            if self.handshakes >= policy.max_handshakes:
+                return self._shed("max_handshakes")
+            bucket = self.buckets.get(ip)
+            if bucket is None:
+                if len(self.buckets) >= MAX_BUCKETS:
+                    self._prune(now)
+                bucket = self.buckets[ip] = TokenBucket(policy.burst, now)
+            if not bucket.take(policy.rate, policy.burst, now):
+                return self._shed("rate")
+            self.handshakes += 1
+            return None
+
+    def handshake_done(self):
+        with self.lock:
+            self.handshakes -= 1
+
+    def _shed(self, reason : str) -> str:
+        if self.shed is not None:
+            self.shed.labels(reason).inc()
+        return reason
+
+    def _prune(self, now : float):
+        """
+        drop buckets that have refilled completely, they behave exactly like a new one
+        """
+        policy = self.policy
+        full_after = policy.burst / policy.rate if policy.rate > 0 else float("inf")
+        self.buckets = {ip : b for ip, b in self.buckets.items() if now - b.last < full_after}
+
+    @staticmethod
+    def reject(sock : socket.socket):
+        """
+        close with a RST instead of a FIN, no TIME_WAIT left behind and nothing read from the socket
+        """
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+        except OSError:
+            pass
+        sock.close()
@@ -0,0 +1,396 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+archive.py
+HistoryArchive class, the cold tier under HashTable: messages past the hot window are packed into zlib compressed
+blocks appended to per peer segment files, with an index of every block's time range and message count, so reading a
+range or searching only inflates the blocks it needs. RetentionPolicy and Compactor decide what moves there and how
+much history is kept at all
+
+on disk: <data>/<id>_history/archive/<peer file>.<n>.seg holds blocks back to back, each
+    length (4) | zlib of a JSON list of serialized messages
+and index.json maps peer id -> [[segment n, offset, length, count, first datetime, last datetime], ...] oldest first.
+a segment is closed at SEGMENT_BYTES and the next one started. retention only ever drops whole blocks from the old
+end, a segment file goes away with its last block
+"""
+
+import functools
+import hashlib
+import heapq
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+
+from exception import CustomException
+from logs import get_logger
+
+BLOCK_MESSAGES = 256 # messages per compressed block, a read or search inflates at least this many
+SEGMENT_BYTES = 4 * 1024 * 1024
+BLOCK_LENGTH = struct.Struct("!I")
+HOT_MESSAGES = 1000 # newest messages per peer kept as plain JSON in the history file
+INTERVAL = 300.0 # seconds between compactor runs
+DATETIME = "%Y-%m-%d %H:%M:%S" # message datetimes compare as strings in this format
+
+# index entry fields
+SEGMENT, OFFSET, LENGTH, COUNT, FIRST, LAST = range(6)
+
+def message_datetime(serialized : str) -> str:
+    return json.loads(serialized)["datetime"]
+
+@functools.lru_cache(maxsize=64)
+def escaped(text : str) -> str:
+    """
+    text as it appears inside a JSON string
+    """
+    return json.dumps(text)[1:-1]
+
+
+class HistoryArchive:
+    """
+    compressed blocks per peer, appended oldest to newest, read back by position or searched by time and text
+    """
+
+    def __init__(self, directory : str):
+        self.dir = directory
+        self.index_fp = f"{directory}/index.json"
+        self.index = {} # peer id -> block entries, oldest first
+        self.lock = threading.Lock()
+        self.changed = False
+        self.removed = set() # segment files no longer indexed, removed once the index without them is saved
+        try:
+            self.load()
+        except CustomException:
+            self.index = {}
+
+    @staticmethod
+    def stem(peer_id : str) -> str:
+        return hashlib.sha1(peer_id.encode("utf-8")).hexdigest()[:16]
+
+    def segment_fp(self, peer_id : str, segment : int) -> str:
+        return f"{self.dir}/{self.stem(peer_id)}.{segment}.seg"
+
+    def peers(self) -> list:
+        return list(self.index)
+
+    def count(self, peer_id : str) -> int:
+        return sum(block[COUNT] for block in self.index.get(peer_id, ()))
+
+    def size(self, peer_id : str) -> int:
+        """
+        compressed bytes on disk for a peer
+        """
+        return sum(BLOCK_LENGTH.size + block[LENGTH] for block in self.index.get(peer_id, ()))
+
+    def oldest(self, peer_id : str) -> str:
+        blocks = self.index.get(peer_id)
+        return blocks[0][FIRST] if blocks else None
+
+    """
+    writing
+    """
+
+    def append(self, peer_id : str, serialized : list):
+        """
+        add messages (older than anything archived after, newer than anything before) as new blocks
+        """
+        if not serialized:
+            return
+        os.makedirs(self.dir, exist_ok=True)
+        with self.lock:
+            blocks = self.index.setdefault(peer_id, [])
+            for start in range(0, len(serialized), BLOCK_MESSAGES):
+                part = serialized[start:start + BLOCK_MESSAGES]
+                data = zlib.compress(json.dumps(part).encode("utf-8"))
+                segment, offset = 0, 0
+                if blocks:
+                    last = blocks[-1]
+                    segment, offset = last[SEGMENT], last[OFFSET] + last[LENGTH]
+                    if offset >= SEGMENT_BYTES:
+                        segment, offset = segment + 1, 0
+                self.removed.discard(self.segment_fp(peer_id, segment)) # numbers start over once a peer is emptied
+                with open(self.segment_fp(peer_id, segment), "ab") as file:
+                    if file.tell() != offset: # bytes a crash left past the last indexed block
+                        file.truncate(offset)
+                        file.seek(offset)
+                    file.write(BLOCK_LENGTH.pack(len(data)) + data)
+                blocks.append([segment, offset + BLOCK_LENGTH.size, len(data), len(part), message_datetime(part[0]), message_datetime(part[-1])])
+            self.changed = True
+
+    def drop_oldest(self, peer_id : str) -> int:
+        """
+        forget a peer's oldest block, returns how many messages went with it
+        """
+        with self.lock:
+            blocks = self.index.get(peer_id)
+            if not blocks:
+                return 0
+            block = blocks.pop(0)
+            if not blocks:
+                del self.index[peer_id]
+            if not blocks or blocks[0][SEGMENT] != block[SEGMENT]:
+                self.remove_segment(peer_id, block[SEGMENT])
+            self.changed = True
+            return block[COUNT]
+
+    def delete(self, peer_id : str):
+        with self.lock:
+            blocks = self.index.pop(peer_id, None)
+            if not blocks:
+                return
+            for segment in {block[SEGMENT] for block in blocks}:
+                self.remove_segment(peer_id, segment)
+            self.changed = True
+
+    def remove_segment(self, peer_id : str, segment : int):
+        self.removed.add(self.segment_fp(peer_id, segment))
+
+    """
+    reading
+    """
+
+    def read_raw(self, peer_id : str, block : list) -> str:
+        """
+        a block inflated but not parsed, the JSON list as text
+        """
+        try:
+            with open(self.segment_fp(peer_id, block[SEGMENT]), "rb") as file:
+                file.seek(block[OFFSET])
+                return zlib.decompress(file.read(block[LENGTH])).decode("utf-8")
+        except Exception as e:
+            raise CustomException(f"Unable to read archive of {peer_id}! - {e}")
+
+    def read_block(self, peer_id : str, block : list) -> list:
+        return json.loads(self.read_raw(peer_id, block))
+
+    def read(self, peer_id : str, start : int = 0, stop : int = None) -> list:
+        """
+        serialized messages [start, stop) of a peer's archive, oldest is 0, only the blocks covering it are inflated
+        """
+        blocks = list(self.index.get(peer_id, ()))
+        stop = self.count(peer_id) if stop is None else stop
+        messages = []
+        position = 0
+        for block in blocks:
+            end = position + block[COUNT]
+            if end > start and position < stop:
+                part = self.read_block(peer_id, block)
+                messages += part[max(start - position, 0):stop - position]
+            position = end
+            if position >= stop:
+                break
+        return messages
+
+    def search(self, peer_id : str, text : str = None, since : str = None, until : str = None, limit : int = 50) -> list:
+        """
+        newest first, at most limit serialized messages whose content contains text and whose datetime is in
+        [since, until], blocks entirely outside the time range are never read
+        """
+        found = []
+        needle = escaped(escaped(text)) if text else None # messages are JSON strings inside the block's JSON list
+        for block in reversed(list(self.index.get(peer_id, ()))):
+            if (since and block[LAST] < since) or (until and block[FIRST] > until):
+                continue
+            raw = self.read_raw(peer_id, block)
+            if needle and needle not in raw:
+                continue # most blocks of a selective search are never parsed
+            for serialized in reversed(json.loads(raw)):
+                if matches(serialized, text, since, until):
+                    found.append(serialized)
+                    if len(found) >= limit:
+                        return found
+        return found
+
+    """
+    disk
+    """
+
+    def save(self):
+        if not self.changed:
+            return
+        try:
+            os.makedirs(self.dir, exist_ok=True)
+            with self.lock:
+                data = json.dumps(self.index)
+                removed, self.removed = self.removed, set()
+                self.changed = False
+            tmp_fp = self.index_fp + ".tmp"
+            with open(tmp_fp, "w") as file:
+                file.write(data)
+            os.replace(tmp_fp, self.index_fp)
+            for fp in removed:
+                if os.path.exists(fp):
+                    os.remove(fp)
+        except Exception as e:
+            raise CustomException(f"Unable to save archive index! - {e}")
+
+    def load(self):
+        if not os.path.exists(self.index_fp):
+            return
+        try:
+            with open(self.index_fp, "r") as file:
+                self.index = json.load(file)
+        except Exception as e:
+            raise CustomException(f"Unable to load archive index! - {e}")
+
+
+def matches(serialized : str, text : str = None, since : str = None, until : str = None) -> bool:
+    """
+    text is checked on the raw string first, only likely hits are parsed
+    """
+    if text and escaped(text) not in serialized:
+        return False
+    data = json.loads(serialized)
+    if since and data["datetime"] < since:
+        return False
+    if until and data["datetime"] > until:
+        return False
+    if text and text not in (data["content"] if isinstance(data["content"], str) else json.dumps(data["content"])):
+        return False
+    return True
+
+
+class RetentionPolicy:
+    """
+    how much history to keep, None is no limit. max_age is seconds, max_bytes counts the plain JSON of hot messages
+    plus the compressed archive. for one peer the limits apply to that peer, as the global policy to all of history
+    """
+
+    def __init__(self, max_age : float = None, max_count : int = None, max_bytes : int = None):
+        self.max_age = max_age
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+
+    def cutoff(self, now : datetime) -> str:
+        return (now - timedelta(seconds=self.max_age)).strftime(DATETIME) if self.max_age else None
+
+
+class Compactor:
+    """
+    background thread over a HashTable: moves messages past the hot window (the newest hot_messages, and nothing older
+    than hot_age seconds if given) into the archive, then enforces each peer's policy and the global one
+    a peer's policy drops its oldest archived blocks first, and trims the oldest hot messages only once it has no archive
+    left. the global policy only drops archived blocks, oldest across every peer first. age limits drop whole blocks, so
+    a block partly past max_age is kept until all of it is
+    """
+
+    def __init__(
+            self,
+            table,
+            max_age : float = None,
+            max_count : int = None,
+            max_bytes : int = None,
+            peers : dict = None,
+            hot_messages : int = HOT_MESSAGES,
+            hot_age : float = None,
+            interval : float = INTERVAL,
+        ):
+        self.table = table
+        self.policy = RetentionPolicy(max_age, max_count, max_bytes)
+        self.peer_policies = {peer_id : RetentionPolicy(**limits) for peer_id, limits in (peers or {}).items()}
+        self.hot_messages = hot_messages
+        self.hot_age = hot_age
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+        self.last_run = None
+        self.logger = get_logger("sync")
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join(timeout=1)
+
+    def run_loop(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.run()
+            except Exception as e:
+                self.logger.error("Exception raised compacting history: %s", e)
+
+    def run(self, now : datetime = None) -> dict:
+        """
+        one pass over every peer then save, returns how many messages were archived and dropped
+        """
+        started = time.perf_counter()
+        now = now if now else datetime.now()
+        hot_cutoff = (now - timedelta(seconds=self.hot_age)).strftime(DATETIME) if self.hot_age else None
+        summary = {"archived" : 0, "dropped" : 0}
+        for peer_id, entry in self.table.peers().items():
+            # decided from the manifest, a peer within its hot window is not loaded
+            if entry.get("count", 0) > self.hot_messages or (hot_cutoff and entry.get("first") and entry["first"] < hot_cutoff):
+                summary["archived"] += self.table.archive_oldest(peer_id, self.hot_messages, hot_cutoff)
+            if peer_id in self.peer_policies:
+                summary["dropped"] += self.enforce_peer(peer_id, self.peer_policies[peer_id], now)
+        summary["dropped"] += self.enforce_global(now)
+        self.table.save()
+        summary["seconds"] = time.perf_counter() - started
+        self.last_run = summary
+        if summary["archived"] or summary["dropped"]:
+            self.logger.info("Archived %d messages, dropped %d", summary["archived"], summary["dropped"])
+        return summary
+
+    def enforce_peer(self, peer_id : str, policy : RetentionPolicy, now : datetime) -> int:
+        archive = self.table.archive
+        entry = self.table.summary(peer_id)
+        hot_count, hot_bytes = entry.get("count", 0), entry.get("bytes", 0)
+        cutoff = policy.cutoff(now)
+        dropped = 0
+        while archive.count(peer_id):
+            block = archive.index[peer_id][0]
+            if not ((cutoff and block[LAST] < cutoff)
+                    or (policy.max_count is not None and hot_count + archive.count(peer_id) > policy.max_count)
+                    or (policy.max_bytes is not None and hot_bytes + archive.size(peer_id) > policy.max_bytes)):
+                break
+            dropped += archive.drop_oldest(peer_id)
+        if dropped:
+            self.table.refresh_columns(peer_id)
+        if not archive.count(peer_id):
+            dropped += self.table.trim_hot(peer_id, policy.max_count, policy.max_bytes, cutoff)
+        return dropped
+
+    def enforce_global(self, now : datetime) -> int:
+        """
+        drop the oldest archived block across every peer until the whole store is within the global policy
+        """
+        policy = self.policy
+        archive = self.table.archive
+        cutoff = policy.cutoff(now)
+        if policy.max_count is None and policy.max_bytes is None and cutoff is None:
+            return 0
+        entries = self.table.peers()
+        total = sum(entry.get("count", 0) for entry in entries.values())
+        size = sum(entry.get("bytes", 0) for entry in entries.values())
+        heap = []
+        for peer_id in archive.peers():
+            total += archive.count(peer_id)
+            size += archive.size(peer_id)
+            heap.append((archive.oldest(peer_id), peer_id))
+        heapq.heapify(heap)
+        dropped = 0
+        touched = set()
+        while heap:
+            _, peer_id = heap[0]
+            block = archive.index[peer_id][0]
+            if not ((cutoff and block[LAST] < cutoff)
+                    or (policy.max_count is not None and total > policy.max_count)
+                    or (policy.max_bytes is not None and size > policy.max_bytes)):
+                break
+            size -= BLOCK_LENGTH.size + block[LENGTH]
+            total -= block[COUNT]
+            dropped += archive.drop_oldest(peer_id)
+            touched.add(peer_id)
+            if archive.count(peer_id):
+                heapq.heapreplace(heap, (archive.oldest(peer_id), peer_id))
+            else:
+                heapq.heappop(heap)
+        for peer_id in touched:
+            self.table.refresh_columns(peer_id)
+        return dropped
@@ -0,0 +1,421 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+attachment.py
+Classes for streaming file attachments over a data socket beside the control connection, with chunk checksums and resume
+"""
+
+import os
+import json
+import mmap
+import socket
+import threading
+import time
+import uuid
+import zlib
+
+from exception import CustomException
+from logs import get_logger
+
+CHUNK_SIZE = 4 * 1024 * 1024 # bytes covered by one checksum
+ID_LEN = 32 # transfer ids are uuid4 hex
+HEADER_LEN = ID_LEN + 8 # data socket header is transfer id + resume offset
+TIMEOUT = 5
+MAX_SIZE = 1024 * 1024 * 1024 # largest offer accepted by default, the part file is preallocated to the offered size
+
+def checksum_file(path : str, chunk_size : int = CHUNK_SIZE) -> list:
+    """
+    crc32 of every chunk of a file, reads into one reused buffer
+    """
+    checksums = []
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(path, 'rb') as file:
+        while True:
+            n = file.readinto(buffer)
+            if not n:
+                break
+            checksums.append(zlib.crc32(view[:n]))
+    view.release()
+    return checksums
+
+def recv_exact(sock : socket.socket, n : int) -> bytes:
+    """
+    read exactly n bytes or raise
+    """
+    data = bytearray(n)
+    view = memoryview(data)
+    got = 0
+    while got < n:
+        part = sock.recv_into(view[got:])
+        if not part:
+            raise ConnectionError("Data conn closed b4 header could be read!")
+        got += part
+    view.release()
+    return bytes(data)
+
+class OutgoingTransfer:
+    """
+    serves one file to a receiver over its own listening socket, the kernel copies straight from the file with sendfile
+    """
+
+    def __init__(
+            self,
+            path : str,
+            peer_id : str,
+            transfer_id : str = None,
+            chunk_size : int = CHUNK_SIZE,
+            checksums : list = None,
+            stamp : list = None,
+        ):
+        """
+        checksums and stamp ([size, mtime_ns] they were taken at) come from the saved state after a restart, the file
+        is only read again if it changed by the time it is served
+        """
+        self.path = path
+        self.peer_id = peer_id
+        self.transfer_id = transfer_id if transfer_id else uuid.uuid4().hex
+        self.chunk_size = chunk_size
+        self.checksums = checksums
+        self.stamp = stamp
+        if checksums is None:
+            self.refresh()
+        self.size = self.stamp[0]
+
+        self.listener = None
+        self.port = None
+        self.running = False
+        self.thread = None
+        self.logger = get_logger("attachment")
+
+    def refresh(self):
+        """
+        checksum the file again if it is not the one the checksums were taken from
+        """
+        stat = os.stat(self.path)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        if self.checksums is None or stamp != self.stamp:
+            self.checksums = checksum_file(self.path, self.chunk_size)
+            self.stamp = stamp
+            self.size = stat.st_size
+
+    def start(self, bind_ip : str) -> int:
+        """
+        open the data listener, returns the port to put in the offer
+        """
+        if self.running:
+            return self.port
+        self.refresh()
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind((bind_ip, 0))
+        self.listener.listen(1)
+        self.listener.settimeout(1)
+        self.port = self.listener.getsockname()[1]
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        self.running = False
+        if self.listener:
+            self.listener.close()
+
+    def get_offer(self) -> dict:
+        """
+        content of the ATTACHMENT_OFFER message
+        """
+        return {
+            "transfer_id" : self.transfer_id,
+            "name" : os.path.basename(self.path),
+            "size" : self.size,
+            "chunk_size" : self.chunk_size,
+            "checksums" : self.checksums,
+            "port" : self.port,
+        }
+
+    def serve(self):
+        """
+        accept data connections until stopped, a receiver reconnects here to resume
+        """
+        while self.running:
+            try:
+                data_socket, _ = self.listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            try:
+                self.send_data(data_socket)
+            except Exception as e:
+                self.logger.error("Exception raised sending attachment %s: %s", self.transfer_id, e)
+            finally:
+                data_socket.close()
+
+    def send_data(self, data_socket : socket.socket):
+        """
+        read header, then sendfile everything from the requested offset
+        """
+        data_socket.settimeout(TIMEOUT)
+        header = recv_exact(data_socket, HEADER_LEN)
+        transfer_id = header[:ID_LEN].decode("ascii")
+        offset = int.from_bytes(header[ID_LEN:], 'big')
+        if transfer_id != self.transfer_id or offset > self.size:
+            raise CustomException("Bad attachment header!")
+        data_socket.settimeout(None)
+        with open(self.path, 'rb') as file:
+            if self.size - offset:
+                data_socket.sendfile(file, offset, self.size - offset)
+        data_socket.shutdown(socket.SHUT_WR)
+
+
+class IncomingTransfer:
+    """
+    receives one file straight into a preallocated, memory mapped part file, verifying each chunk as it lands
+    """
+
+    def __init__(
+            self,
+            offer : dict,
+            peer_id : str,
+            dest_path : str,
+        ):
+        self.offer = offer
+        self.peer_id = peer_id
+        self.transfer_id = offer["transfer_id"]
+        self.size = offer["size"]
+        self.chunk_size = offer["chunk_size"]
+        self.checksums = offer["checksums"]
+        self.dest_path = dest_path
+        self.part_path = dest_path + ".part"
+        self.progress_path = dest_path + ".part.json"
+        self.verified = 0 # everything before this offset passed its checksum
+        self.complete = False
+        self.logger = get_logger("attachment")
+        self.load_progress()
+
+    def load_progress(self):
+        """
+        pick up the last verified offset from a previous attempt
+        """
+        try:
+            with open(self.progress_path, 'r') as file:
+                progress = json.load(file)
+            if progress["transfer_id"] == self.transfer_id and os.path.exists(self.part_path):
+                self.verified = progress["verified"]
+        except Exception:
+            self.verified = 0
+
+    def save_progress(self):
+        with open(self.progress_path, 'w') as file:
+            json.dump({"transfer_id" : self.transfer_id, "verified" : self.verified}, file)
+
+    def update_offer(self, offer : dict):
+        """
+        sender re-offered (new port after a reconnect), keep our progress unless the file changed
+        """
+        if offer["checksums"] != self.checksums or offer["size"] != self.size:
+            self.size = offer["size"]
+            self.chunk_size = offer["chunk_size"]
+            self.checksums = offer["checksums"]
+            self.verified = 0
+        self.offer = offer
+
+    def run(self, ip : str, retries : int = 3) -> bool:
+        """
+        download until complete, reconnecting from the last verified offset on failure
+        """
+        attempt = 0
+        while not self.complete:
+            try:
+                self.receive((ip, self.offer["port"]))
+            except Exception as e:
+                attempt += 1
+                self.logger.error("Attachment %s interrupted at %d/%d: %s", self.transfer_id, self.verified, self.size, e)
+                if attempt > retries:
+                    return False
+                time.sleep(min(2 ** attempt * 0.1, 2))
+        self.finish()
+        return True
+
+    def receive(self, peer_tuple : tuple):
+        """
+        one data connection, recv_into the mapped file chunk by chunk
+        """
+        # preallocate part file
+        mode = 'r+b' if os.path.exists(self.part_path) else 'w+b'
+        with open(self.part_path, mode) as file:
+            file.truncate(self.size)
+            if self.size == 0:
+                self.complete = True
+                return
+
+            data_socket = socket.create_connection(peer_tuple, timeout=TIMEOUT)
+            mm = mmap.mmap(file.fileno(), self.size)
+            view = memoryview(mm)
+            try:
+                data_socket.sendall(self.transfer_id.encode("ascii") + self.verified.to_bytes(8, 'big'))
+                pos = self.verified
+                while pos < self.size:
+                    chunk_start = pos - pos % self.chunk_size
+                    chunk_end = min(chunk_start + self.chunk_size, self.size)
+                    n = data_socket.recv_into(view[pos:chunk_end])
+                    if not n:
+                        raise ConnectionError("Data conn closed b4 full attachment could be read!")
+                    pos += n
+                    if pos == chunk_end:
+                        index = chunk_start // self.chunk_size
+                        if zlib.crc32(view[chunk_start:chunk_end]) != self.checksums[index]:
+                            raise CustomException(f"Checksum mismatch in chunk {index}!")
+                        self.verified = chunk_end
+                        self.save_progress()
+                mm.flush()
+                self.complete = True
+            finally:
+                view.release()
+                mm.close()
+                data_socket.close()
+
+    def finish(self):
+        """
+        move completed part file into place
+        """
+        os.replace(self.part_path, self.dest_path)
+        if os.path.exists(self.progress_path):
+            os.remove(self.progress_path)
+
+
+class AttachmentManager:
+    """
+    keeps track of outgoing and incoming transfers so they can resume after a disconnect or restart
+    """
+
+    def __init__(
+            self,
+            host_id : str,
+            data_dir : str = "../data",
+            max_size : int = MAX_SIZE,
+        ):
+        self.fp = f"{data_dir}/{host_id}_attachments.json"
+        self.download_dir = f"{data_dir}/attachments"
+        self.max_size = max_size # offers over this are refused
+        self.outgoing = {} # transfer id -> OutgoingTransfer
+        self.incoming = {} # transfer id -> IncomingTransfer
+        self.lock = threading.Lock()
+        self.logger = get_logger("attachment")
+
+        try:
+            self.load()
+        except CustomException:
+            pass
+
+    def add_outgoing(self, path : str, peer_id : str, transfer_id : str = None) -> OutgoingTransfer:
+        transfer = OutgoingTransfer(path, peer_id, transfer_id)
+        with self.lock:
+            self.outgoing[transfer.transfer_id] = transfer
+        self.save()
+        return transfer
+
+    def get_outgoing(self, transfer_id : str) -> OutgoingTransfer:
+        with self.lock:
+            return self.outgoing.get(transfer_id)
+
+    def finish_outgoing(self, transfer_id : str):
+        with self.lock:
+            transfer = self.outgoing.pop(transfer_id, None)
+        if transfer:
+            transfer.stop()
+            self.save()
+
+    def check_offer(self, offer : dict):
+        """
+        raise CustomException for an offer we will not write to disk
+        """
+        try:
+            transfer_id, name, size, chunk_size, checksums = (offer[k] for k in ("transfer_id", "name", "size", "chunk_size", "checksums"))
+        except (KeyError, TypeError):
+            raise CustomException("Malformed attachment offer")
+        if not isinstance(transfer_id, str) or len(transfer_id) != ID_LEN or any(c not in "0123456789abcdef" for c in transfer_id):
+            raise CustomException("Bad attachment transfer id")
+        if not isinstance(size, int) or size < 0 or size > self.max_size:
+            raise CustomException(f"Attachment of {size} bytes is over the {self.max_size} byte limit")
+        if not isinstance(chunk_size, int) or chunk_size <= 0 or not isinstance(checksums, list) or len(checksums) != -(-size // chunk_size):
+            raise CustomException("Attachment checksums do not match its size")
+        if not isinstance(name, str) or os.path.basename(name) in ("", ".", "..") or "\0" in name:
+            raise CustomException(f"Bad attachment name {name!r}")
+
+    def unique_dest(self, name : str) -> str:
+        """
+        a path in the download dir no finished file, part file, or other transfer has, caller holds the lock
+        """
+        stem, ext = os.path.splitext(os.path.basename(name))
+        taken = {transfer.dest_path for transfer in self.incoming.values()}
+        n = 0
+        while True:
+            path = os.path.join(self.download_dir, f"{stem} ({n}){ext}" if n else stem + ext)
+            if path not in taken and not os.path.exists(path) and not os.path.exists(path + ".part"):
+                return path
+            n += 1
+
+    def add_incoming(self, offer : dict, peer_id : str) -> IncomingTransfer:
+        """
+        new offer, or a re-offer of a transfer we already started, raises CustomException if check_offer refuses it
+        """
+        self.check_offer(offer)
+        with self.lock:
+            transfer = self.incoming.get(offer["transfer_id"])
+            if transfer and transfer.peer_id != peer_id:
+                raise CustomException("Attachment transfer id belongs to another peer")
+            if transfer:
+                transfer.update_offer(offer)
+            else:
+                os.makedirs(self.download_dir, exist_ok=True)
+                transfer = IncomingTransfer(offer, peer_id, self.unique_dest(offer["name"]))
+                self.incoming[transfer.transfer_id] = transfer
+        self.save()
+        return transfer
+
+    def finish_incoming(self, transfer_id : str):
+        with self.lock:
+            self.incoming.pop(transfer_id, None)
+        self.save()
+
+    def incomplete_from(self, peer_id : str) -> list:
+        with self.lock:
+            return [transfer for transfer in self.incoming.values() if transfer.peer_id == peer_id]
+
+    def stop(self):
+        with self.lock:
+            transfers = list(self.outgoing.values())
+        for transfer in transfers:
+            transfer.stop()
+
+    def save(self):
+        """
+        save which transfers are in flight, chunk progress lives next to each part file
+        """
+        with self.lock:
+            state = {
+                "outgoing" : {tid : {"path" : t.path, "peer_id" : t.peer_id, "chunk_size" : t.chunk_size, "checksums" : t.checksums, "stamp" : t.stamp} for tid, t in self.outgoing.items()},
+                "incoming" : {tid : {"offer" : t.offer, "peer_id" : t.peer_id, "dest_path" : t.dest_path} for tid, t in self.incoming.items()},
+            }
+        try:
+            with open(self.fp, 'w') as file:
+                json.dump(state, file)
+        except Exception as e:
+            raise CustomException(f"Unable to save to file! - {e}")
+
+    def load(self):
+        try:
+            with open(self.fp, 'r') as file:
+                state = json.load(file)
+        except Exception as e:
+            raise CustomException(f"Unable to load from file! - {e}")
+        for tid, entry in state["outgoing"].items():
+            # no file reads here, refresh() checks the file when it is offered again
+            try:
+                self.outgoing[tid] = OutgoingTransfer(entry["path"], entry["peer_id"], tid, entry.get("chunk_size", CHUNK_SIZE), entry.get("checksums"), entry.get("stamp"))
+            except OSError as e:
+                self.logger.error("Dropping outgoing attachment %s: %s", tid, e)
+        for tid, entry in state["incoming"].items():
+            self.incoming[tid] = IncomingTransfer(entry["offer"], entry["peer_id"], entry["dest_path"])
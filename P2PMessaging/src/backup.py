@@ -0,0 +1,545 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+backup.py
+BackupManager class, encrypted copies of our history kept on friends' nodes, pushed in the background and pulled back
+in parallel after a disk is lost, and BackupStore, where a node keeps the copies its friends push to it
+
+every peer's history is cut into segments of SEGMENT_MESSAGES, each sealed (zlib, then encrypted and authenticated, see
+seal) with keys derived from a passphrase that is never stored, and named by an HMAC of peer id and segment number, so
+a holder learns neither whose history it keeps nor how it is split. a hash ring of the backup friends (VNODES points
+each) puts every segment on `replicas` of them, a friend joining or leaving only moves the segments next to its points.
+the index (ring members, and per peer the name, digest, and size of every segment) is sealed too and kept by every
+backup friend
+
+pushes: every interval, peers whose manifest entry changed are cut again and only segments whose digest changed go out,
+at bulk priority and at most `rate` bytes per second. a friend that is not connected gets its share on a later round
+restore: the newest index any friend has, then every segment from one of its holders, each holder with one fetch in
+flight, so the holders work in parallel. a missing or bad copy is fetched from the next holder
+
+encryption is AES-256-GCM from the cryptography package (see requirements.txt). the rest of the app runs without it,
+BackupManager refuses to start instead. a friend only stores blobs, so BackupStore needs nothing
+"""
+
+import base64
+import bisect
+import hashlib
+import hmac
+import json
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:
+    AESGCM = None # backups refuse to start, see BackupManager
+
+from identification import Identification
+from exception import CustomException
+from logs import get_logger
+
+SEGMENT_MESSAGES = 1000 # messages per segment, appends only ever rewrite the last one
+VNODES = 64 # ring points per friend
+REPLICAS = 2
+RATE = 256 * 1024 # bytes per second pushed at most
+INTERVAL = 30.0 # seconds between push rounds
+FETCH_TIMEOUT = 10.0
+QUOTA = 64 * 1024 * 1024 # bytes a friend may keep with us
+INDEX = "index"
+
+SEAL_VERSION = 1
+AES_GCM = 1
+SEAL_HEADER = struct.Struct("!BB12s") # version, cipher, nonce
+NAME = re.compile(r"^(index|[0-9a-f]{32})$")
+
+class BackupKeys:
+    """
+    encryption and naming keys, scrypt over the passphrase with our id as salt so the same passphrase and id give the
+    same keys on a new machine
+    """
+
+    __slots__ = ("enc", "names")
+
+    def __init__(self, passphrase : str, host_id : str):
+        material = hashlib.scrypt(passphrase.encode("utf-8"), salt=f"p2pmessaging-backup:{host_id}".encode("utf-8"), n=2 ** 14, r=8, p=1, dklen=64)
+        self.enc = material[:32]
+        self.names = material[32:]
+
+    def name(self, peer_id : str, index : int) -> str:
+        return hmac.new(self.names, f"{peer_id}/{index}".encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+
+def seal(keys : BackupKeys, name : str, data : bytes) -> bytes:
+    """
+    compress and encrypt data, bound to name so a holder cannot swap two blobs
+    """
+    header = SEAL_HEADER.pack(SEAL_VERSION, AES_GCM, os.urandom(12))
+    nonce = header[2:]
+    return header + AESGCM(keys.enc).encrypt(nonce, zlib.compress(data), header + name.encode("utf-8"))
+
+def open_sealed(keys : BackupKeys, name : str, blob : bytes) -> bytes:
+    """
+    check and decrypt a blob from seal, raises CustomException if it was changed, sealed under other keys, or for
+    another name
+    """
+    try:
+        version, cipher, nonce = SEAL_HEADER.unpack_from(blob)
+    except struct.error:
+        raise CustomException(f"Backup {name} is truncated")
+    header = blob[:SEAL_HEADER.size]
+    aad = header + name.encode("utf-8")
+    if version != SEAL_VERSION:
+        raise CustomException(f"Backup {name} has unknown version {version}")
+    if cipher != AES_GCM:
+        raise CustomException(f"Backup {name} has unknown cipher {cipher}")
+    try:
+        plain = AESGCM(keys.enc).decrypt(nonce, blob[SEAL_HEADER.size:], aad)
+    except Exception:
+        raise CustomException(f"Backup {name} failed authentication")
+    return zlib.decompress(plain)
+
+def digest(data : bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+class HashRing:
+    """
+    consistent hashing of segment names onto friend ids
+    """
+
+    def __init__(self, nodes : list, vnodes : int = VNODES):
+        self.nodes = sorted(set(nodes))
+        self.points = sorted(
+            (int.from_bytes(hashlib.sha1(f"{node}#{v}".encode("utf-8")).digest()[:8], "big"), node)
+            for node in self.nodes for v in range(vnodes)
+        )
+        self.keys = [point for point, _ in self.points]
+
+    def owners(self, name : str, count : int) -> list:
+        """
+        the first count distinct nodes clockwise from name
+        """
+        owners = []
+        if not self.points:
+            return owners
+        start = bisect.bisect(self.keys, int.from_bytes(hashlib.sha1(name.encode("utf-8")).digest()[:8], "big"))
+        for i in range(len(self.points)):
+            node = self.points[(start + i) % len(self.points)][1]
+            if node not in owners:
+                owners.append(node)
+                if len(owners) == count:
+                    break
+        return owners
+
+
+class RateLimiter:
+    """
+    byte token bucket, wait(n) sleeps until n more bytes fit under rate
+    """
+
+    def __init__(self, rate : float, burst : float = None):
+        self.rate = rate
+        self.burst = burst if burst else rate
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self, n : int, stopped : threading.Event = None):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= n # may go negative for a blob bigger than burst, the debt is paid below
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if delay:
+            if stopped:
+                stopped.wait(delay)
+            else:
+                time.sleep(delay)
+
+
+class BackupStore:
+    """
+    sealed blobs friends pushed to us, <data>/<id>_backups/<owner hash>/<name>, at most quota bytes per owner
+    """
+
+    def __init__(self, data_dir : str, host_id : str, quota : int = QUOTA):
+        self.dir = f"{data_dir}/{host_id}_backups"
+        self.quota = quota
+        self.lock = threading.Lock()
+
+    def owner_dir(self, owner_id : str) -> str:
+        return f"{self.dir}/{hashlib.sha1(owner_id.encode('utf-8')).hexdigest()[:16]}"
+
+    def used(self, owner_id : str) -> int:
+        folder = self.owner_dir(owner_id)
+        if not os.path.isdir(folder):
+            return 0
+        return sum(os.path.getsize(f"{folder}/{name}") for name in os.listdir(folder))
+
+    def put(self, owner_id : str, content : dict) -> dict:
+        """
+        keep one pushed blob, returns the BACKUP_STORED reply
+        """
+        name = content.get("name", "")
+        reply = {"name" : name, "digest" : content.get("digest"), "ok" : False}
+        if not NAME.match(name):
+            reply["error"] = "bad name"
+            return reply
+        blob = base64.b64decode(content["data"])
+        fp = f"{self.owner_dir(owner_id)}/{name}"
+        with self.lock:
+            replaced = os.path.getsize(fp) if os.path.exists(fp) else 0
+            if self.used(owner_id) - replaced + len(blob) > self.quota:
+                reply["error"] = "quota"
+                return reply
+            os.makedirs(self.owner_dir(owner_id), exist_ok=True)
+            tmp_fp = fp + ".tmp"
+            with open(tmp_fp, "wb") as file:
+                file.write(blob)
+            os.replace(tmp_fp, fp)
+        reply["ok"] = True
+        return reply
+
+    def get(self, owner_id : str, name : str) -> bytes:
+        if not NAME.match(name):
+            return None
+        fp = f"{self.owner_dir(owner_id)}/{name}"
+        try:
+            with open(fp, "rb") as file:
+                return file.read()
+        except OSError:
+            return None
+
+
+class BackupManager:
+    """
+    pushes our history to backup friends and restores it from them
+    friends None backs up to every friend in the roster, after a lost disk the roster is gone too, so list them
+    """
+
+    def __init__(
+            self,
+            client,
+            passphrase : str,
+            friends : list = None,
+            replicas : int = REPLICAS,
+            rate : float = RATE,
+            interval : float = INTERVAL,
+        ):
+        if AESGCM is None:
+            raise CustomException("Backups need the cryptography package, pip install -r requirements.txt")
+        if not passphrase:
+            raise CustomException("Backups need a passphrase")
+        self.client = client
+        self.keys = BackupKeys(passphrase, client.identification.get_id())
+        self.friends = friends
+        self.replicas = replicas
+        self.interval = interval
+        self.limiter = RateLimiter(rate)
+        self.fp = f"{client.data_dir}/{client.identification.get_id()}_backup.json"
+        self.state = {
+            "version" : 0, # index version, bumped whenever a segment changes
+            "peers" : {}, # peer id -> [count, last] the segments were cut at
+            "segments" : {}, # peer id -> [[name, digest, messages], ...]
+            "receivers" : {}, # peer id -> identity string
+            "held" : {}, # friend id -> {name : digest} the friend confirmed
+        }
+        self.load()
+        self.lock = threading.Lock()
+        self.waiting = {} # (friend id, name) -> [Event, blob]
+        self.stopped = threading.Event()
+        self.thread = None
+        self.logger = get_logger("sync")
+        self.pushed_bytes = client.metrics.counter("backup_pushed_bytes", "sealed backup bytes sent to friends")
+        self.rounds = client.metrics.histogram("backup_round_seconds", "time spent in one backup push round")
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        if self.thread:
+            self.thread.join(timeout=1)
+        self.save()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.push_round()
+            except Exception as e:
+                self.logger.error("Exception raised pushing backups: %s", e)
+
+    def backup_friends(self) -> list:
+        if self.friends is not None:
+            return list(self.friends)
+        return [friend.get_receiver().get_id() for friend in self.client.friends.get_friends()]
+
+    """
+    pushing
+    """
+
+    def cut(self, peer_id : str) -> list:
+        """
+        [(name, digest, messages, data), ...] for every segment of a peer's history
+        """
+        history = self.client.hash_table.read_serialized(peer_id)
+        segments = []
+        for index, start in enumerate(range(0, len(history), SEGMENT_MESSAGES)):
+            data = json.dumps(history[start:start + SEGMENT_MESSAGES]).encode("utf-8")
+            segments.append((self.keys.name(peer_id, index), digest(data), len(history[start:start + SEGMENT_MESSAGES]), data))
+        return segments
+
+    def push_round(self) -> dict:
+        """
+        send what changed since the last round to whoever should hold it and is connected, returns what was sent
+        """
+        started = time.perf_counter()
+        friends = self.backup_friends()
+        ring = HashRing(friends)
+        sent = {"segments" : 0, "bytes" : 0}
+        changed = False
+        for peer_id, entry in self.client.hash_table.peers().items():
+            signature = [entry.get("count"), entry.get("last")]
+            stale = self.state["peers"].get(peer_id) != signature
+            known = self.state["segments"].get(peer_id, [])
+            if not stale and all(self.held_by(owner, name, seg_digest)
+                                 for name, seg_digest, _ in known for owner in ring.owners(name, self.replicas)
+                                 if self.client.get_conn(owner)):
+                continue
+            segments = self.cut(peer_id)
+            if [[name, seg_digest, count] for name, seg_digest, count, _ in segments] != known:
+                changed = True
+            self.state["segments"][peer_id] = [[name, seg_digest, count] for name, seg_digest, count, _ in segments]
+            self.state["peers"][peer_id] = signature
+            self.state["receivers"][peer_id] = entry.get("receiver")
+            for name, seg_digest, _, data in segments:
+                for owner in ring.owners(name, self.replicas):
+                    if not self.held_by(owner, name, seg_digest):
+                        self.count(sent, self.push(owner, name, seg_digest, data))
+            if self.stopped.is_set():
+                break
+        if changed:
+            self.state["version"] += 1
+        index = self.index(friends)
+        index_digest = digest(index)
+        for friend in friends:
+            if not self.held_by(friend, INDEX, index_digest):
+                self.count(sent, self.push(friend, INDEX, index_digest, index))
+        self.rounds.observe(time.perf_counter() - started)
+        self.save()
+        return sent
+
+    def index(self, friends : list) -> bytes:
+        return json.dumps({
+            "version" : self.state["version"],
+            "friends" : sorted(friends),
+            "replicas" : self.replicas,
+            "segments" : self.state["segments"],
+            "receivers" : self.state["receivers"],
+        }, sort_keys=True).encode("utf-8")
+
+    @staticmethod
+    def count(sent : dict, size : int):
+        if size:
+            sent["segments"] += 1
+            sent["bytes"] += size
+
+    def held_by(self, friend_id : str, name : str, seg_digest : str) -> bool:
+        return self.state["held"].get(friend_id, {}).get(name) == seg_digest
+
+    def push(self, friend_id : str, name : str, seg_digest : str, data : bytes) -> int:
+        """
+        seal and send one segment, returns the sealed size or 0 if the friend is not connected
+        it only counts as held once the friend confirms (on_stored)
+        """
+        conn = self.client.get_conn(friend_id)
+        if conn is None:
+            return 0
+        blob = seal(self.keys, name, data)
+        self.limiter.wait(len(blob), self.stopped)
+        content = {"name" : name, "digest" : seg_digest, "data" : base64.b64encode(blob).decode("ascii")}
+        if not self.client.send_backup(conn, "BACKUP_STORE", content):
+            return 0
+        self.pushed_bytes.inc(len(blob))
+        return len(blob)
+
+    def on_stored(self, friend_id : str, reply : dict):
+        if not reply.get("ok"):
+            self.logger.warning("%s did not keep backup %s: %s", friend_id, reply.get("name"), reply.get("error"))
+            return
+        with self.lock:
+            self.state["held"].setdefault(friend_id, {})[reply["name"]] = reply["digest"]
+
+    """
+    restoring
+    """
+
+    def fetch(self, friend_id : str, name : str, timeout : float = FETCH_TIMEOUT) -> bytes:
+        """
+        one blob from one friend, None if it has none, is not connected, or does not answer in time
+        """
+        conn = self.client.get_conn(friend_id)
+        if conn is None:
+            return None
+        waiter = [threading.Event(), None]
+        with self.lock:
+            self.waiting[(friend_id, name)] = waiter
+        try:
+            if not self.client.send_backup(conn, "BACKUP_FETCH", {"name" : name}):
+                return None
+            waiter[0].wait(timeout)
+            return waiter[1]
+        finally:
+            with self.lock:
+                self.waiting.pop((friend_id, name), None)
+
+    def on_data(self, friend_id : str, content : dict):
+        with self.lock:
+            waiter = self.waiting.get((friend_id, content.get("name")))
+        if waiter is None:
+            return
+        waiter[1] = base64.b64decode(content["data"]) if content.get("data") else None
+        waiter[0].set()
+
+    def newest_index(self) -> dict:
+        """
+        the highest version index any connected backup friend has, asked all at once
+        """
+        results = {}
+        def ask(friend_id):
+            blob = self.fetch(friend_id, INDEX)
+            if blob:
+                try:
+                    results[friend_id] = json.loads(open_sealed(self.keys, INDEX, blob))
+                except CustomException as e:
+                    self.logger.warning("Index from %s unusable: %s", friend_id, e)
+        threads = [threading.Thread(target=ask, args=(friend_id,), daemon=True) for friend_id in self.backup_friends()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if not results:
+            raise CustomException("No backup friend has an index")
+        return max(results.values(), key=lambda index: index["version"])
+
+    def restore(self) -> dict:
+        """
+        pull every segment in the newest index and merge it into the hash table, holders are asked in parallel
+        """
+        started = time.perf_counter()
+        index = self.newest_index()
+        ring = HashRing(index["friends"])
+        work = deque() # [peer id, segment number, name, digest, holders left]
+        for peer_id, segments in index["segments"].items():
+            for number, (name, seg_digest, _) in enumerate(segments):
+                work.append([peer_id, number, name, seg_digest, ring.owners(name, index["replicas"])])
+        total = len(work)
+        done = {} # (peer id, segment number) -> serialized messages
+        failed = []
+        busy = [0]
+        fetched = [0]
+        cond = threading.Condition()
+
+        def next_item(holder):
+            for item in work:
+                if holder in item[4]:
+                    work.remove(item)
+                    return item
+            return None
+
+        def worker(holder):
+            while True:
+                with cond:
+                    item = next_item(holder)
+                    while item is None and busy[0]:
+                        cond.wait()
+                        item = next_item(holder)
+                    if item is None:
+                        return
+                    busy[0] += 1
+                peer_id, number, name, seg_digest, holders = item
+                blob = self.fetch(holder, name)
+                messages = None
+                if blob:
+                    try:
+                        data = open_sealed(self.keys, name, blob)
+                        if digest(data) == seg_digest:
+                            messages = json.loads(data)
+                    except CustomException as e:
+                        self.logger.warning("Backup %s from %s unusable: %s", name, holder, e)
+                with cond:
+                    busy[0] -= 1
+                    if messages is not None:
+                        done[(peer_id, number)] = messages
+                        fetched[0] += len(blob)
+                    else:
+                        holders.remove(holder)
+                        (work if holders else failed).append(item)
+                    cond.notify_all()
+
+        holders = sorted({holder for item in work for holder in item[4]})
+        threads = [threading.Thread(target=worker, args=(holder,), daemon=True) for holder in holders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        failed += list(work) # holders that were never connected
+
+        restored = 0
+        for peer_id, segments in index["segments"].items():
+            history = []
+            for number in range(len(segments)):
+                history += done.get((peer_id, number), [])
+            receiver = index["receivers"].get(peer_id)
+            if history and receiver:
+                self.client.hash_table.merge_history(Identification.from_string(receiver), history)
+                restored += len(history)
+        self.client.hash_table.save()
+        return {
+            "version" : index["version"],
+            "segments" : total,
+            "failed" : len(failed),
+            "messages" : restored,
+            "bytes" : fetched[0],
+            "seconds" : time.perf_counter() - started,
+        }
+
+    """
+    local state
+    """
+
+    def stats(self) -> dict:
+        return {
+            "version" : self.state["version"],
+            "peers" : len(self.state["segments"]),
+            "segments" : sum(len(segments) for segments in self.state["segments"].values()),
+            "friends" : self.backup_friends(),
+            "held" : {friend_id : len(names) for friend_id, names in self.state["held"].items()},
+            "cipher" : "aes-gcm",
+        }
+
+    def save(self):
+        try:
+            tmp_fp = self.fp + ".tmp"
+            with open(tmp_fp, "w") as file:
+                json.dump(self.state, file)
+            os.replace(tmp_fp, self.fp)
+        except Exception as e:
+            raise CustomException(f"Unable to save backup state! - {e}")
+
+    def load(self):
+        if not os.path.exists(self.fp):
+            return
+        try:
+            with open(self.fp, "r") as file:
+                self.state.update(json.load(file))
+        except Exception as e:
+            raise CustomException(f"Unable to load backup state! - {e}")
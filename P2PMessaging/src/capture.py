@@ -0,0 +1,123 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+capture.py
+TrafficCapture class, an optional ring buffer of the frames a Client sends and receives, written out as a capture file
+that replay.py feeds back into a Client
+
+file: MAGIC | meta length (4) | meta JSON | records
+record: offset seconds (8) | conn (4) | direction (1) | length (4) | encoded Message
+meta has the host identity, the wall clock time of the first record, how many frames fell off the ring, and the peer
+identity behind each conn id. conn 0 is frames read or written before there was a LiveConnection (the handshake)
+"""
+
+import json
+import os
+import struct
+import threading
+import time
+import weakref
+from collections import deque
+
+from identification import Identification
+from exception import CustomException
+
+MAGIC = b"P2PCAP1\n"
+META_LENGTH = struct.Struct("!I")
+RECORD = struct.Struct("!dIBI") # offset from the first record, conn id, direction, payload length
+INBOUND = 0
+OUTBOUND = 1
+DEFAULT_CAPACITY = 16 * 1024 * 1024 # bytes of frames kept, oldest are dropped past this
+
+class TrafficCapture:
+    """
+    the newest frames up to capacity bytes, recording is an append under a lock, files are only written on save
+    """
+
+    def __init__(self, host : Identification, capacity : int = DEFAULT_CAPACITY):
+        self.host = host
+        self.capacity = capacity
+        self.records = deque() # (monotonic time, conn id, direction, payload)
+        self.size = 0
+        self.dropped = 0
+        self.conn_ids = weakref.WeakKeyDictionary() # LiveConnection -> conn id
+        self.peers = {} # conn id -> peer identity string
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.started_wall = time.time()
+
+    def conn_id(self, conn) -> int:
+        if conn is None:
+            return 0
+        conn_id = self.conn_ids.get(conn)
+        if conn_id is None:
+            conn_id = self.conn_ids[conn] = len(self.peers) + 1
+            self.peers[conn_id] = conn.get_receiver().to_string()
+        return conn_id
+
+    def record(self, conn, direction : int, payload : bytes):
+        now = time.monotonic()
+        payload = bytes(payload)
+        with self.lock:
+            self.records.append((now, self.conn_id(conn), direction, payload))
+            self.size += RECORD.size + len(payload)
+            while self.size > self.capacity and len(self.records) > 1:
+                _, _, _, old = self.records.popleft()
+                self.size -= RECORD.size + len(old)
+                self.dropped += 1
+
+    def stats(self) -> dict:
+        return {"frames" : len(self.records), "bytes" : self.size, "dropped" : self.dropped, "capacity" : self.capacity}
+
+    def save(self, fp : str) -> int:
+        """
+        write what the ring holds now, returns the number of frames written
+        """
+        with self.lock:
+            records = list(self.records)
+            peers = dict(self.peers)
+            dropped = self.dropped
+        first = records[0][0] if records else self.started
+        meta = {
+            "host" : self.host.to_string(),
+            "started" : self.started_wall + (first - self.started),
+            "dropped" : dropped,
+            "conns" : {str(conn_id) : peer for conn_id, peer in peers.items()},
+        }
+        meta_bytes = json.dumps(meta).encode("utf-8")
+        try:
+            tmp_fp = fp + ".tmp"
+            with open(tmp_fp, "wb") as file:
+                file.write(MAGIC + META_LENGTH.pack(len(meta_bytes)) + meta_bytes)
+                for at, conn_id, direction, payload in records:
+                    file.write(RECORD.pack(at - first, conn_id, direction, len(payload)))
+                    file.write(payload)
+            os.replace(tmp_fp, fp)
+        except Exception as e:
+            raise CustomException(f"Unable to save capture! - {e}")
+        return len(records)
+
+
+def read_capture(fp : str) -> tuple:
+    """
+    (meta, [(offset seconds, conn id, direction, payload), ...]) from a capture file
+    """
+    try:
+        with open(fp, "rb") as file:
+            data = file.read()
+    except Exception as e:
+        raise CustomException(f"Unable to read capture! - {e}")
+    if not data.startswith(MAGIC):
+        raise CustomException(f"{fp} is not a capture file")
+    pos = len(MAGIC)
+    (meta_length,) = META_LENGTH.unpack_from(data, pos)
+    pos += META_LENGTH.size
+    meta = json.loads(data[pos:pos + meta_length])
+    pos += meta_length
+    records = []
+    while pos + RECORD.size <= len(data):
+        offset, conn_id, direction, length = RECORD.unpack_from(data, pos)
+        pos += RECORD.size
+        records.append((offset, conn_id, direction, data[pos:pos + length]))
+        pos += length
+    return meta, records
@@ -5,18 +5,40 @@ client.py
 Client class for performing all client related operations, like multiple connection management, history management, and more
 """
 
+import base64
 import socket
 import threading
-import logging
 import errno
+import time
 
 from live_connection import LiveConnection
 from hash_table import HashTable
-from friendship import Friendship
+from friendship import FriendRoster
 from identification import Identification
 from message import Message
+from discovery import PeerDirectory, Discovery
+from outbox import Outbox
+from attachment import AttachmentManager, MAX_SIZE as MAX_ATTACHMENT
+from metrics import MetricsRegistry, MetricsServer, make_buckets
+from profiling import Profiler
+from dispatch import HandlerRegistry, HandlerSpec, HandlerPool
+from logs import LogPipeline, get_logger
+from receipts import ReadReceipts, DeliveryAcks
+from admission import AdmissionControl, AdmissionPolicy
+from streams import write_frame, read_frame, wire_size, Paused, PAUSE_POLL
+from transport import TcpTransport
+from datagram import DatagramChannel, DATA_HEADER, MAX_PAYLOAD as DATAGRAM_PAYLOAD
+from capture import TrafficCapture, INBOUND, OUTBOUND
+from backup import BackupManager, BackupStore
+from archive import Compactor
+from exception import CustomException
 
 TIMEOUT = 5
+PIGGYBACK_TYPES = ("TEXT_MESSAGE_REQUEST", "BATCH_MESSAGE") # frames a pending read receipt can ride on
+STREAM_PRIORITIES = {"control" : 0, "user" : 1, "bulk" : 2} # Message.category -> StreamMux priority, lower goes first
+BULK_WEIGHTS = {"BATCH_MESSAGE" : 4} # chunks per turn among bulk streams, queued messages beat history backfill
+DATAGRAM_TYPES = ("TEXT_MESSAGE_REQUEST", "READ_RECEIPT", "PULSECHECK_REQUEST", "ACK") # small frames that may go over UDP
+SHUTDOWN_DEADLINE = 2.0 # seconds stop() waits on peers and threads in total, however many connections are open
 
 class Client:
     """
@@ -25,63 +47,196 @@ class Client:
 
     def __init__(
             self,
-            id: Identification
+            id: Identification,
+            data_dir: str = "../data",
+            bind: bool = True,
+            friends_only: bool = False,
+            admission: AdmissionPolicy = None,
+            transport = None,
+            datagrams: bool = False,
+            capture: int = 0,
+            handoff: bool = False,
+            backup: dict = None,
+            retention: dict = None,
+            max_attachment: int = MAX_ATTACHMENT,
         ):
         """
         Creates Client Obj
+        bind is False when someone else owns the listening socket and hands us connections (see shard.py)
+        friends_only keeps history only for peers in the friend roster
+        admission limits inbound connections, defaults in admission.py
+        transport makes the sockets, real TCP unless given one (see simnet.py for an in-memory network)
+        datagrams offers peers a UDP path for small interactive messages (see datagram.py)
+        capture keeps the newest `capture` bytes of frames sent and received for replay.py, 0 is off (see capture.py)
+        handoff makes the accept loop and steady connections stoppable between frames, so hand_off can pass the live
+        sockets to a new process (see handoff.py)
+        backup keeps encrypted copies of our history on friends, BackupManager options with at least a passphrase
+        (see backup.py), friends' copies are kept for them either way
+        retention moves history past the hot window into the compressed archive and enforces retention limits, Compactor
+        options (see archive.py), history is kept whole and uncompressed without it
+        max_attachment is the largest file a friend may offer us, offers from anyone not in the friend roster are refused
         """
+        started = time.perf_counter()
 
         # data structures
         self.identification = id
-        self.threads = []
+        self.data_dir = data_dir
+        self.threads = [] # started and not seen finished yet, see start_thread
+        self.threads_lock = threading.Lock()
         self.connections = []
-        self.friends = {}
-        self.hash_table = HashTable(self.identification)
+        self.friends = FriendRoster(self.identification, self.data_dir)
+        self.friends_only = friends_only
+        self.persisted_categories = {"user"} # Message.categories kept in history, bulk is unpacked, control is dropped
+        self.hash_table = HashTable(self.identification, self.data_dir)
+        self.directory = PeerDirectory(self.identification, self.data_dir)
+        self.outbox = Outbox(self.identification, self.data_dir)
+        self.transport = transport if transport else TcpTransport()
+        self.receipts = ReadReceipts(self.send_read_receipt, timer=self.transport.timer)
+        self.acks = DeliveryAcks(lambda conn, keys: self.send_ack(keys, conn), timer=self.transport.timer)
+        self.attachments = AttachmentManager(self.identification.get_id(), self.data_dir, max_attachment)
+        self.backup_store = BackupStore(self.data_dir, self.identification.get_id())
+        self.discovery = None
+        self.listeners = [] # callbacks for client events, see subscribe
+        self.handlers = HandlerRegistry(HandlerSpec(self.bad_message_handler))
+        self.handler_pool = HandlerPool()
+        self.register_default_handlers()
 
         self.binding = (id.get_ip(), int(id.get_port()))
+        self.admission = AdmissionControl(admission, self.transport.now)
 
         # socket stuff
-        self.listening_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.listening_socket.bind(self.binding)
-        self.listening_socket.listen(5)
-        # self.listening_socket.settimeout(TIMEOUT)
+        self.listening_socket = None
+        if bind:
+            self.listening_socket = self.transport.listen(self.binding, self.admission.policy.backlog)
+            # self.listening_socket.settimeout(TIMEOUT)
+            if handoff: # accept wakes up now and then to see if a handoff started
+                self.listening_socket.settimeout(PAUSE_POLL)
+        self.time_to_listen = time.perf_counter() - started # histories load lazily, so this should not grow with them
 
         # state
         self.running = True
+        self.stopping = False
+        self.handoff = handoff
+        self.handing_off = False # set once by hand_off, no connection becomes pausable after that
+        self.handed_off = False # the sockets and saved state belong to the next process now
+        self.handoff_lock = threading.Lock()
+        self.listening_thread = None
 
-        # logging
-        self.logger = logging.getLogger('client_logger')
-        self.file_handler = logging.FileHandler(f'../data/{self.identification.get_id()}_log.log')
-        self.file_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        self.file_handler.setFormatter(self.file_formatter)
+        # logging, written on a background thread (see logs.py)
+        self.log_pipeline = LogPipeline.acquire(self.data_dir, self.identification.get_id())
+        self.logger = get_logger("conn")
+        self.message_logger = get_logger("message")
+        self.sync_logger = get_logger("sync")
+        self.outbox_logger = get_logger("outbox")
+
+        # metrics
+        self.metrics = MetricsRegistry()
+        self.metrics_server = None
+        self.sent_traffic = self.metrics.traffic("sent", "frames written to sockets, framing included")
+        self.received_traffic = self.metrics.traffic("received", "frames read from sockets, framing included")
+        self.handshake_latency = self.metrics.histogram("handshake_seconds", "time to exchange begin conversation messages")
+        self.sync_duration = self.metrics.histogram("history_sync_seconds", "time spent in manage_histories")
+        self.sync_size = self.metrics.histogram("history_sync_messages", "messages received in a history sync", buckets=make_buckets(1, 1e7))
+        self.hash_table.op_latency = self.metrics.histogram("hash_table_op_seconds", "HashTable operation latency", ("op",))
+        self.metrics.gauge("live_connections", "connections currently open", func=lambda: len(self.connections))
+        self.metrics.gauge("threads", "threads started and not seen finished yet", func=lambda: len(self.threads))
+        self.metrics.gauge("outbox_depth", "undelivered messages in the outbox", func=self.outbox.depth)
+        self.metrics.gauge("outbox_oldest_age_seconds", "age of the oldest undelivered message", func=self.outbox.oldest_age)
+        self.profiler = Profiler(self.identification.get_id(), self.metrics, self.data_dir)
+        self.metrics.gauge("handler_pool_pending", "pooled handlers queued or running", func=self.handler_pool.pending)
+        self.metrics.gauge("time_to_listen_seconds", "Client construction until the listening socket was up", func=lambda: self.time_to_listen)
+        self.metrics.gauge("histories_loaded", "peer histories read from disk so far", func=lambda: len(self.hash_table.table["histories"]))
+        self.admission.shed = self.metrics.counter("connections_shed", "inbound connections closed by admission control", ("reason",))
+        self.metrics.gauge("handshakes_in_flight", "accepted connections still in init_conn", func=lambda: self.admission.handshakes)
+        self.metrics.gauge("attachments_in_flight", "incoming and outgoing attachment transfers", func=lambda: len(self.attachments.incoming) + len(self.attachments.outgoing))
+
+        self.capture = TrafficCapture(self.identification, capture) if capture else None
+
+        # optional UDP path on the same ip and port, used with peers that offer one too
+        self.datagrams = None
+        if datagrams and bind:
+            self.start_datagrams()
+
+        self.backups = None
+        if backup:
+            self.backups = BackupManager(self, **backup)
+            self.backups.start()
+
+        self.compactor = None
+        if retention:
+            self.compactor = Compactor(self.hash_table, **retention)
+            self.compactor.start()
+
+    def start_datagrams(self, sock : socket.socket = None):
+        """
+        open the UDP path, on sock if a previous process handed one over
+        """
+        self.datagrams = DatagramChannel(self.binding, self.receive_datagram, self.datagram_fallback, sock=sock)
+        self.datagrams.retransmits = self.metrics.counter("datagram_retransmits", "datagrams resent, by reason (timeout, fast, fallback to the stream)", ("reason",))
+        self.metrics.gauge("datagrams_in_flight", "datagrams sent and not acked yet", func=self.datagrams.in_flight)
+        self.datagrams.start()
     
     def start_listening(self):
         """
         Create listening thread assigned to listen_for_connections
+        unless the transport hands over accepted connections itself
         """
-        listening_thread = threading.Thread(target=self.listen_for_conns)
-        listening_thread.start()
-        self.threads.append(listening_thread)
+        if self.transport.serve(self.listening_socket, self.adopt_conn):
+            self.logger.info("Transport is serving connections")
+            return
+        self.listening_thread = self.start_thread(self.listen_for_conns)
         self.logger.info("Created listening thread")
 
+    def stop_listening(self):
+        """
+        stop accepting connections, shutdown (not just close) so a thread blocked in accept() wakes up
+        """
+        self.running = False
+        if self.listening_socket is None:
+            return
+        try:
+            self.listening_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.listening_socket.close()
+
     def listen_for_conns(self):
         """
         Listen for new connection requests, if new conn then create thread and go to handle conn
+        accept errors (out of fds, buffers) back off exponentially instead of spinning
+        a handoff stops the loop without closing the socket, dials wait in the backlog for the next process
         """
-        while self.running:
+        backoff = 0
+        while self.running and not self.handing_off:
             try:
                 # get connection
                 client_socket, peer_tuple = self.listening_socket.accept()
+                backoff = 0
                 
                 # thread this connection
-                new_thread = threading.Thread(target=self.handle_conn, args=(client_socket, peer_tuple))
-                new_thread.start()
-                self.threads.append(new_thread)
-                self.logger.info("Received new connection")
-                print("Received new Connection!")
+                self.adopt_conn(client_socket, peer_tuple)
 
+            except socket.timeout: # only with handoff, see __init__
+                continue
             except Exception as e:
-                self.logger.error(f"Exception raised listening for connections: {e}")
+                if not self.running: # accept fails on purpose when stop_listening closes the socket
+                    break
+                policy = self.admission.policy
+                backoff = min(backoff * 2, policy.max_accept_backoff) if backoff else policy.accept_backoff
+                self.logger.error("Exception raised listening for connections: %s, retrying in %.2fs", e, backoff)
+                time.sleep(backoff)
+
+    def adopt_conn(self, client_socket : socket.socket, peer_tuple : tuple):
+        """
+        handle an already accepted socket on its own thread, or shed it if admission control says no
+        """
+        reason = self.admission.admit(peer_tuple[0], len(self.connections))
+        if reason is not None:
+            AdmissionControl.reject(client_socket)
+            self.logger.debug("Shed connection from %s: %s", peer_tuple[0], reason)
+            return
+        self.start_thread(self.handle_conn, (client_socket, peer_tuple, True))
+        self.logger.info("Received new connection")
 
     def start_conn(self, peer_tuple: tuple):
         """
@@ -89,19 +244,47 @@ class Client:
         """
         try:
             # create socket and connect
-            receiver_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            receiver_socket.connect(peer_tuple)
+            receiver_socket = self.transport.connect(peer_tuple)
 
             # thread this connection
-            new_thread = threading.Thread(target=self.handle_conn, args=(receiver_socket, peer_tuple))
-            new_thread.start()
-            self.threads.append(new_thread)
+            self.start_thread(self.handle_conn, (receiver_socket, peer_tuple))
             self.logger.info("Started new connection")
             return "Created Connection!"
 
         except Exception as e:
-            self.logger.error(f"Exception raised trying to start a connection: {e}")
+            self.logger.error("Exception raised trying to start a connection: %s", e)
             return "Failed Connection!"
+
+    def start_thread(self, target, args : tuple = (), daemon : bool = False) -> threading.Thread:
+        """
+        start a thread stop() waits for, finished ones are dropped here so the list only grows with what is running
+        """
+        thread = threading.Thread(target=target, args=args, daemon=daemon)
+        thread.start()
+        with self.threads_lock:
+            self.threads = [t for t in self.threads if t.is_alive()]
+            self.threads.append(thread)
+        return thread
+
+    def start_conn_by_id(self, peer_id : str):
+        """
+        start a connection with a peer we have seen before, one directory lookup and one dial
+        """
+        peer = self.directory.lookup(peer_id)
+        if peer is None:
+            return "Unknown Peer!"
+        return self.start_conn((peer.get_ip(), int(peer.get_port())))
+
+    def start_discovery(self, **kwargs):
+        """
+        start announcing ourselves and recording other peers on the LAN, kwargs go to Discovery
+        """
+        try:
+            self.discovery = Discovery(self.identification, self.directory, **kwargs)
+            self.discovery.start()
+        except Exception as e:
+            self.discovery = None
+            self.logger.error("Exception raised starting discovery: %s", e)
     
     def init_conn(self, client_socket : socket.socket, peer_tuple : tuple) -> LiveConnection:
         """
@@ -123,9 +306,10 @@ class Client:
             )
             delimiter = "_*!*BEGINDELIM*!*_"
             begin_content = self.identification.get_name() + delimiter + self.identification.get_id() # send data in request message for efficiency
+            if self.datagrams:
+                begin_content += delimiter + str(self.datagrams.port) # offer the datagram path
             begin_request_message = Message(self.identification, receiver, begin_content, "BEGIN_CONVERSATION_REQUEST")
-            self.logger.info(f"Sent a message: {begin_request_message.serialize()}")
-
+            deadline = self.transport.now() + self.admission.policy.handshake_timeout
             # send begin message
             self.send_message(begin_request_message, client_socket)
 
@@ -134,18 +318,19 @@ class Client:
 
                 # receive a message
                 begin_response_message = self.receive_message(client_socket)
-                logging.info(f"Receieved a message: {begin_response_message.serialize()}")
 
                 if begin_response_message.get_type() == "BEGIN_CONVERSATION_RESPONSE": # if message is a response to our request...
 
                     # get content from response message
-                    data = begin_response_message.get_content() # standard format is name{delim}id
-                    name, id = data.split(delimiter)
+                    data = begin_response_message.get_content() # standard format is name{delim}id, then a udp port if offered
+                    name, id, *offer = data.split(delimiter)
 
                     # update receiver, create connection
                     receiver.set_name(name)
                     receiver.set_id(id)
+                    self.directory.update(receiver, receiver_ip, begin_response_message.get_sender().get_port())
                     new_conn = LiveConnection(self.identification, receiver, client_socket)
+                    self.attach_datagrams(new_conn, receiver_ip, offer)
                     self.connections.append(new_conn)
                     self.logger.info("Initted new connection with response")
                     # return
@@ -156,28 +341,43 @@ class Client:
                     # while initting, if client sends request instead, respond accordingly
                     # get data from request
                     data = begin_response_message.get_content()
-                    name, id = data.split(delimiter)
+                    name, id, *offer = data.split(delimiter)
 
-                    # update receiver, 
+                    # update receiver, remember their listening port (not the port of this socket)
                     receiver.set_name(name)
                     receiver.set_id(id)
+                    self.directory.update(receiver, receiver_ip, begin_response_message.get_sender().get_port())
                     # send response 
                     new_begin_response_message = Message(self.identification, receiver, begin_content, "BEGIN_CONVERSATION_RESPONSE")
                     self.send_message(new_begin_response_message, client_socket)
                     self.logger.info("Sent begin convo response to request")
                     # create connection
                     new_conn = LiveConnection(self.identification, receiver, client_socket)
+                    self.attach_datagrams(new_conn, receiver_ip, offer)
                     self.connections.append(new_conn)
                     self.logger.info("Initted new connection with request")
                     # return
                     return new_conn
                 
+                elif begin_response_message.get_type() == "ERROR": # timed out or closed
+                    raise Exception(begin_response_message.get_content())
+
+                elif self.transport.now() > deadline: # talking, but never finishing the handshake
+                    raise Exception("Handshake deadline passed")
+
                 else:
-                    continue # NEED SOME SORT OF TIMEOUT HERE IF FAILS
+                    continue
         
         except Exception as e:
-            self.logger.error(f"Exception raised when intting a connection: {e}")
+            self.logger.error("Exception raised when intting a connection: %s", e)
     
+    def attach_datagrams(self, conn : LiveConnection, ip : str, offer : list):
+        """
+        use the datagram path with this peer if both ends offered one
+        """
+        if self.datagrams and offer and offer[0].isdigit():
+            conn.datagram = self.datagrams.attach(conn, (ip, int(offer[0])))
+
     def manage_histories(self, conn : LiveConnection):
         """
         see if history exists for this connection in self hash table
@@ -190,11 +390,11 @@ class Client:
         history = self.hash_table.read_history(receiver)
         # print("\nhistory type: ", type(history))
         # print("\nhistory value: ", history)
-        lotta_history = len(history) > 1 # is there more history than what was just sent?
+        lotta_history = len(history) > 0 # handshake frames are not stored, so anything here is real history
         if lotta_history:
             # print("overwriting!")
             conn.overwrite_history(history)
-            self.logger.info("found message history in hash table")
+            self.sync_logger.info("found message history in hash table")
         else:
             # send history request to receiver later to see if they have anything
             # either can send request and handle response in handle_conn, or do same process as init conn, where look for requests/responses and manage flow from there based on message contents
@@ -210,22 +410,10 @@ class Client:
                 # receive message
                 # print(type(conn))
                 hist_response_msg = self.receive_message(conn.get_socket(), conn)
-                logging.info(f"Receieved a message: {hist_response_msg.serialize()}")
 
                 if hist_response_msg.get_type() == "HISTORY_RESPONSE":
                     # print("responsed!")
-                    data_raw = hist_response_msg.get_content()
-                    # unpackage data
-                    data = Message.msg_history_unprep(data_raw)
-                    # update self history if it not empty
-                    # print("unpacke dmessage data looks like this: ", data)
-                    if data != []:
-                        # print("Overwrote")
-                        # merge with current history
-                        conn.merge_history(data)
-                        # conn.overwrite_history(data)
-                        # merge with hash table
-                        self.hash_table.merge_history(receiver, data)
+                    self.apply_history_response(hist_response_msg, conn)
                     break   
                 elif hist_response_msg.get_type() == "HISTORY_REQUEST":
                     # we are being requested, time to send what we have!
@@ -238,13 +426,31 @@ class Client:
                     self.send_message(my_msg, conn.get_socket(), conn)
                     break
                 else:
-                    continue
-                    # implement some sort of timeout here
+                    # control and text frames overtake a history response still streaming in, handle them normally
+                    if Outbox.should_queue(hist_response_msg):
+                        self.acks.schedule(conn, hist_response_msg.get_key())
+                    if not self.dispatch_message(hist_response_msg, conn):
+                        break
 
             # handle hist responses + possible request to client
-        self.logger.info("completed hash table check")
+        self.sync_logger.info("completed hash table check")
                     
-    def handle_conn(self, client_socket : socket.socket, peer_tuple : tuple):
+    def apply_history_response(self, msg : Message, conn : LiveConnection):
+        """
+        merge the history a peer sent back into the conn and the hash table
+        """
+        # unpackage data
+        data = Message.msg_history_unprep(msg.get_content())
+        self.sync_size.observe(len(data))
+        # update self history if it not empty
+        if data != []:
+            # merge with current history
+            conn.merge_history(data)
+            # merge with hash table
+            if self.should_store(conn.get_receiver()):
+                self.hash_table.merge_history(conn.get_receiver(), data)
+
+    def handle_conn(self, client_socket : socket.socket, peer_tuple : tuple, admitted : bool = False):
         """
         init conversation, get peer info to add it 
         receive messages from conn and handle message types. if conn appears 'dead' (timeout?), go to end_conn
@@ -256,14 +462,40 @@ class Client:
                 - PULSECHECK_REQUEST
                 - END_CONVERSATION_REQUEST
         if connection fails, go to end_conn
+        admitted connections hold a handshake slot until init_conn is done
         """
-        # init connection
-
-        conn = self.init_conn(client_socket, peer_tuple)
+        # init connection, a peer that stalls is dropped at the deadline
+        client_socket.settimeout(self.admission.policy.handshake_timeout)
+        try:
+            with self.handshake_latency.time():
+                conn = self.init_conn(client_socket, peer_tuple)
+        finally:
+            if admitted:
+                self.admission.handshake_done()
+        if conn is None:
+            client_socket.close()
+            return
+        client_socket.settimeout(None)
 
         # print(type(conn))
 
-        self.manage_histories(conn)
+        with self.sync_duration.time():
+            self.profiler.call("sync", "HISTORY_REQUEST", self.manage_histories, conn)
+
+        # deliver anything that was waiting for this peer
+        self.flush_outbox(conn)
+
+        self.emit("connected", peer=conn.get_receiver())
+
+        # a receipt that never made it out before the last disconnect, resent late so it can piggyback
+        read_mark = self.hash_table.get_watermark(conn.get_receiver(), "read")
+        if read_mark is not None and read_mark != self.hash_table.get_watermark(conn.get_receiver(), "read_sent"):
+            self.receipts.schedule(conn.get_receiver().get_id(), read_mark)
+
+        # ask for re-offers of attachments that were cut off
+        for transfer in self.attachments.incomplete_from(conn.get_receiver().get_id()):
+            resume_msg = Message(self.identification, conn.get_receiver(), transfer.transfer_id, "ATTACHMENT_RESUME")
+            self.send_message(resume_msg, client_socket, conn)
 
         # # # if there is message history
         # if history_exists:
@@ -277,36 +509,109 @@ class Client:
         #     self.send_message(hist_msg, client_socket, conn)
 
         # regular handling
+        self.serve_conn(conn)
+
+    def serve_conn(self, conn : LiveConnection):
+        """
+        handle messages from an initted conn until the conversation ends, then go to end_conn
+        with handoff the reader can be paused between frames, it then returns and leaves the socket to the next process
+        """
+        if self.handoff:
+            with self.handoff_lock:
+                if not self.handing_off: # one that gets here late is ended by stop() like before
+                    conn.streams.pause = threading.Event()
+
         while self.running:
             try:
                 # receive message
-                message = self.receive_message(client_socket, conn)
-                # handle message type
-                if message.get_type() == "TEXT_MESSAGE_REQUEST":
-                    self.text_message_rq_handler(message, conn)
-                elif message.get_type() == "FRIEND_REQUEST":
-                    self.friend_rq_handler(message, conn)
-                elif message.get_type() == "END_FRIENDS":
-                    self.end_friends_handler(message, conn)
-                elif message.get_type() == "READ_RECEIPT":
-                    self.read_receipt_handler(message, conn)
-                elif message.get_type() == "PULSECHECK_REQUEST":
-                    self.pulsecheck_rq_handler(message, conn)
-                elif message.get_type() == "END_CONVERSATION_REQUEST":
-                    self.end_conversation_rq_handler(message, conn)
+                message = self.receive_message(conn.get_socket(), conn, offload=True)
+                if message is None: # a bulk frame, the pool decodes and handles it
+                    continue
+                # acknowledge anything the sender is holding in its outbox, keys batch up into one ACK
+                if Outbox.should_queue(message):
+                    self.acks.schedule(conn, message.get_key())
+                if message.duplicate:
+                    continue
+                # handle message type, stop when the conversation ends
+                if not self.dispatch_message(message, conn):
                     break
-                elif message.get_type() == "HISTORY_REQUEST":
-                    self.history_rq_handler(message, conn)
-                else:
-                    # logging message was nothing, or bad
-                    self.bad_message_handler(message, conn)
 
+            except Paused:
+                return
             except Exception as e:
-                self.logger.error(f"Exception raised when handling connection: {e}")
+                self.logger.error("Exception raised when handling connection: %s", e)
 
         # end conn
         self.end_conn(conn)
 
+    def serve_bulk(self, full_msg : bytes, conn : LiveConnection):
+        """
+        decode, record and handle a bulk frame on the pool, in arrival order with the conn's other pooled work
+        it is already off the reader so its handler runs right here, and bulk types never end the conversation
+        """
+        try:
+            message = self.accept_message(full_msg, conn, wire_size(len(full_msg)))
+        except Exception as e:
+            self.message_logger.error("Exception raised when receiving message: %s", e)
+            return
+        if Outbox.should_queue(message):
+            self.acks.schedule(conn, message.get_key())
+        if message.duplicate:
+            return
+        spec = self.handlers.lookup(message.type)
+        self.profiler.call("handle", message.type, spec.handler, message, conn)
+
+    def resume_conn(self, conn : LiveConnection):
+        """
+        carry on a conn handed over by a previous process, no handshake or history sync, queued chunks go out first
+        """
+        try:
+            conn.streams.flush()
+        except OSError as e:
+            self.logger.error("Exception raised flushing a handed over connection: %s", e)
+        self.emit("connected", peer=conn.get_receiver())
+        self.serve_conn(conn)
+
+    def register_default_handlers(self):
+        """
+        built in message types, heavy handlers run on the pool so the reader keeps draining the socket
+        """
+        self.register_handler("TEXT_MESSAGE_REQUEST", self.text_message_rq_handler)
+        self.register_handler("FRIEND_REQUEST", self.friend_rq_handler)
+        self.register_handler("FRIEND_RESPONSE", self.friend_response_handler)
+        self.register_handler("END_FRIENDS", self.end_friends_handler)
+        self.register_handler("READ_RECEIPT", self.read_receipt_handler)
+        self.register_handler("PULSECHECK_REQUEST", self.pulsecheck_rq_handler)
+        self.register_handler("END_CONVERSATION_REQUEST", self.end_conversation_rq_handler)
+        self.register_handler("HISTORY_REQUEST", self.history_rq_handler, pooled=True)
+        self.register_handler("BATCH_MESSAGE", self.batch_message_handler)
+        self.register_handler("ACK", self.ack_handler)
+        self.register_handler("ERROR", self.error_handler)
+        self.register_handler("ATTACHMENT_OFFER", self.attachment_offer_handler)
+        self.register_handler("ATTACHMENT_RESUME", self.attachment_resume_handler, pooled=True)
+        self.register_handler("ATTACHMENT_COMPLETE", self.attachment_complete_handler)
+        self.register_handler("BACKUP_STORE", self.backup_store_handler, pooled=True)
+        self.register_handler("BACKUP_STORED", self.backup_stored_handler)
+        self.register_handler("BACKUP_FETCH", self.backup_fetch_handler, pooled=True)
+        self.register_handler("BACKUP_DATA", self.backup_data_handler)
+
+    def register_handler(self, type : str, handler, pooled : bool = False, ordered : bool = True) -> int:
+        """
+        handle messages of type with handler(msg, conn), new types are registered with Message, returns the opcode
+        a handler returning False ends the conversation (only honored for handlers that are not pooled)
+        """
+        return self.handlers.register(type, handler, pooled, ordered)
+
+    def dispatch_message(self, message : Message, conn : LiveConnection) -> bool:
+        """
+        call the handler for a message's type, returns False when the conversation is over
+        """
+        spec = self.handlers.lookup(message.type)
+        if spec.pooled:
+            self.handler_pool.submit(conn, spec.ordered, self.profiler.call, "handle", message.type, spec.handler, message, conn)
+            return True
+        return self.profiler.call("handle", message.type, spec.handler, message, conn) is not False
+
     def end_conn(self, conn : LiveConnection):
         """
         envoke a connection end, send message, then go to cleanup conn
@@ -328,6 +633,7 @@ class Client:
             return True
         
         if not is_socket_closed(conn.get_socket()):
+            self.acks.flush(conn)
             # send message
             end_msg = Message(
                     sender=conn.get_sender(),
@@ -345,98 +651,340 @@ class Client:
         cleanup conn, thread, and other stuff
         """
         # remove conn
+        self.acks.discard(conn)
         conn.get_socket().close()
+        if conn.datagram:
+            self.datagrams.detach(conn.datagram)
         if conn in self.connections:
             self.connections.remove(conn)
+            self.emit("disconnected", peer=conn.get_receiver())
         # remove thread
 
         # other stuff
 
-    def send_message(self, message : Message, csocket : socket.socket, conn : LiveConnection = None): 
+    def subscribe(self, callback):
+        """
+        call callback(event, **data) for client events:
+            - connected (peer)
+            - message (peer, message), every received frame
+            - disconnected (peer)
+            - stored (peer, message), a message went into history, sent or received, for keeping an inbox live
+              (a merged batch comes without message, page that peer again)
+        callbacks run on network threads, so they should hand work off rather than block
+        """
+        self.listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def emit(self, event : str, **data):
+        for callback in list(self.listeners):
+            try:
+                callback(event, **data)
+            except Exception as e:
+                self.logger.error("Exception raised in %s listener: %s", event, e)
+
+    def get_conn(self, peer_id : str) -> LiveConnection:
+        """
+        get the live connection to a peer, None if not connected
+        """
+        for conn in self.connections:
+            if conn.get_receiver().get_id() == peer_id:
+                return conn
+        return None
+
+    def send_to(self, receiver : Identification, content : str, type : str = "TEXT_MESSAGE_REQUEST") -> str:
+        """
+        send a message to a peer whether or not they are connected
+        queueable messages go through the outbox first and stay there until the peer acks them
+        """
+        message = Message(self.identification, receiver, content, type)
+        queue = Outbox.should_queue(message)
+        if queue:
+            self.outbox.enqueue(message)
+
+        conn = self.get_conn(receiver.get_id())
+        if conn and self.send_message(message, conn.get_socket(), conn):
+            if queue:
+                self.outbox.mark_sent(receiver.get_id(), [message.get_key()])
+            result = "Sent Message!"
+        else:
+            result = "Queued Message!" if queue else "Failed Message!"
+        if self.listeners:
+            self.emit("sent", peer=receiver, message=message, result=result)
+        return result
+
+    def flush_outbox(self, conn : LiveConnection) -> int:
+        """
+        send every unacked message for this peer as one batch frame, returns number of messages flushed
+        """
+        peer_id = conn.get_receiver().get_id()
+        pending = self.outbox.pending(peer_id)
+        if not pending:
+            return 0
+        batch = Message(self.identification, conn.get_receiver(), Message.msg_history_prep(pending), "BATCH_MESSAGE")
+        if self.send_message(batch, conn.get_socket(), conn):
+            self.outbox.mark_sent(peer_id, [msg.get_key() for msg in pending])
+            self.outbox_logger.info("Flushed %d queued messages to %s", len(pending), peer_id)
+            return len(pending)
+        return 0
+
+    def send_attachment(self, conn : LiveConnection, path : str) -> str:
+        """
+        offer a file to a peer, the data is streamed over its own socket once they connect for it
+        """
+        try:
+            transfer = self.attachments.add_outgoing(path, conn.get_receiver().get_id())
+            transfer.start(self.binding[0])
+            offer_msg = Message(self.identification, conn.get_receiver(), transfer.get_offer(), "ATTACHMENT_OFFER")
+            if self.send_message(offer_msg, conn.get_socket(), conn):
+                return "Offered Attachment!"
+        except Exception as e:
+            self.logger.error("Exception raised offering attachment: %s", e)
+        return "Failed Attachment!"
+
+    def send_ack(self, keys : list, conn : LiveConnection):
+        """
+        tell a peer which of its messages we got
+        """
+        ack_msg = Message(self.identification, conn.get_receiver(), keys, "ACK")
+        self.send_message(ack_msg, conn.get_socket(), conn)
+
+    def record_message(self, message : Message, receive_flag : bool, conn : LiveConnection = None):
+        """
+        update live connection and hash table with a sent or received message
+        batches are unpacked and merged so a resent batch never duplicates history
+        """
+        if message.get_type() == "BATCH_MESSAGE":
+            batch = Message.msg_history_unprep(message.get_content())
+            peer = message.get_sender() if receive_flag else message.get_receiver()
+            if not self.should_store(peer):
+                return
+            if conn:
+                conn.merge_history(batch)
+            self.hash_table.merge_history(peer, batch)
+            self.emit("stored", peer=peer)
+            return
+
+        if Message.category(message.type) not in self.persisted_categories:
+            return
+        if not self.should_store(message.get_sender() if receive_flag else message.get_receiver()):
+            return
+        if conn:
+            conn.add_message(message)
+        self.hash_table.write_message(message, receive_flag)
+        self.emit("stored", peer=message.get_sender() if receive_flag else message.get_receiver(), message=message)
+
+    def should_store(self, peer : Identification) -> bool:
         """
-        send a message obj to someone
+        friend roster gate, one dict lookup
+        """
+        return not self.friends_only or self.friends.is_friend(peer.get_id())
+
+    def send_message(self, message : Message, csocket : socket.socket, conn : LiveConnection = None) -> bool: 
+        """
+        send a message obj to someone, returns True if it was written to the socket
         conn is None if BEGIN convo request
         """
 
+        ack = None
         try:
 
+            # a waiting read receipt rides along for free
+            if conn and message.type in PIGGYBACK_TYPES:
+                ack = message.ack = self.receipts.take(conn.get_receiver().get_id())
+
             # prepare data 
-            data = message.prepare_send()
-            data_len = len(data).to_bytes(4, 'big')
+            data = self.profiler.call("encode", message.type, message.prepare_send)
+            message.ack = None # wire only, keep it out of history
 
-            # send data through socket
-            csocket.sendall(data_len + data)
+            # small interactive frames take the datagram path when the peer has one, so a lost packet only delays itself
+            # otherwise on a conn it is chunked on its own stream so bulk never blocks control
+            if conn and conn.datagram and message.type in DATAGRAM_TYPES and len(data) <= DATAGRAM_PAYLOAD:
+                self.profiler.call("write", message.type, self.datagrams.send, conn.datagram, data)
+                self.sent_traffic.record(message.type, len(data) + DATA_HEADER.size)
+            elif conn:
+                category = Message.category(message.type)
+                weight = BULK_WEIGHTS.get(message.type, 1) if category == "bulk" else None
+                self.profiler.call("write", message.type, conn.streams.send, data, STREAM_PRIORITIES.get(category, 0), weight)
+                self.sent_traffic.record(message.type, wire_size(len(data)))
+            else:
+                self.profiler.call("write", message.type, write_frame, csocket, data)
+                self.sent_traffic.record(message.type, wire_size(len(data)))
+            if self.capture:
+                self.capture.record(conn, OUTBOUND, data)
+            if ack is not None:
+                self.hash_table.set_watermark(conn.get_receiver(), "read_sent", ack)
 
-            # update local records
-            if conn:
-                conn.add_message(message)
-            self.hash_table.write_message(message, False) # need to do this only if person is "friend"
-            self.logger.info(f"Successfully sent message to {message.get_receiver().get_id()}")
+            # update local records, only once the data actually went out
+            self.profiler.call("record", message.type, self.record_message, message, False, conn)
+            self.message_logger.info("Successfully sent %s to %s", message.type, message.receiver.get_id())
+            self.message_logger.debug("Sent a message: %s", message)
+            return True
 
         except Exception as e:
-            self.logger.error(f"Exception raised when sending message: {e}")
+            self.message_logger.error("Exception raised when sending message: %s", e)
+            if ack is not None: # try again on the next frame or the timer
+                self.receipts.schedule(conn.get_receiver().get_id(), ack)
+            return False
 
-    def receive_message(self, csocket : socket.socket, conn : LiveConnection = None) -> Message: 
+    def receive_message(self, csocket : socket.socket, conn : LiveConnection = None, offload : bool = False) -> Message: 
         """
         receive a message obj from someone
         conn is None if BEGIN convo response
+        offload hands frames the sender marked bulk to serve_bulk on the pool and returns None for them, decoding
+        megabytes of json here would hold every small frame behind it up
         """
 
         try:
-            # read message len first
-            raw_msg_len = csocket.recv(4)
-            if not raw_msg_len:
-                raise Exception("No message length!")
-            msg_len = int.from_bytes(raw_msg_len, 'big')
-            # get bytes of full message
-            full_msg = b''
-            while len(full_msg) < msg_len:
-                part = csocket.recv(msg_len - len(full_msg))
-                if not part:
-                    raise Exception("Conn closed b4 full message could be read!")
-                full_msg += part
-            # get data, prepare for message
-            message = Message.prepare_receive(full_msg)
-
-            # update local records
-            if conn:
-                conn.add_message(message)
-            self.hash_table.write_message(message, True) # need to do this only if person is "friend"
-            self.logger.info(f"Successfully received message from {message.get_sender().get_id()}")
+            # next complete message, on a conn chunks of other streams are collected along the way
+            if conn is None:
+                full_msg = read_frame(csocket)
+            else:
+                full_msg, bulk = conn.streams.receive_marked()
+                if bulk and offload:
+                    self.handler_pool.submit(conn, True, self.serve_bulk, full_msg, conn)
+                    return None
+            return self.accept_message(full_msg, conn, wire_size(len(full_msg)))
 
-            # return message
-            return message
-        
+        except Paused:
+            raise
         except Exception as e:
 
             err_msg = f"Exception raised when receiving message: {e}"
-            self.logger.error(err_msg)
-            print(err_msg)
-            message = Message(self.identification, conn.get_receiver(), err_msg, "ERROR")
+            self.message_logger.error(err_msg)
+            message = Message(self.identification, conn.get_receiver() if conn else self.identification, err_msg, "ERROR")
 
             return message
     
-    def stop(self):
+    def accept_message(self, full_msg : bytes, conn : LiveConnection, wire_bytes : int) -> Message:
+        """
+        decode a received message and update local records, whichever path it came in on
+        """
+        # get data, prepare for message
+        if self.capture:
+            self.capture.record(conn, INBOUND, full_msg)
+        message = self.profiler.call("decode", None, Message.prepare_receive, full_msg)
+        self.received_traffic.record(message.type, wire_bytes)
+        if message.ack is not None:
+            self.apply_read_receipt(message.get_sender(), message.ack)
+            message.ack = None
+
+        # a datagram that ran out of retries is resent on the stream even if it arrived, only its acks were lost
+        if conn and Message.category(message.type) in self.persisted_categories and conn.seen(message.get_key()):
+            message.duplicate = True
+            self.message_logger.debug("Dropped duplicate %s from %s", message.type, message.sender.get_id())
+            return message
+
+        # update local records
+        self.profiler.call("record", message.type, self.record_message, message, True, conn)
+        if self.listeners:
+            self.emit("message", peer=message.get_sender(), message=message)
+        self.message_logger.info("Successfully received %s from %s", message.type, message.sender.get_id())
+        self.message_logger.debug("Received a message: %s", message)
+
+        # return message
+        return message
+
+    def receive_datagram(self, data : bytes, conn : LiveConnection):
         """
-        turn off app, do total cleanup
+        a message off the datagram path, handled like one read in handle_conn
         """
         try:
-            self.running = False
-            # connections
-            for conn in self.connections:
-                end_msg = Message(
-                    sender=conn.get_sender(),
-                    receiver=conn.get_receiver(),
-                    content="Bye bye now!",
-                    type="END_CONVERSATION_REQUEST",
-                )
-                self.send_message(end_msg, conn.get_socket(), conn)
+            message = self.accept_message(data, conn, len(data) + DATA_HEADER.size)
+            if Outbox.should_queue(message):
+                self.acks.schedule(conn, message.get_key())
+            if not message.duplicate:
+                self.dispatch_message(message, conn)
+        except Exception as e:
+            self.message_logger.error("Exception raised when receiving datagram: %s", e)
+
+    def datagram_fallback(self, data : bytes, conn : LiveConnection):
+        """
+        a datagram ran out of retries, send the same bytes on the stream
+        """
+        try:
+            conn.streams.send(data, STREAM_PRIORITIES["control"])
+        except Exception as e:
+            self.message_logger.error("Exception raised when resending datagram on the stream: %s", e)
+
+    def stop(self, deadline : float = SHUTDOWN_DEADLINE):
+        """
+        turn off app, do total cleanup, waiting on peers and threads for at most deadline seconds in total:
+        every connection gets its goodbye at once, then sockets close, live threads are joined, and state is saved once
+        """
+        if self.stopping:
+            return
+        self.stopping = True
+        until = time.monotonic() + deadline
+        try:
+            self.stop_listening()
+            # discovery
+            if self.discovery:
+                self.discovery.stop()
+            self.attachments.stop()
+            self.receipts.stop()
+            if self.backups:
+                self.backups.stop()
+            if self.compactor:
+                self.compactor.stop()
+            if self.datagrams:
+                self.datagrams.stop()
+            if self.metrics_server:
+                self.metrics_server.stop()
+            self.handler_pool.shutdown(wait=False)
+            # connections, each goodbye on its own thread so one slow peer does not hold up the rest
+            conns = list(self.connections)
+            goodbyes = [threading.Thread(target=self.say_goodbye, args=(conn, until), daemon=True) for conn in conns]
+            for thread in goodbyes:
+                thread.start()
+            for thread in goodbyes:
+                thread.join(timeout=max(until - time.monotonic(), 0))
+            self.acks.stop()
+            for conn in conns: # shutdown wakes readers and any writer still stuck past the deadline
+                try:
+                    conn.get_socket().shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
                 conn.get_socket().close()
             # threads
-            for thread in self.threads:
-                thread.join(timeout=1)
-        except:
-            pass 
+            with self.threads_lock:
+                threads = [t for t in self.threads if t.is_alive() and t is not threading.current_thread()]
+            for thread in threads:
+                thread.join(timeout=max(until - time.monotonic(), 0))
+        except Exception as e:
+            self.logger.error("Exception raised while stopping: %s", e)
+        # persistence, once, after the threads that write it are done, after a handoff the next process has it
+        saves = () if self.handed_off else (self.directory.save, self.hash_table.save)
+        for save in saves + ((self.save_capture,) if self.capture else ()):
+            try:
+                save()
+            except Exception as e:
+                self.logger.error("Exception raised saving on stop: %s", e)
+        if self.log_pipeline:
+            self.log_pipeline = None
+            LogPipeline.release()
+
+    def say_goodbye(self, conn : LiveConnection, until : float):
+        """
+        END_CONVERSATION_REQUEST queued behind everything else on conn (below every priority), so writing it drains the
+        conn's queue first, the socket times out at until
+        """
+        end_msg = Message(
+            sender=conn.get_sender(),
+            receiver=conn.get_receiver(),
+            content="Bye bye now!",
+            type="END_CONVERSATION_REQUEST",
+        )
+        try:
+            conn.get_socket().settimeout(max(until - time.monotonic(), 0.001))
+            self.acks.flush(conn) # queued ahead of the goodbye
+            data = end_msg.prepare_send()
+            conn.streams.send(data, max(STREAM_PRIORITIES.values()) + 1)
+            self.sent_traffic.record(end_msg.type, wire_size(len(data)))
+        except Exception as e:
+            self.logger.debug("No goodbye to %s: %s", conn.get_receiver().get_id(), e)
 
     """
     Message handlers
@@ -447,16 +995,78 @@ class Client:
 
     def end_conversation_rq_handler(self, msg : Message, conn : LiveConnection):
         self.connections.remove(conn)
-        print("\nConnection with " + conn.get_receiver().get_name() + " ended.\n")
+        self.emit("disconnected", peer=conn.get_receiver())
+        return False
 
     def friend_rq_handler(self, msg : Message, conn : LiveConnection):
-        pass 
-    
+        """
+        they want to be friends, if we already asked them that is a yes, otherwise wait for accept_friend
+        """
+        peer = conn.get_receiver()
+        if peer.get_id() in self.friends.requested:
+            self.accept_friend(peer)
+            return
+        self.friends.receive_request(peer)
+        self.emit("friend_request", peer=peer)
+
+    def friend_response_handler(self, msg : Message, conn : LiveConnection):
+        """
+        they accepted a request we sent, a response we never asked for (even from a peer that asked us) is ignored
+        """
+        peer = conn.get_receiver()
+        if peer.get_id() in self.friends.requested:
+            self.friends.add(peer)
+            self.emit("friends", peer=peer)
+
     def end_friends_handler(self, msg : Message, conn : LiveConnection):
-        pass 
+        if self.friends.remove(conn.get_receiver().get_id()):
+            self.emit("unfriended", peer=conn.get_receiver())
+
+    def request_friend(self, peer : Identification) -> str:
+        self.friends.request(peer)
+        return self.send_to(peer, "", "FRIEND_REQUEST")
+
+    def accept_friend(self, peer : Identification) -> str:
+        self.friends.add(peer)
+        self.emit("friends", peer=peer)
+        return self.send_to(peer, "", "FRIEND_RESPONSE")
+
+    def end_friendship(self, peer : Identification) -> str:
+        self.friends.remove(peer.get_id())
+        return self.send_to(peer, "", "END_FRIENDS")
 
     def read_receipt_handler(self, msg : Message, conn : LiveConnection):
-        pass 
+        """
+        standalone receipt, nothing was going out to piggyback on
+        """
+        self.apply_read_receipt(conn.get_receiver(), msg.get_content())
+
+    def mark_read(self, peer : Identification, message : Message):
+        """
+        we have read everything from peer up to and including message, the receipt goes out later and cumulatively
+        """
+        mark = [message.get_key(), message.get_datetime()]
+        if self.hash_table.set_watermark(peer, "read", mark):
+            self.receipts.schedule(peer.get_id(), mark)
+
+    def send_read_receipt(self, peer_id : str, mark : list):
+        """
+        ReadReceipts timer ran out with nothing to piggyback on, one small frame
+        if the peer is gone the mark is resent when they reconnect
+        """
+        conn = self.get_conn(peer_id)
+        if conn is None:
+            return
+        receipt = Message(self.identification, conn.get_receiver(), mark, "READ_RECEIPT")
+        if self.send_message(receipt, conn.get_socket(), conn):
+            self.hash_table.set_watermark(conn.get_receiver(), "read_sent", mark)
+
+    def apply_read_receipt(self, peer : Identification, mark : list):
+        """
+        peer has read our messages up to mark
+        """
+        if self.hash_table.set_watermark(peer, "peer_read", mark):
+            self.emit("read", peer=peer, key=mark[0], datetime=mark[1])
 
     def pulsecheck_rq_handler(self, msg : Message, conn : LiveConnection):
         pass
@@ -464,6 +1074,131 @@ class Client:
     def bad_message_handler(self, msg : Message, conn : LiveConnection):
         pass
 
+    def error_handler(self, msg : Message, conn : LiveConnection):
+        """
+        ERROR from ourselves means receive_message failed, the socket is dead so stop reading it instead of spinning
+        """
+        if msg.get_sender().get_id() == self.identification.get_id():
+            return False
+
+    def batch_message_handler(self, msg : Message, conn : LiveConnection):
+        """
+        batch was already merged into history on receive, ack everything in it at once
+        """
+        batch = Message.msg_history_unprep(msg.get_content())
+        self.send_ack([inner.get_key() for inner in batch], conn)
+
+    def ack_handler(self, msg : Message, conn : LiveConnection):
+        """
+        peer got these messages, drop them from the outbox
+        """
+        removed = self.outbox.acknowledge(conn.get_receiver().get_id(), msg.get_content())
+        self.outbox_logger.debug("%d messages delivered to %s", removed, conn.get_receiver().get_id())
+
+    def attachment_offer_handler(self, msg : Message, conn : LiveConnection):
+        """
+        download an offered file on its own thread so this conn keeps reading, only from friends and within the size limit
+        """
+        peer_id = conn.get_receiver().get_id()
+        if not self.friends.is_friend(peer_id):
+            self.logger.warning("Refused attachment from %s: not a friend", peer_id)
+            return
+        try:
+            transfer = self.attachments.add_incoming(msg.get_content(), peer_id)
+        except CustomException as e:
+            self.logger.warning("Refused attachment from %s: %s", peer_id, e.message)
+            return
+        peer_ip = conn.get_socket().getpeername()[0]
+
+        def download():
+            if transfer.run(peer_ip):
+                self.attachments.finish_incoming(transfer.transfer_id)
+                done_msg = Message(self.identification, conn.get_receiver(), transfer.transfer_id, "ATTACHMENT_COMPLETE")
+                self.send_message(done_msg, conn.get_socket(), conn)
+                self.logger.info("Received attachment %s", transfer.dest_path)
+
+        self.start_thread(download, daemon=True)
+
+    def attachment_resume_handler(self, msg : Message, conn : LiveConnection):
+        """
+        receiver lost the data conn, re-offer on a fresh listener if we still have the file
+        """
+        transfer = self.attachments.get_outgoing(msg.get_content())
+        if transfer is None:
+            return
+        transfer.start(self.binding[0])
+        offer_msg = Message(self.identification, conn.get_receiver(), transfer.get_offer(), "ATTACHMENT_OFFER")
+        self.send_message(offer_msg, conn.get_socket(), conn)
+
+    def attachment_complete_handler(self, msg : Message, conn : LiveConnection):
+        self.attachments.finish_outgoing(msg.get_content())
+
+    def backup_store_handler(self, msg : Message, conn : LiveConnection):
+        """
+        keep a sealed segment for a friend (we cannot read it), strangers are refused
+        """
+        peer_id = conn.get_receiver().get_id()
+        if self.friends.is_friend(peer_id):
+            reply = self.backup_store.put(peer_id, msg.get_content())
+        else:
+            reply = {"name" : msg.get_content().get("name"), "digest" : msg.get_content().get("digest"), "ok" : False, "error" : "not a friend"}
+        self.send_backup(conn, "BACKUP_STORED", reply)
+
+    def backup_stored_handler(self, msg : Message, conn : LiveConnection):
+        if self.backups:
+            self.backups.on_stored(conn.get_receiver().get_id(), msg.get_content())
+
+    def backup_fetch_handler(self, msg : Message, conn : LiveConnection):
+        """
+        hand a friend back a segment it pushed to us, data is None if we do not have it
+        """
+        name = msg.get_content().get("name", "")
+        blob = self.backup_store.get(conn.get_receiver().get_id(), name)
+        self.send_backup(conn, "BACKUP_DATA", {"name" : name, "data" : base64.b64encode(blob).decode("ascii") if blob else None})
+
+    def backup_data_handler(self, msg : Message, conn : LiveConnection):
+        if self.backups:
+            self.backups.on_data(conn.get_receiver().get_id(), msg.get_content())
+
+    def send_backup(self, conn : LiveConnection, type : str, content : dict) -> bool:
+        return self.send_message(Message(self.identification, conn.get_receiver(), content, type), conn.get_socket(), conn)
+
+    def start_metrics_server(self, port : int = 9464) -> int:
+        """
+        serve metrics as Prometheus text on localhost, returns the port actually bound
+        """
+        if self.metrics_server is None:
+            self.metrics_server = MetricsServer(self.metrics, port)
+            self.metrics_server.start()
+            self.logger.info("Serving metrics on 127.0.0.1:%d", self.metrics_server.port)
+        return self.metrics_server.port
+
+    def get_stats(self) -> dict:
+        """
+        every metric as plain python data
+        """
+        return self.metrics.snapshot()
+
+    def save_capture(self, fp : str = None) -> str:
+        """
+        write the capture ring to fp (default <data>/<id>_capture.p2pcap), returns the path
+        """
+        if not self.capture:
+            raise CustomException("Capture is off, start the client with capture=<bytes>")
+        fp = fp or f"{self.data_dir}/{self.identification.get_id()}_capture.p2pcap"
+        self.capture.save(fp)
+        return fp
+
+    def outbox_stats(self) -> dict:
+        """
+        outbox depth and age per peer, plus totals
+        """
+        return {
+            "total_depth" : self.outbox.depth(),
+            "oldest_age" : self.outbox.oldest_age(),
+            "peers" : self.outbox.stats(),
+        }
+
     def history_rq_handler(self, msg : Message, conn : LiveConnection):
         """
         
@@ -0,0 +1,435 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+columns.py
+HistoryColumns class, history metadata (time, peer, type, size, direction) kept column by column next to the JSON
+histories, so volume, activity, and size questions never deserialize a message
+
+on disk: <data>/<id>_history/columns/<name>.col is one raw array per column, rows in the order they were written, and
+meta.json names the peer behind each slot and the message type behind each type code. column files are only appended to, rows past meta's row count come from a
+save that did not finish and are cut off on load. saved rows are memory mapped, with numpy (requirements.txt) queries
+run vectorized over them, without it (or with vectorized off) they fall back to plain loops, 10 to 40 times slower
+(benchmarks analytics suite, *.loop results)
+
+a peer whose history is rewritten (sync merge, delete) moves to a new slot and its old rows stay behind as dead rows,
+skipped by queries, until there are more dead rows than live ones and the files are rewritten without them
+"""
+
+import json
+import mmap
+import os
+import threading
+from array import array
+from bisect import bisect_right
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError: # in requirements.txt, queries loop in plain python without it
+    np = None
+
+from identification import Identification
+from message import Message
+from exception import CustomException
+
+# name, array typecode
+COLUMNS = (
+    ("time", "q"), # wall clock seconds as written in the message datetime, so time % 86400 is the local time of day
+    ("peer", "I"), # slot, see HistoryColumns.slots
+    ("type", "H"), # code, see HistoryColumns.types
+    ("size", "I"), # content bytes
+    ("inbound", "B"), # 1 if the peer sent it
+)
+EPOCH = datetime(1970, 1, 1)
+COMPACT_MIN = 10_000 # dead rows before the files are worth rewriting
+GROUPINGS = ("peer", "type", "hour", "weekday", "bucket", "inbound")
+
+def seconds(dt : str) -> int:
+    try:
+        return int((datetime.fromisoformat(dt) - EPOCH).total_seconds())
+    except (TypeError, ValueError):
+        return 0
+
+def message_row(message, host_id : str) -> tuple:
+    """
+    (time, type name, size, inbound) for a Message or a serialized one
+    """
+    if isinstance(message, Message):
+        dt, msg_type, content = message.get_datetime(), message.get_type(), message.get_content()
+        sender_id = message.get_sender().get_id()
+    else:
+        data = json.loads(message)
+        dt, msg_type, content = data["datetime"], data["type"], data["content"]
+        sender_id = data["sender"].split(Identification.delimiter)[1]
+    size = len(content.encode(Message.encoding)) if isinstance(content, str) else len(json.dumps(content))
+    return (seconds(dt), msg_type, size, int(sender_id != host_id))
+
+
+class HistoryColumns:
+    """
+    one row per stored message, kept up to date by HashTable
+    """
+
+    def __init__(self, directory : str, host_id : str):
+        self.dir = directory
+        self.host_id = host_id
+        self.lock = threading.Lock()
+        self.slots = [] # slot -> peer id
+        self.live = bytearray() # slot -> 1 while it is its peer's current slot
+        self.slot_rows = [] # slot -> rows written under it
+        self.current = {} # peer id -> slot
+        self.types = [] # type code -> message type name, saved with the columns so codes mean the same thing forever
+        self.type_codes = {} # message type name -> type code
+        self.vectorized = np is not None # queries use numpy, off runs the plain loops
+        self.saved_rows = 0
+        self.mapped = self.empty_columns() # saved rows, memoryviews over the mapped files
+        self.tail = self.empty_columns() # rows since the last save
+        self.rewrite = False # files no longer match meta, write them whole on the next save
+        try:
+            self.load()
+        except Exception:
+            self.reset()
+
+    @staticmethod
+    def empty_columns() -> dict:
+        return {name : array(code) for name, code in COLUMNS}
+
+    def reset(self):
+        """
+        forget everything, HashTable.stale then reports every peer and they are rebuilt from their histories
+        """
+        self.slots, self.live, self.slot_rows, self.current = [], bytearray(), [], {}
+        self.types, self.type_codes = [], {}
+        self.saved_rows = 0
+        self.mapped = self.empty_columns()
+        self.tail = self.empty_columns()
+        self.rewrite = True
+
+    """
+    writing
+    """
+
+    def slot(self, peer_id : str) -> int:
+        if peer_id not in self.current:
+            self.current[peer_id] = len(self.slots)
+            self.slots.append(peer_id)
+            self.live.append(1)
+            self.slot_rows.append(0)
+        return self.current[peer_id]
+
+    def type_code(self, msg_type : str) -> int:
+        code = self.type_codes.get(msg_type)
+        if code is None:
+            code = self.type_codes[msg_type] = len(self.types)
+            self.types.append(msg_type)
+        return code
+
+    def add_row(self, slot : int, row : tuple):
+        tail = self.tail
+        tail["time"].append(row[0])
+        tail["peer"].append(slot)
+        tail["type"].append(self.type_code(row[1]))
+        tail["size"].append(row[2])
+        tail["inbound"].append(row[3])
+        self.slot_rows[slot] += 1
+
+    def append(self, peer_id : str, message):
+        """
+        one message written to a peer's history
+        """
+        row = message_row(message, self.host_id)
+        with self.lock:
+            self.add_row(self.slot(peer_id), row)
+
+    def replace(self, peer_id : str, history : list):
+        """
+        a peer's history was rewritten, its old rows go dead and the new history gets a fresh slot
+        """
+        rows = [message_row(message, self.host_id) for message in history]
+        with self.lock:
+            self.retire(peer_id)
+            if rows:
+                slot = self.slot(peer_id)
+                for row in rows:
+                    self.add_row(slot, row)
+
+    def drop(self, peer_id : str):
+        with self.lock:
+            self.retire(peer_id)
+
+    def retire(self, peer_id : str):
+        slot = self.current.pop(peer_id, None)
+        if slot is not None:
+            self.live[slot] = 0
+
+    def stale(self, counts : dict) -> set:
+        """
+        peers whose row count disagrees with counts (peer id -> messages in their history), peers missing from counts
+        are dropped
+        """
+        with self.lock:
+            for peer_id in [peer_id for peer_id in self.current if peer_id not in counts]:
+                self.retire(peer_id)
+            return {
+                peer_id for peer_id, count in counts.items()
+                if count != (self.slot_rows[self.current[peer_id]] if peer_id in self.current else 0)
+            }
+
+    def live_rows(self) -> int:
+        return sum(rows for slot, rows in enumerate(self.slot_rows) if self.live[slot])
+
+    def dead_rows(self) -> int:
+        return sum(rows for slot, rows in enumerate(self.slot_rows) if not self.live[slot])
+
+    def compact_rows(self):
+        """
+        drop dead rows and dead slots, everything ends up in the tail and the files are rewritten on save
+        """
+        renumber = {}
+        for slot, peer_id in enumerate(self.slots):
+            if self.live[slot]:
+                renumber[slot] = len(renumber)
+        columns = self.empty_columns()
+        for part in (self.mapped, self.tail):
+            for row in zip(*(part[name] for name, _ in COLUMNS)):
+                if row[1] in renumber:
+                    for (name, _), value in zip(COLUMNS, row):
+                        columns[name].append(renumber[value] if name == "peer" else value)
+        self.slots = [self.slots[slot] for slot in renumber]
+        self.live = bytearray(b"\x01" * len(renumber))
+        self.slot_rows = [self.slot_rows[slot] for slot in renumber]
+        self.current = {peer_id : slot for slot, peer_id in enumerate(self.slots)}
+        self.mapped = self.empty_columns()
+        self.tail = columns
+        self.saved_rows = 0
+        self.rewrite = True
+
+    """
+    disk
+    """
+
+    def save(self):
+        try:
+            os.makedirs(self.dir, exist_ok=True)
+            with self.lock:
+                if self.dead_rows() > max(COMPACT_MIN, self.live_rows()):
+                    self.compact_rows()
+                mode = "wb" if self.rewrite else "ab"
+                for name, _ in COLUMNS:
+                    with open(f"{self.dir}/{name}.col", mode) as file:
+                        self.tail[name].tofile(file)
+                rows = self.saved_rows + len(self.tail["time"])
+                meta = {
+                    "rows" : rows,
+                    "slots" : self.slots,
+                    "live" : list(self.live),
+                    "slot_rows" : self.slot_rows,
+                    "types" : self.types,
+                }
+                with open(f"{self.dir}/meta.json.tmp", "w") as file:
+                    json.dump(meta, file)
+                os.replace(f"{self.dir}/meta.json.tmp", f"{self.dir}/meta.json")
+                self.saved_rows = rows
+                self.tail = self.empty_columns()
+                self.rewrite = False
+                self.remap()
+        except Exception as e:
+            raise CustomException(f"Unable to save history columns! - {e}")
+
+    def load(self):
+        if not os.path.exists(f"{self.dir}/meta.json"):
+            return
+        with open(f"{self.dir}/meta.json", "r") as file:
+            meta = json.load(file)
+        if "types" not in meta: # type column holds opcodes from before, rebuilt from the histories instead
+            raise CustomException(f"{self.dir} has no type table")
+        self.slots = meta["slots"]
+        self.live = bytearray(meta["live"])
+        self.slot_rows = meta["slot_rows"]
+        self.current = {peer_id : slot for slot, peer_id in enumerate(self.slots) if self.live[slot]}
+        self.types = meta["types"]
+        self.type_codes = {msg_type : code for code, msg_type in enumerate(self.types)}
+        self.saved_rows = meta["rows"]
+        for name, code in COLUMNS:
+            fp = f"{self.dir}/{name}.col"
+            length = self.saved_rows * array(code).itemsize
+            if os.path.getsize(fp) < length:
+                raise CustomException(f"{fp} is shorter than its meta")
+            if os.path.getsize(fp) > length: # rows from a save that did not finish
+                os.truncate(fp, length)
+        self.remap()
+
+    def remap(self):
+        """
+        map the saved rows read only, old maps close once no query holds them
+        """
+        mapped = {}
+        for name, code in COLUMNS:
+            if self.saved_rows == 0:
+                mapped[name] = array(code)
+                continue
+            with open(f"{self.dir}/{name}.col", "rb") as file:
+                view = mmap.mmap(file.fileno(), self.saved_rows * array(code).itemsize, access=mmap.ACCESS_READ)
+            mapped[name] = memoryview(view).cast(code)
+        self.mapped = mapped
+
+    """
+    queries
+    filters on every query: since / until (seconds, until exclusive), peers (ids), types (names), inbound (bool)
+    """
+
+    def aggregate(
+            self,
+            by : str = "peer",
+            value : str = "count",
+            bucket : int = 3600,
+            since : int = None,
+            until : int = None,
+            peers : list = None,
+            types : list = None,
+            inbound : bool = None,
+        ) -> dict:
+        """
+        group rows by peer (id), type (name), hour (of day), weekday (0 is Monday), bucket (start of each bucket
+        seconds wide) or inbound, and count them (value="count") or sum their content bytes (value="bytes")
+        """
+        if by not in GROUPINGS:
+            raise CustomException(f"Unknown grouping {by}")
+        if value not in ("count", "bytes"):
+            raise CustomException(f"Unknown value {value}")
+        totals = {}
+        with self.lock:
+            for part in (self.mapped, self.tail):
+                if self.vectorized:
+                    found = self.aggregate_numpy(part, by, value, bucket, since, until, peers, types, inbound)
+                else:
+                    found = self.aggregate_loop(part, by, value, bucket, since, until, peers, types, inbound)
+                for key, total in found.items():
+                    totals[key] = totals.get(key, 0) + total
+            return {self.label(by, key) : total for key, total in totals.items()}
+
+    def size_histogram(self, edges : list, **filters) -> list:
+        """
+        counts of content sizes per bin, bin i is [edges[i - 1], edges[i]), bin 0 is below edges[0] and the last bin
+        is edges[-1] and up
+        """
+        edges = sorted(edges)
+        counts = [0] * (len(edges) + 1)
+        with self.lock:
+            for part in (self.mapped, self.tail):
+                if self.vectorized:
+                    mask = self.mask_numpy(part, **filters)
+                    sizes = np.frombuffer(part["size"], dtype=np.uint32)[mask]
+                    found = np.bincount(np.searchsorted(np.asarray(edges), sizes, side="right"), minlength=len(counts))
+                    for i, count in enumerate(found.tolist()):
+                        counts[i] += count
+                else:
+                    keep = self.filter_loop(**filters)
+                    for row in zip(*(part[name] for name, _ in COLUMNS)):
+                        if keep(row):
+                            counts[bisect_right(edges, row[3])] += 1
+        return counts
+
+    def rows(self) -> int:
+        with self.lock:
+            return self.live_rows()
+
+    def label(self, by : str, key : int):
+        if by == "peer":
+            return self.slots[key]
+        if by == "type":
+            return self.types[key]
+        if by == "inbound":
+            return bool(key)
+        return key
+
+    def mask_numpy(self, part : dict, since = None, until = None, peers = None, types = None, inbound = None):
+        slot_filter = np.frombuffer(bytes(self.live), dtype=np.uint8).astype(bool)
+        if peers is not None:
+            wanted = np.zeros(len(self.slots), dtype=bool)
+            wanted[[self.current[peer_id] for peer_id in peers if peer_id in self.current]] = True
+            slot_filter &= wanted
+        mask = slot_filter[np.frombuffer(part["peer"], dtype=np.uint32)]
+        if since is not None or until is not None:
+            times = np.frombuffer(part["time"], dtype=np.int64)
+            if since is not None:
+                mask &= times >= since
+            if until is not None:
+                mask &= times < until
+        if types is not None:
+            mask &= np.isin(np.frombuffer(part["type"], dtype=np.uint16), [self.type_codes[t] for t in types if t in self.type_codes])
+        if inbound is not None:
+            mask &= np.frombuffer(part["inbound"], dtype=np.uint8) == int(inbound)
+        return mask
+
+    def aggregate_numpy(self, part, by, value, bucket, since, until, peers, types, inbound) -> dict:
+        if len(part["time"]) == 0:
+            return {}
+        mask = self.mask_numpy(part, since, until, peers, types, inbound)
+        if by == "peer":
+            keys = np.frombuffer(part["peer"], dtype=np.uint32)[mask]
+        elif by == "type":
+            keys = np.frombuffer(part["type"], dtype=np.uint16)[mask]
+        elif by == "inbound":
+            keys = np.frombuffer(part["inbound"], dtype=np.uint8)[mask]
+        else:
+            times = np.frombuffer(part["time"], dtype=np.int64)[mask]
+            if by == "hour":
+                keys = times % 86400 // 3600
+            elif by == "weekday":
+                keys = (times // 86400 + 3) % 7 # 1970-01-01 was a Thursday
+            else:
+                keys = times // bucket
+        if len(keys) == 0:
+            return {}
+        weights = np.frombuffer(part["size"], dtype=np.uint32)[mask].astype(np.float64) if value == "bytes" else None
+        keys = keys.astype(np.int64)
+        low = int(keys.min())
+        span = int(keys.max()) - low + 1
+        if span <= 4 * len(keys) + 1024: # dense enough to count straight into an array
+            found = np.bincount(keys - low, weights=weights, minlength=span)
+            present = np.nonzero(found if weights is None else np.bincount(keys - low, minlength=span))[0]
+            keys, found = present + low, found[present]
+        else: # sparse buckets over a long span
+            keys, inverse = np.unique(keys, return_inverse=True)
+            found = np.bincount(inverse, weights=weights)
+        if by == "bucket":
+            keys = keys * bucket
+        return dict(zip(keys.tolist(), (int(total) for total in found.tolist())))
+
+    def filter_loop(self, since = None, until = None, peers = None, types = None, inbound = None):
+        slots = {slot for slot in range(len(self.slots)) if self.live[slot]}
+        if peers is not None:
+            slots &= {self.current[peer_id] for peer_id in peers if peer_id in self.current}
+        codes = None if types is None else {self.type_codes[t] for t in types if t in self.type_codes}
+
+        def keep(row : tuple) -> bool:
+            return (
+                row[1] in slots
+                and (since is None or row[0] >= since)
+                and (until is None or row[0] < until)
+                and (codes is None or row[2] in codes)
+                and (inbound is None or row[4] == int(inbound))
+            )
+        return keep
+
+    def aggregate_loop(self, part, by, value, bucket, since, until, peers, types, inbound) -> dict:
+        keep = self.filter_loop(since, until, peers, types, inbound)
+        found = {}
+        for row in zip(*(part[name] for name, _ in COLUMNS)):
+            if not keep(row):
+                continue
+            if by == "peer":
+                key = row[1]
+            elif by == "type":
+                key = row[2]
+            elif by == "inbound":
+                key = row[4]
+            elif by == "hour":
+                key = row[0] % 86400 // 3600
+            elif by == "weekday":
+                key = (row[0] // 86400 + 3) % 7
+            else:
+                key = row[0] // bucket * bucket
+            found[key] = found.get(key, 0) + (row[3] if value == "bytes" else 1)
+        return found
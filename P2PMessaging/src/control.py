@@ -0,0 +1,432 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+control.py
+ControlServer class exposing a Client over a Unix domain socket with a JSON lines protocol, and ControlClient for driving it from scripts
+
+requests are one JSON object per line:
+    {"id": 1, "op": "send", "peer_id": "aa:bb", "content": "hi"}
+responses echo the id:
+    {"id": 1, "ok": true, "result": "Sent Message!"}
+    {"id": 1, "ok": false, "error": "..."}
+after a subscribe, events arrive on the same socket with no id:
+    {"event": "message", "peer_id": "aa:bb", "type": "TEXT_MESSAGE_REQUEST", "content": "hi", ...}
+"""
+
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+
+from client import Client
+from identification import Identification
+from message import Message
+from exception import CustomException
+from handoff import bind_private, same_user
+from logs import get_logger
+
+SEND_TYPES = ("TEXT_MESSAGE_REQUEST", "TEXT_MESSAGE_RESPONSE") # op send only writes text, friend has its own op
+
+class ControlSession(socketserver.StreamRequestHandler):
+    """
+    one connected controller, requests are handled in order, responses and events share one writer thread
+    """
+
+    def setup(self):
+        super().setup()
+        self.client = self.server.client
+        self.outgoing = queue.Queue()
+        self.subscribed_types = None # None = not subscribed, empty set = every type
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def handle(self):
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                self.reply(None, error=f"Bad JSON: {e}")
+                continue
+            request_id = request.get("id")
+            try:
+                op = getattr(self, f"op_{request.get('op')}", None)
+                if op is None:
+                    raise CustomException(f"Unknown op {request.get('op')}")
+                self.reply(request_id, result=op(request))
+            except CustomException as e:
+                self.reply(request_id, error=e.message)
+            except Exception as e:
+                self.reply(request_id, error=str(e))
+
+    def finish(self):
+        self.client.unsubscribe(self.on_event)
+        self.outgoing.put(None)
+        self.writer.join(timeout=1)
+        super().finish()
+
+    def reply(self, request_id, result = None, error : str = None):
+        if error is None:
+            self.outgoing.put({"id" : request_id, "ok" : True, "result" : result})
+        else:
+            self.outgoing.put({"id" : request_id, "ok" : False, "error" : error})
+
+    def write_loop(self):
+        """
+        batch whatever is queued into one write, keeps event floods from turning into one syscall each
+        """
+        while True:
+            item = self.outgoing.get()
+            if item is None:
+                return
+            lines = [json.dumps(item)]
+            while True:
+                try:
+                    item = self.outgoing.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.wfile.write(("\n".join(lines) + "\n").encode("utf-8"))
+                    return
+                lines.append(json.dumps(item))
+            try:
+                self.wfile.write(("\n".join(lines) + "\n").encode("utf-8"))
+                self.wfile.flush()
+            except OSError:
+                return
+
+    def on_event(self, event : str, **data):
+        """
+        client listener, runs on network threads so it only queues
+        """
+        if self.subscribed_types is None:
+            return
+        peer = data.get("peer")
+        out = {"event" : event, "peer_id" : peer.get_id() if peer else None, "peer_name" : peer.get_name() if peer else None}
+        message = data.get("message")
+        if message is not None:
+            if self.subscribed_types and message.get_type() not in self.subscribed_types:
+                return
+            out.update(message_to_dict(message))
+        self.outgoing.put(out)
+
+    # ops
+
+    def op_ping(self, request : dict):
+        return "pong"
+
+    def op_whoami(self, request : dict):
+        return identification_to_dict(self.client.identification)
+
+    def op_connect(self, request : dict):
+        """
+        by peer_id (directory lookup) or by ip and port
+        """
+        if "peer_id" in request:
+            return self.client.start_conn_by_id(request["peer_id"])
+        return self.client.start_conn((request["ip"], int(request["port"])))
+
+    def op_send(self, request : dict):
+        """
+        one message (content) or many (contents) to one peer, offline peers get it through the outbox
+        type is one of SEND_TYPES, protocol frames (friend responses, backups, ...) can not be forged from here
+        """
+        msg_type = request.get("type", "TEXT_MESSAGE_REQUEST")
+        if msg_type not in SEND_TYPES:
+            raise CustomException(f"Can not send messages of type {msg_type}")
+        receiver = self.find_peer(request["peer_id"])
+        if "contents" in request:
+            return [self.client.send_to(receiver, content, msg_type) for content in request["contents"]]
+        return self.client.send_to(receiver, request["content"], msg_type)
+
+    def op_subscribe(self, request : dict):
+        """
+        start streaming events, optionally only messages of the given types
+        """
+        self.subscribed_types = set(request.get("types", []))
+        self.client.unsubscribe(self.on_event)
+        self.client.subscribe(self.on_event)
+        return True
+
+    def op_unsubscribe(self, request : dict):
+        self.subscribed_types = None
+        self.client.unsubscribe(self.on_event)
+        return True
+
+    def op_history(self, request : dict):
+        """
+        last `limit` messages with a peer, oldest first
+        """
+        history = self.client.hash_table.read_history(self.find_peer(request["peer_id"]))
+        limit = request.get("limit")
+        if limit:
+            history = history[-int(limit):]
+        return [message_to_dict(message) for message in history]
+
+    def op_inbox(self, request : dict):
+        """
+        newest `limit` messages across every peer, newest first. pass the returned cursor back for older ones, or the
+        returned head (with no cursor) for only what arrived since
+        """
+        table = self.client.hash_table
+        if "head" in request:
+            messages, head = table.inbox_since(request["head"])
+            return {"messages" : [message_to_dict(message) for message in messages], "head" : head}
+        head = table.inbox_ends() if request.get("cursor") is None else None
+        messages, cursor = table.inbox(int(request.get("limit", 50)), request.get("cursor"))
+        return {"messages" : [message_to_dict(message) for message in messages], "cursor" : cursor, "head" : head}
+
+    def op_read(self, request : dict):
+        """
+        mark a peer's messages read up to `key`, or up to their newest message, returns the key used
+        """
+        peer = self.find_peer(request["peer_id"])
+        for message in reversed(self.client.hash_table.read_history(peer)):
+            if message.get_sender().get_id() != peer.get_id():
+                continue
+            if request.get("key") in (None, message.get_key()):
+                self.client.mark_read(peer, message)
+                return message.get_key()
+        raise CustomException(f"No message to mark read from {peer.get_id()}")
+
+    def op_friend(self, request : dict):
+        """
+        action is request, accept, or end
+        """
+        peer = self.find_peer(request["peer_id"])
+        action = request.get("action", "request")
+        if action == "request":
+            return self.client.request_friend(peer)
+        if action == "accept":
+            return self.client.accept_friend(peer)
+        if action == "end":
+            return self.client.end_friendship(peer)
+        raise CustomException(f"Unknown friend action {action}")
+
+    def op_friends(self, request : dict):
+        roster = self.client.friends
+        return {
+            "friends" : [identification_to_dict(peer) for peer in roster.get_friends()],
+            "requested" : [identification_to_dict(peer) for peer in list(roster.requested.values())],
+            "pending" : [identification_to_dict(peer) for peer in list(roster.pending.values())],
+        }
+
+    def op_connections(self, request : dict):
+        return [identification_to_dict(conn.get_receiver()) for conn in list(self.client.connections)]
+
+    def op_peers(self, request : dict):
+        return [identification_to_dict(peer) for peer in self.client.directory.get_peers()]
+
+    def op_analytics(self, request : dict):
+        """
+        grouped counts or content bytes over every history (by, value, bucket), or a size histogram when edges is
+        given, both with the since, until, peers, types, and inbound filters, see HistoryColumns
+        """
+        columns = self.client.hash_table.analytics()
+        filters = {k : request[k] for k in ("since", "until", "peers", "types", "inbound") if k in request}
+        if "edges" in request:
+            return columns.size_histogram(request["edges"], **filters)
+        grouping = {k : request[k] for k in ("by", "value", "bucket") if k in request}
+        return [[key, total] for key, total in columns.aggregate(**grouping, **filters).items()]
+
+    def op_capture(self, request : dict):
+        """
+        write the capture ring to `path` (or the default in the data directory), returns the path and ring stats
+        """
+        return {"path" : self.client.save_capture(request.get("path")), **self.client.capture.stats()}
+
+    def op_backup(self, request : dict):
+        """
+        backup state, with "now" a push round runs first and what it sent is returned too
+        """
+        if self.client.backups is None:
+            raise CustomException("Backups are not configured")
+        result = {"stats" : self.client.backups.stats()}
+        if request.get("now"):
+            result["sent"] = self.client.backups.push_round()
+        return result
+
+    def op_restore(self, request : dict):
+        """
+        pull our history back from the backup friends (connect to them first), merged into what is here
+        """
+        if self.client.backups is None:
+            raise CustomException("Backups are not configured")
+        return self.client.backups.restore()
+
+    def op_search(self, request : dict):
+        """
+        newest first, messages containing `text` within since and until (datetimes), from `peers` or everyone, archived
+        history included
+        """
+        messages = self.client.hash_table.search_history(
+            request.get("text"), request.get("peers"), request.get("since"), request.get("until"), int(request.get("limit", 50)))
+        return [message_to_dict(message) for message in messages]
+
+    def op_archive(self, request : dict):
+        """
+        archived messages and compressed bytes per peer and the last compaction, with "now" a compaction runs first
+        """
+        compactor = self.client.compactor
+        result = {}
+        if request.get("now"):
+            if compactor is None:
+                raise CustomException("Retention is not configured")
+            result["run"] = compactor.run()
+        archive = self.client.hash_table.archive
+        result["peers"] = {peer_id : {"count" : archive.count(peer_id), "bytes" : archive.size(peer_id)} for peer_id in archive.peers()}
+        result["last_run"] = compactor.last_run if compactor else None
+        return result
+
+    def op_stats(self, request : dict):
+        return self.client.get_stats()
+
+    def op_outbox(self, request : dict):
+        return self.client.outbox_stats()
+
+    def op_shutdown(self, request : dict):
+        threading.Thread(target=self.server.owner.stop, daemon=True).start()
+        return True
+
+    def find_peer(self, peer_id : str) -> Identification:
+        """
+        live connection first, then the directory
+        """
+        conn = self.client.get_conn(peer_id)
+        if conn:
+            return conn.get_receiver()
+        peer = self.client.directory.lookup(peer_id)
+        if peer is None:
+            raise CustomException(f"Unknown peer {peer_id}")
+        return peer
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        bind_private(self.socket, self.server_address) # only our user can drive the client
+        self.server_address = self.socket.getsockname()
+
+    def verify_request(self, request, client_address) -> bool:
+        return same_user(request)
+
+
+class ControlServer:
+    """
+    serves ControlSessions on a Unix domain socket
+    """
+
+    def __init__(self, client : Client, path : str, owner = None):
+        self.client = client
+        self.path = path
+        if os.path.exists(path):
+            os.remove(path) # stale socket from a previous run
+        self.server = _UnixServer(path, ControlSession)
+        self.server.client = client
+        self.server.owner = owner if owner else self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.logger = get_logger("control")
+
+    def start(self):
+        self.thread.start()
+        self.logger.info("Control API listening on %s", self.path)
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ControlClient:
+    """
+    small blocking client for the control API, events received while waiting for a reply are kept for events()
+    """
+
+    def __init__(self, path : str):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(path)
+        self.file = self.socket.makefile("rwb")
+        self.next_id = 0
+        self.pending_events = []
+
+    def call(self, op : str, **args):
+        self.next_id += 1
+        request = dict(args, id=self.next_id, op=op)
+        self.file.write((json.dumps(request) + "\n").encode("utf-8"))
+        self.file.flush()
+        while True:
+            reply = self.read()
+            if "event" in reply:
+                self.pending_events.append(reply)
+                continue
+            if reply.get("id") != self.next_id:
+                continue
+            if not reply["ok"]:
+                raise CustomException(reply["error"])
+            return reply["result"]
+
+    def send_many(self, ops : list) -> list:
+        """
+        pipeline several requests (list of (op, args) pairs) in one write, then collect every reply
+        """
+        first = self.next_id + 1
+        lines = []
+        for op, args in ops:
+            self.next_id += 1
+            lines.append(json.dumps(dict(args, id=self.next_id, op=op)))
+        self.file.write(("\n".join(lines) + "\n").encode("utf-8"))
+        self.file.flush()
+        replies = {}
+        while len(replies) < len(ops):
+            reply = self.read()
+            if "event" in reply:
+                self.pending_events.append(reply)
+            elif first <= reply.get("id", 0) <= self.next_id:
+                replies[reply["id"]] = reply
+        return [replies[i] for i in range(first, self.next_id + 1)]
+
+    def read(self) -> dict:
+        line = self.file.readline()
+        if not line:
+            raise CustomException("Control socket closed!")
+        return json.loads(line)
+
+    def events(self):
+        """
+        yield events forever, blocking for new ones
+        """
+        while True:
+            while self.pending_events:
+                yield self.pending_events.pop(0)
+            reply = self.read()
+            if "event" in reply:
+                yield reply
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+def identification_to_dict(identification : Identification) -> dict:
+    return {
+        "name" : identification.get_name(),
+        "id" : identification.get_id(),
+        "ip" : identification.get_ip(),
+        "port" : identification.get_port(),
+    }
+
+def message_to_dict(message : Message) -> dict:
+    return {
+        "type" : message.get_type(),
+        "content" : message.get_content(),
+        "datetime" : message.get_datetime(),
+        "sender_id" : message.get_sender().get_id(),
+        "receiver_id" : message.get_receiver().get_id(),
+        "key" : message.get_key(),
+    }
@@ -0,0 +1,174 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+daemon.py
+Headless entry point: starts a Client from flags or a config file and exposes it over the control API instead of the CLI
+
+python3 daemon.py --name bot --port 5000
+python3 daemon.py --config bot.json
+python3 daemon.py --config bot.json --takeover  (replaces a running --handoff daemon without dropping its peers)
+"""
+
+import argparse
+import json
+import os
+import signal
+import socket
+import threading
+import uuid
+
+from identification import Identification
+from client import Client
+from control import ControlServer
+from logs import configure
+from admission import AdmissionPolicy
+from handoff import HandoffServer, request_handoff, take_over, handoff_path
+
+DEFAULTS = {
+    "name" : "daemon",
+    "id" : None, # machine MAC like the UI uses when not given
+    "ip" : None, # machine ip when not given
+    "port" : None,
+    "data_dir" : "../data",
+    "control" : None, # defaults to <data_dir>/<id>.sock
+    "discovery" : False,
+    "friends_only" : False, # keep history only for friends
+    "admission" : None, # {"max_connections": 256, "rate": 5, ...}, see AdmissionPolicy
+    "datagrams" : False, # offer the UDP path for small messages to peers that also have it
+    "capture" : 0, # bytes of recent frames kept for replay.py, 0 is off
+    "metrics_port" : None,
+    "log_levels" : None, # {"message": "DEBUG", ...}, see logs.CATEGORIES
+    "log_samples" : None, # {"message": 1} keeps every per frame record
+    "handoff" : False, # serve <data_dir>/<id>.handoff.sock so a --takeover process can replace this one live
+    "takeover" : False, # take the sockets of the --handoff daemon with the same id instead of binding
+    "backup" : None, # {"friends": [...], "replicas": 2, "rate": 262144}, see BackupManager, passphrase from P2P_BACKUP_PASSPHRASE if not here
+    "retention" : None, # {"max_age": 31536000, "max_bytes": 1073741824, "peers": {"<id>": {"max_count": 10000}}, "hot_messages": 1000}, see Compactor
+    "max_attachment" : 1073741824, # bytes, larger offers from friends are refused
+}
+
+class Daemon:
+    """
+    runs one Client plus its ControlServer until stopped
+    """
+
+    def __init__(self, config : dict):
+        self.config = dict(DEFAULTS, **{k : v for k, v in config.items() if v is not None})
+        if self.config["port"] is None:
+            raise ValueError("port is required")
+        if self.config["id"] is None:
+            self.config["id"] = ':'.join(['{:02x}'.format((uuid.getnode() >> elements) & 0xff) for elements in range(0, 2 * 6, 8)][::-1])
+        if self.config["ip"] is None:
+            self.config["ip"] = socket.gethostbyname(socket.gethostname())
+        if self.config["control"] is None:
+            self.config["control"] = f"{self.config['data_dir']}/{self.config['id']}.sock"
+
+        self.identification = Identification(
+            name = self.config["name"],
+            id = self.config["id"],
+            ip = self.config["ip"],
+            port = str(self.config["port"]),
+        )
+        backup = self.config["backup"]
+        if backup is not None and not backup.get("passphrase"):
+            backup = dict(backup, passphrase=os.environ.get("P2P_BACKUP_PASSPHRASE"))
+
+        handoff_channel = None
+        if self.config["takeover"]:
+            # before the Client exists, it has to load history the old process saved for the handoff
+            handoff_state, handoff_fds, handoff_channel = request_handoff(handoff_path(self.config["data_dir"], self.config["id"]))
+        self.client = Client(
+            self.identification,
+            self.config["data_dir"],
+            bind=not self.config["takeover"],
+            friends_only=self.config["friends_only"],
+            admission=AdmissionPolicy(**self.config["admission"]) if self.config["admission"] else None,
+            datagrams=self.config["datagrams"],
+            capture=self.config["capture"],
+            handoff=self.config["handoff"],
+            backup=backup,
+            retention=self.config["retention"],
+            max_attachment=self.config["max_attachment"],
+        )
+        configure(self.config["log_levels"], self.config["log_samples"])
+        if handoff_channel:
+            try:
+                take_over(self.client, handoff_state, handoff_fds)
+                handoff_channel.recv(1) # closed once the old process is done, its control socket is gone by then
+            finally:
+                handoff_channel.close()
+        self.control = ControlServer(self.client, self.config["control"], owner=self)
+        self.handoff = None
+        if self.config["handoff"]:
+            self.handoff = HandoffServer(self.client, handoff_path(self.config["data_dir"], self.config["id"]), on_done=self.stop)
+        self.stopping = False
+        self.stopped = threading.Event()
+
+    def start(self):
+        if not self.config["takeover"]: # already serving what it took over
+            self.client.start_listening()
+        if self.config["discovery"]:
+            self.client.start_discovery()
+        if self.config["metrics_port"] is not None:
+            self.client.start_metrics_server(int(self.config["metrics_port"]))
+        self.control.start()
+        if self.handoff:
+            self.handoff.start()
+
+    def stop(self):
+        if self.stopping:
+            return
+        self.stopping = True
+        if self.handoff:
+            self.handoff.stop()
+        self.control.stop()
+        self.client.stop()
+        self.stopped.set() # only now, wait() returning lets the process exit
+
+    def wait(self):
+        self.stopped.wait()
+
+
+def parse_args() -> dict:
+    parser = argparse.ArgumentParser(description="run a P2PMessaging client without the CLI")
+    parser.add_argument("--config", help="JSON file with any of the options below")
+    parser.add_argument("--name")
+    parser.add_argument("--id")
+    parser.add_argument("--ip")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--data-dir", dest="data_dir")
+    parser.add_argument("--control", help="path of the control Unix socket")
+    parser.add_argument("--discovery", action="store_true", default=None, help="announce and discover peers on the LAN")
+    parser.add_argument("--friends-only", dest="friends_only", action="store_true", default=None, help="keep history only for friends")
+    parser.add_argument("--datagrams", action="store_true", default=None, help="send small messages over UDP to peers that support it")
+    parser.add_argument("--capture", type=int, metavar="BYTES", help="keep the newest BYTES of frames for replay.py, saved on stop or with the capture op")
+    parser.add_argument("--metrics-port", dest="metrics_port", type=int, help="serve Prometheus metrics on localhost")
+    parser.add_argument("--handoff", action="store_true", default=None, help="let a --takeover process replace this one without dropping peers")
+    parser.add_argument("--takeover", action="store_true", default=None, help="take over the sockets of the running --handoff daemon with this id")
+    parser.add_argument("--log-level", dest="log_levels", action="append", metavar="CATEGORY=LEVEL", help="per category log level, can repeat")
+    args = vars(parser.parse_args())
+    if args["log_levels"]:
+        args["log_levels"] = dict(item.split("=", 1) for item in args["log_levels"])
+
+    config = {}
+    config_path = args.pop("config")
+    if config_path:
+        with open(config_path, 'r') as file:
+            config = json.load(file)
+    # flags win over the config file
+    config.update({k : v for k, v in args.items() if v is not None})
+    return config
+
+def main():
+    daemon = Daemon(parse_args())
+    daemon.start()
+    print(f"{daemon.identification.get_name()} ({daemon.identification.get_id()}) listening on port {daemon.identification.get_port()}, control socket {daemon.config['control']}")
+
+    def on_signal(signum, frame):
+        threading.Thread(target=daemon.stop).start()
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+    daemon.wait()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+datagram.py
+DatagramChannel class, an optional UDP path next to a peer's TCP connection for small interactive messages, with its
+own sequence numbers, selective acks, and retransmit timers
+
+packets:
+    DATA: kind (1) | seq (4) | floor (4) | encoded Message
+    ACK:  kind (1) | cumulative (4) | count (1) | count x (start (4), end (4))
+floor is the lowest seq the sender still retransmits, cumulative is the first seq the receiver is missing and each
+(start, end) is a run it has above that. a message is handed up as soon as its packet arrives, so a lost packet never
+holds up the ones behind it the way it does on a TCP stream. a message that runs out of retries goes back to the stream
+"""
+
+import base64
+import random
+import socket
+import struct
+import threading
+import time
+
+from logs import get_logger
+
+DATA = 1
+ACK = 2
+DATA_HEADER = struct.Struct("!BII") # kind, seq, floor
+ACK_HEADER = struct.Struct("!BIB") # kind, cumulative, sack count
+SACK_BLOCK = struct.Struct("!II") # start, end (exclusive)
+MAX_PAYLOAD = 1200 # encoded message bytes per packet, stays under the smallest common MTU
+MAX_SACK = 4 # runs per ack, the ones nearest cumulative matter most
+INITIAL_RTO = 0.2
+MIN_RTO = 0.02
+MAX_RTO = 2.0
+MAX_RETRIES = 6 # then the message is sent on the stream instead
+DUP_THRESH = 3 # acked packets after a missing one before it is resent without waiting for its timer
+
+class Outstanding:
+    """
+    a sent packet waiting for its ack
+    """
+
+    __slots__ = ("packet", "first_sent", "deadline", "retries", "fast")
+
+    def __init__(self, packet : bytes, now : float, rto : float):
+        self.packet = packet
+        self.first_sent = now
+        self.deadline = now + rto
+        self.retries = 0
+        self.fast = False # already fast retransmitted once
+
+
+class DatagramPeer:
+    """
+    both directions of the datagram path with one peer
+    """
+
+    def __init__(self, addr : tuple, conn):
+        self.addr = addr
+        self.conn = conn
+        # sending
+        self.next_seq = 0
+        self.unacked = {} # seq -> Outstanding
+        self.srtt = None
+        self.rttvar = 0.0
+        self.rto = INITIAL_RTO
+        # receiving
+        self.expected = 0 # first seq not received yet
+        self.above = set() # received seqs past expected
+
+    def floor(self) -> int:
+        return min(self.unacked) if self.unacked else self.next_seq
+
+    def sample_rtt(self, rtt : float):
+        """
+        RFC 6298 smoothing, only fed by packets that were never resent
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(MAX_RTO, max(MIN_RTO, self.srtt + 4 * self.rttvar))
+
+    def receive(self, seq : int, floor : int) -> bool:
+        """
+        note a data packet, False if it was a duplicate
+        """
+        if floor > self.expected: # sender gave up on everything below floor
+            self.expected = floor
+            self.above = {s for s in self.above if s >= floor}
+        if seq < self.expected or seq in self.above:
+            return False
+        self.above.add(seq)
+        while self.expected in self.above:
+            self.above.discard(self.expected)
+            self.expected += 1
+        return True
+
+    def snapshot(self) -> dict:
+        """
+        sequence state and unacked packets, for a process taking over the channel (handoff.py)
+        """
+        return {
+            "addr" : list(self.addr),
+            "next_seq" : self.next_seq,
+            "unacked" : [base64.b64encode(out.packet).decode("ascii") for _, out in sorted(self.unacked.items())],
+            "srtt" : self.srtt,
+            "rttvar" : self.rttvar,
+            "rto" : self.rto,
+            "expected" : self.expected,
+            "above" : sorted(self.above),
+        }
+
+    def restore(self, state : dict):
+        """
+        carry on from snapshot, the unacked packets are resent when their fresh timers run out
+        """
+        now = time.monotonic()
+        self.next_seq = state["next_seq"]
+        self.srtt = state["srtt"]
+        self.rttvar = state["rttvar"]
+        self.rto = state["rto"]
+        self.expected = state["expected"]
+        self.above = set(state["above"])
+        for encoded in state["unacked"]:
+            packet = base64.b64decode(encoded)
+            _, seq, _ = DATA_HEADER.unpack_from(packet)
+            self.unacked[seq] = Outstanding(packet, now, self.rto)
+
+    def ack_packet(self) -> bytes:
+        runs = []
+        for seq in sorted(self.above):
+            if runs and runs[-1][1] == seq:
+                runs[-1][1] += 1
+            elif len(runs) == MAX_SACK:
+                break
+            else:
+                runs.append([seq, seq + 1])
+        return ACK_HEADER.pack(ACK, self.expected, len(runs)) + b"".join(SACK_BLOCK.pack(*run) for run in runs)
+
+
+class DatagramChannel:
+    """
+    one UDP socket on the client's ip and port, peers are attached once the handshake says both ends have one
+    deliver(data, conn) is called for every new message, fallback(data, conn) for ones that ran out of retries
+    loss drops that share of outgoing packets on purpose, for benchmarks
+    sock is an already bound socket to use instead of binding one (handed over by a previous process)
+    """
+
+    def __init__(
+            self,
+            binding : tuple,
+            deliver,
+            fallback,
+            loss : float = 0.0,
+            seed : int = None,
+            sock : socket.socket = None,
+        ):
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(binding)
+        self.sock = sock
+        self.port = self.sock.getsockname()[1]
+        self.deliver = deliver
+        self.fallback = fallback
+        self.loss = loss
+        self.rng = random.Random(seed)
+        self.peers = {} # (ip, port) -> DatagramPeer
+        self.lock = threading.Lock()
+        self.timer = threading.Condition(self.lock)
+        self.running = True
+        self.threads = []
+        self.retransmits = None # counter family labeled by reason, set by the client
+        self.logger = get_logger("datagram")
+
+    def start(self):
+        for target in (self.read_loop, self.timer_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+            self.timer.notify()
+        self.sock.close()
+        for thread in self.threads:
+            thread.join(timeout=1)
+
+    def release(self):
+        """
+        stop both threads but leave the socket open, another process carries on with it
+        """
+        with self.lock:
+            self.running = False
+            self.timer.notify()
+        try:
+            self.sock.sendto(b"", self.sock.getsockname()) # wakes the read loop, empty packets are dropped
+        except OSError:
+            pass
+        for thread in self.threads:
+            thread.join(timeout=1)
+        self.threads = []
+
+    def attach(self, conn, addr : tuple) -> DatagramPeer:
+        with self.lock:
+            peer = self.peers[addr] = DatagramPeer(addr, conn)
+            return peer
+
+    def detach(self, peer : DatagramPeer):
+        with self.lock:
+            if self.peers.get(peer.addr) is peer:
+                del self.peers[peer.addr]
+            peer.unacked = {}
+
+    def in_flight(self) -> int:
+        return sum(len(peer.unacked) for peer in list(self.peers.values()))
+
+    """
+    sending
+    """
+
+    def send(self, peer : DatagramPeer, data : bytes):
+        """
+        send one encoded message, retransmitted until acked
+        """
+        with self.lock:
+            packet = DATA_HEADER.pack(DATA, peer.next_seq, peer.floor()) + data
+            seq = peer.next_seq
+            peer.next_seq += 1
+            now = time.monotonic()
+            peer.unacked[seq] = Outstanding(packet, now, peer.rto)
+            self.timer.notify()
+        self.transmit(packet, peer.addr)
+
+    def transmit(self, packet : bytes, addr : tuple):
+        if self.loss and self.rng.random() < self.loss:
+            return
+        try:
+            self.sock.sendto(packet, addr)
+        except OSError as e:
+            self.logger.debug("Datagram to %s failed: %s", addr, e)
+
+    def count(self, reason : str):
+        if self.retransmits is not None:
+            self.retransmits.labels(reason).inc()
+
+    def timer_loop(self):
+        """
+        resend packets whose timer ran out, backing off, and give up on them after MAX_RETRIES
+        """
+        with self.lock:
+            while self.running:
+                now = time.monotonic()
+                resend = []
+                give_up = []
+                next_deadline = None
+                for peer in self.peers.values():
+                    for seq, out in list(peer.unacked.items()):
+                        if out.deadline <= now:
+                            if out.retries >= MAX_RETRIES:
+                                del peer.unacked[seq]
+                                give_up.append((out.packet[DATA_HEADER.size:], peer.conn))
+                                continue
+                            out.retries += 1
+                            out.deadline = now + min(MAX_RTO, peer.rto * 2 ** out.retries)
+                            resend.append((out.packet, peer.addr))
+                        if next_deadline is None or out.deadline < next_deadline:
+                            next_deadline = out.deadline
+                if resend or give_up:
+                    self.lock.release()
+                    try:
+                        for packet, addr in resend:
+                            self.count("timeout")
+                            self.transmit(packet, addr)
+                        for data, conn in give_up:
+                            self.count("fallback")
+                            self.fallback(data, conn)
+                    finally:
+                        self.lock.acquire()
+                    continue
+                self.timer.wait(None if next_deadline is None else max(0.0, next_deadline - now))
+
+    """
+    receiving
+    """
+
+    def read_loop(self):
+        while self.running:
+            try:
+                packet, addr = self.sock.recvfrom(65535)
+            except OSError:
+                if not self.running:
+                    break
+                continue
+            try:
+                self.handle(packet, addr)
+            except Exception as e:
+                self.logger.error("Exception raised handling datagram from %s: %s", addr, e)
+
+    def handle(self, packet : bytes, addr : tuple):
+        peer = self.peers.get(addr)
+        if peer is None or not packet: # only attached peers, anything else is dropped
+            return
+        if packet[0] == DATA:
+            _, seq, floor = DATA_HEADER.unpack_from(packet)
+            with self.lock:
+                new = peer.receive(seq, floor)
+                ack = peer.ack_packet()
+            self.transmit(ack, addr)
+            if new:
+                self.deliver(packet[DATA_HEADER.size:], peer.conn)
+        elif packet[0] == ACK:
+            _, cumulative, count = ACK_HEADER.unpack_from(packet)
+            runs = [SACK_BLOCK.unpack_from(packet, ACK_HEADER.size + i * SACK_BLOCK.size) for i in range(count)]
+            self.handle_ack(peer, cumulative, runs)
+
+    def handle_ack(self, peer : DatagramPeer, cumulative : int, runs : list):
+        now = time.monotonic()
+        fast = []
+        with self.lock:
+            for seq in list(peer.unacked):
+                if seq < cumulative or any(start <= seq < end for start, end in runs):
+                    out = peer.unacked.pop(seq)
+                    if out.retries == 0:
+                        peer.sample_rtt(now - out.first_sent)
+            # packets acked past a hole mean the hole was lost, not late
+            highest = max((end for _, end in runs), default=cumulative) - 1
+            for seq, out in peer.unacked.items():
+                if seq + DUP_THRESH <= highest and not out.fast:
+                    out.fast = True
+                    out.retries += 1
+                    out.deadline = now + peer.rto * 2 ** out.retries
+                    fast.append(out.packet)
+        for packet in fast:
+            self.count("fast")
+            self.transmit(packet, peer.addr)
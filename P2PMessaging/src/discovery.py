@@ -0,0 +1,237 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+discovery.py
+PeerDirectory class for remembering where peers were last seen, and Discovery class for finding peers on the LAN via UDP announcements
+"""
+
+import socket
+import struct
+import threading
+import json
+import time
+
+from identification import Identification
+from exception import CustomException
+from logs import get_logger
+
+DISCOVERY_GROUP = "239.255.77.77" # multicast group, use a broadcast address (ex: 127.255.255.255) for broadcast mode
+DISCOVERY_PORT = 47474
+ANNOUNCE_INTERVAL = 5 # seconds between announcements
+PEER_TTL = 24 * 60 * 60 # seconds a directory entry stays valid without being seen again
+
+class PeerDirectory:
+    """
+    persistent, ttl expiring directory of peer id -> last known address
+    """
+
+    def __init__(
+            self,
+            host : Identification,
+            data_dir : str = "../data",
+            ttl : float = PEER_TTL,
+        ):
+        self.host = host
+        self.ttl = ttl
+        self.fp = f"{data_dir}/{host.get_id()}_peers.json"
+        self.peers = {}
+        self.lock = threading.Lock()
+
+        # load directory if it exists, otherwise start empty
+        try:
+            self.load()
+        except CustomException:
+            self.peers = {}
+
+    def update(self, peer : Identification, ip : str = None, port : str = None):
+        """
+        record where a peer was seen, ip and port override what the peer reported about itself
+        """
+        # never record ourselves
+        if peer.get_id() == self.host.get_id():
+            return
+        with self.lock:
+            self.peers[peer.get_id()] = {
+                "name" : peer.get_name(),
+                "ip" : ip if ip else peer.get_ip(),
+                "port" : str(port) if port else str(peer.get_port()),
+                "last_seen" : time.time(),
+            }
+
+    def lookup(self, peer_id : str) -> Identification:
+        """
+        get the last known address of a peer, None if unknown or expired
+        """
+        with self.lock:
+            entry = self.peers.get(peer_id)
+            if entry is None:
+                return None
+            if time.time() - entry["last_seen"] > self.ttl:
+                del self.peers[peer_id]
+                return None
+            return Identification(entry["name"], peer_id, entry["ip"], entry["port"])
+
+    def get_peers(self) -> list:
+        """
+        get every unexpired peer as a list of Identification objs, most recently seen first
+        """
+        self.expire()
+        with self.lock:
+            entries = sorted(self.peers.items(), key=lambda item: item[1]["last_seen"], reverse=True)
+            return [Identification(entry["name"], peer_id, entry["ip"], entry["port"]) for peer_id, entry in entries]
+
+    def expire(self) -> int:
+        """
+        drop entries older than the ttl, returns number dropped
+        """
+        now = time.time()
+        with self.lock:
+            expired = [peer_id for peer_id, entry in self.peers.items() if now - entry["last_seen"] > self.ttl]
+            for peer_id in expired:
+                del self.peers[peer_id]
+        return len(expired)
+
+    def save(self):
+        """
+        save directory to disk
+        """
+        self.expire()
+        try:
+            with self.lock:
+                with open(self.fp, 'w') as file:
+                    json.dump(self.peers, file)
+        except Exception as e:
+            raise CustomException(f"Unable to save to file! - {e}")
+
+    def load(self):
+        """
+        load directory from disk, dropping anything that expired while we were offline
+        """
+        try:
+            with open(self.fp, 'r') as file:
+                self.peers = json.load(file)
+        except Exception as e:
+            raise CustomException(f"Unable to load from file! - {e}")
+        self.expire()
+
+
+class Discovery:
+    """
+    announces this client over UDP multicast/broadcast and records other announcements in a PeerDirectory
+    """
+
+    app_tag = "mutuals"
+
+    def __init__(
+            self,
+            host : Identification,
+            directory : PeerDirectory,
+            group : str = DISCOVERY_GROUP,
+            port : int = DISCOVERY_PORT,
+            interface : str = "0.0.0.0",
+            interval : float = ANNOUNCE_INTERVAL,
+        ):
+        self.host = host
+        self.directory = directory
+        self.group = group
+        self.port = port
+        self.interface = interface
+        self.interval = interval
+        self.multicast = socket.inet_aton(group)[0] in range(224, 240)
+
+        self.running = False
+        self.threads = []
+        self.logger = get_logger("discovery")
+
+        # receiving socket, shared port so several clients on one machine can all listen
+        self.recv_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.recv_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            self.recv_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.recv_socket.bind(('', self.port))
+        self.recv_socket.settimeout(1)
+
+        # sending socket
+        self.send_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.multicast:
+            membership = struct.pack('4s4s', socket.inet_aton(self.group), socket.inet_aton(self.interface))
+            self.recv_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+            self.send_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(self.interface))
+            self.send_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+            self.send_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        else:
+            self.send_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+
+    def start(self):
+        """
+        start announcing and listening threads
+        """
+        self.running = True
+        for target in (self.announce_loop, self.listen_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        self.logger.info("Started peer discovery")
+
+    def stop(self):
+        """
+        stop threads and close sockets
+        """
+        self.running = False
+        for thread in self.threads:
+            thread.join(timeout=2)
+        self.recv_socket.close()
+        self.send_socket.close()
+
+    def announce(self):
+        """
+        send one announcement of who we are and which port we listen on
+        """
+        packet = json.dumps({
+            "app" : self.app_tag,
+            "id" : self.host.get_id(),
+            "name" : self.host.get_name(),
+            "port" : str(self.host.get_port()),
+        }).encode("utf-8")
+        self.send_socket.sendto(packet, (self.group, self.port))
+
+    def announce_loop(self):
+        """
+        announce every interval until stopped
+        """
+        while self.running:
+            try:
+                self.announce()
+            except Exception as e:
+                self.logger.error("Exception raised announcing presence: %s", e)
+            # sleep in small steps so stop is quick
+            slept = 0
+            while self.running and slept < self.interval:
+                time.sleep(0.1)
+                slept += 0.1
+
+    def listen_loop(self):
+        """
+        record announcements from other peers, address comes from the packet source so it is what we can actually dial
+        """
+        while self.running:
+            try:
+                data, (ip, _) = self.recv_socket.recvfrom(1024)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self.handle_announcement(data, ip)
+
+    def handle_announcement(self, data : bytes, ip : str):
+        """
+        parse an announcement and update the directory
+        """
+        try:
+            info = json.loads(data.decode("utf-8"))
+            if info.get("app") != self.app_tag or info["id"] == self.host.get_id():
+                return
+            peer = Identification(info["name"], info["id"], ip, str(int(info["port"])))
+            self.directory.update(peer)
+        except Exception as e:
+            self.logger.error("Bad discovery announcement from %s: %s", ip, e)
@@ -0,0 +1,173 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+dispatch.py
+HandlerSpec and HandlerRegistry classes that map message opcodes to handlers, and HandlerPool for running heavy handlers off the socket reading thread
+"""
+
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from message import Message
+from logs import get_logger
+
+WORKERS = 4 # pool threads
+MAX_PENDING = 256 # pooled handlers queued or running before readers block (backpressure)
+
+class HandlerSpec:
+    """
+    how to run the handler for one message type
+    pooled: run on the worker pool instead of the reading thread
+    ordered: pooled runs for one peer happen one at a time, in arrival order
+    """
+
+    def __init__(
+            self,
+            handler,
+            pooled : bool = False,
+            ordered : bool = True,
+        ):
+        self.handler = handler
+        self.pooled = pooled
+        self.ordered = ordered
+
+
+class HandlerRegistry:
+    """
+    opcode -> HandlerSpec, a plain list indexed by opcode so lookup is one index
+    """
+
+    def __init__(self, fallback : HandlerSpec):
+        self.fallback = fallback
+        self.specs = []
+
+    def register(self, type : str, handler, pooled : bool = False, ordered : bool = True) -> int:
+        """
+        register (or replace) the handler for a type, unknown types are added to Message.standard_types
+        returns the opcode
+        """
+        opcode = Message.register_type(type)
+        while len(self.specs) <= opcode:
+            self.specs.append(None)
+        self.specs[opcode] = HandlerSpec(handler, pooled, ordered)
+        return opcode
+
+    def unregister(self, type : str):
+        opcode = Message.opcodes.get(type)
+        if opcode is not None and opcode < len(self.specs):
+            self.specs[opcode] = None
+
+    def lookup(self, type : str) -> HandlerSpec:
+        opcode = Message.opcodes.get(type)
+        if opcode is None or opcode >= len(self.specs) or self.specs[opcode] is None:
+            return self.fallback
+        return self.specs[opcode]
+
+
+class HandlerPool:
+    """
+    bounded thread pool, ordered work for the same key (peer) runs one at a time in submit order
+    every piece of work holds a slot from submit until it ran or was dropped, pending() counts them all
+    """
+
+    def __init__(
+            self,
+            workers : int = WORKERS,
+            max_pending : int = MAX_PENDING,
+        ):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="handler")
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lanes = {} # key -> deque of (func, args) waiting for that key
+        self.count = 0 # submitted and not yet run or dropped, ordered or not
+        self.closed = False # shut down, new work is dropped
+        self.dropping = False # shut down without waiting, queued work is dropped too
+        self.lock = threading.Lock()
+        self.logger = get_logger("dispatch")
+
+    def submit(self, key, ordered : bool, func, *args):
+        """
+        queue func(*args), blocks the caller if max_pending is reached
+        """
+        self.slots.acquire()
+        with self.lock:
+            if self.closed:
+                self.slots.release()
+                self.logger.debug("Dropped handler submitted after shutdown")
+                return
+            self.count += 1
+            if ordered:
+                lane = self.lanes.get(key)
+                if lane is None:
+                    lane = self.lanes[key] = deque()
+                lane.append((func, args))
+                if len(lane) > 1: # the lane's drain picks it up
+                    return
+        try:
+            future = self.executor.submit(self._drain, key) if ordered else self.executor.submit(self._run, func, args)
+        except RuntimeError: # shut down between the check and here
+            self._cancelled(key, ordered)
+            return
+        future.add_done_callback(lambda future: self._cancelled(key, ordered) if future.cancelled() else None)
+
+    def _finish(self, n : int = 1):
+        with self.lock:
+            self.count -= n
+        for _ in range(n):
+            self.slots.release()
+
+    def _cancelled(self, key, ordered : bool):
+        """
+        a future that never ran, its work (the whole lane if ordered) gives its slots back
+        """
+        if not ordered:
+            self._finish()
+            return
+        with self.lock:
+            lane = self.lanes.pop(key, ())
+        self._finish(len(lane))
+
+    def _run(self, func, args):
+        try:
+            func(*args)
+        except Exception as e:
+            self.logger.error("Exception raised in pooled handler: %s", e)
+        finally:
+            self._finish()
+
+    def _drain(self, key):
+        """
+        run a lane until it is empty, the lane stays in the dict while running so new work queues behind it
+        """
+        while True:
+            with self.lock:
+                lane = self.lanes[key]
+                drop = self.dropping
+                if drop:
+                    del self.lanes[key]
+                func, args = lane[0]
+            if drop:
+                self._finish(len(lane))
+                return
+            self._run(func, args)
+            with self.lock:
+                lane.popleft()
+                if not lane:
+                    del self.lanes[key]
+                    return
+
+    def pending(self) -> int:
+        """
+        pooled handlers queued or running, ordered or not
+        """
+        with self.lock:
+            return self.count
+
+    def shutdown(self, wait : bool = True):
+        """
+        stop taking work, wait for what is queued or (wait False) drop it and give its slots back
+        """
+        with self.lock:
+            self.closed = True
+            self.dropping = not wait
+        self.executor.shutdown(wait=wait, cancel_futures=not wait)
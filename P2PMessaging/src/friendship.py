@@ -2,12 +2,16 @@
 Anthony Silva
 UNR, CPE 400, S24
 friendship.py
-class that represents a friendship. Currently not implemented. 
+Friendship class that represents a friendship, and FriendRoster which stores them by peer id and tracks friend requests
 """
 
+import json
+import os
+import threading
 from datetime import datetime
 
 from identification import Identification
+from exception import CustomException
 
 class Friendship:
     """
@@ -17,18 +21,125 @@ class Friendship:
     def __init__(
             self,
             sender : Identification,
-            receiver : Identification
+            receiver : Identification,
+            dt : str = None,
         ):
         self.sender = sender
         self.receiver = receiver
-        self.datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    
+        if dt:
+            self.datetime = dt
+        else:
+            self.datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
     def get_sender(self) -> Identification:
         return self.sender
-    
+
     def get_receiver(self) -> Identification:
         return self.receiver
-    
-    def get_datetime(self) -> str: 
-        return self.datetime
\ No newline at end of file
+
+    def get_datetime(self) -> str:
+        return self.datetime
+
+
+class FriendRoster:
+    """
+    friends and open friend requests keyed by peer id, every lookup is one dict access
+    """
+
+    def __init__(
+            self,
+            host : Identification,
+            data_dir : str = "../data",
+        ):
+        self.host = host
+        self.fp = f"{data_dir}/{host.get_id()}_friends.json"
+        self.friends = {} # peer id -> Friendship
+        self.requested = {} # peer id -> Identification, we asked them
+        self.pending = {} # peer id -> Identification, they asked us
+        self.lock = threading.Lock()
+
+        # load roster if it exists, otherwise start empty
+        try:
+            self.load()
+        except CustomException:
+            self.friends = {}
+
+    def is_friend(self, peer_id : str) -> bool:
+        return peer_id in self.friends
+
+    def get(self, peer_id : str) -> Friendship:
+        return self.friends.get(peer_id)
+
+    def get_friends(self) -> list:
+        return [friendship.get_receiver() for friendship in list(self.friends.values())]
+
+    def add(self, peer : Identification) -> Friendship:
+        """
+        become friends, clears any open request either way
+        """
+        with self.lock:
+            peer_id = peer.get_id()
+            self.requested.pop(peer_id, None)
+            self.pending.pop(peer_id, None)
+            if peer_id not in self.friends:
+                self.friends[peer_id] = Friendship(self.host, peer)
+            self._save()
+            return self.friends[peer_id]
+
+    def remove(self, peer_id : str) -> bool:
+        with self.lock:
+            removed = self.friends.pop(peer_id, None) is not None
+            self.requested.pop(peer_id, None)
+            self.pending.pop(peer_id, None)
+            self._save()
+            return removed
+
+    def request(self, peer : Identification):
+        """
+        we sent a friend request
+        """
+        with self.lock:
+            self.requested[peer.get_id()] = peer
+            self._save()
+
+    def receive_request(self, peer : Identification):
+        """
+        they sent us a friend request
+        """
+        with self.lock:
+            self.pending[peer.get_id()] = peer
+            self._save()
+
+    def _save(self):
+        """
+        write roster to disk, caller holds the lock. written to a temp file first so a crash never leaves half a file
+        """
+        data = {
+            "friends" : {peer_id : {"receiver" : f.get_receiver().to_string(), "datetime" : f.get_datetime()} for peer_id, f in self.friends.items()},
+            "requested" : {peer_id : peer.to_string() for peer_id, peer in self.requested.items()},
+            "pending" : {peer_id : peer.to_string() for peer_id, peer in self.pending.items()},
+        }
+        try:
+            tmp_fp = self.fp + ".tmp"
+            with open(tmp_fp, 'w') as file:
+                json.dump(data, file)
+            os.replace(tmp_fp, self.fp)
+        except Exception as e:
+            raise CustomException(f"Unable to save to file! - {e}")
+
+    def load(self):
+        """
+        load roster from disk
+        """
+        try:
+            with open(self.fp, 'r') as file:
+                data = json.load(file)
+            self.friends = {
+                peer_id : Friendship(self.host, Identification.from_string(entry["receiver"]), entry["datetime"])
+                for peer_id, entry in data.get("friends", {}).items()
+            }
+            self.requested = {peer_id : Identification.from_string(s) for peer_id, s in data.get("requested", {}).items()}
+            self.pending = {peer_id : Identification.from_string(s) for peer_id, s in data.get("pending", {}).items()}
+        except Exception as e:
+            raise CustomException(f"Unable to load from file! - {e}")
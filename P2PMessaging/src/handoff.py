@@ -0,0 +1,253 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+handoff.py
+HandoffServer class and take_over, restart a Client without dropping anyone: the running process passes its listening
+socket, UDP socket, and every steady peer socket to the new process over a Unix socket (SCM_RIGHTS), along with what
+each conn was in the middle of, and the new process carries on with no reconnect, handshake, or history sync
+
+python3 daemon.py --config bot.json --handoff       (old process, serves <data_dir>/<id>.handoff.sock)
+python3 daemon.py --config bot.json --takeover      (new process, takes everything over, then starts its control API)
+
+channel: the new process sends REQUEST, the old one answers
+    body length (4) | fd count (4) | fds in batches of FD_BATCH, one marker byte each | JSON body
+fds are the listening socket, the UDP socket if there is one, then one per conn in body["conns"] order. the old
+process stops accepting, pauses every reader between chunks, snapshots the stream and datagram state, saves history,
+and only then sends, so nothing is read, written, or saved twice. it closes the channel once it has torn down, the new
+process waits for that before it takes the control socket path
+"""
+
+import json
+import os
+import socket
+import struct
+import threading
+import time
+
+from identification import Identification
+from live_connection import LiveConnection
+from streams import recv_exact, PAUSE_POLL
+from exception import CustomException
+from logs import get_logger
+
+REQUEST = b"P2PHANDOFF1\n"
+HEADER = struct.Struct("!II") # body length, fd count
+FD_BATCH = 250 # the kernel takes at most 253 fds per message
+HANDOFF_DEADLINE = 5.0 # seconds to get every reader paused, past it a conn is ended the old way instead
+
+def handoff_path(data_dir : str, id : str) -> str:
+    return f"{data_dir}/{id}.handoff.sock"
+
+def bind_private(sock : socket.socket, path : str):
+    """
+    bind a Unix socket with no group or other access from the start, chmod after bind leaves a window open
+    """
+    umask = os.umask(0o077)
+    try:
+        sock.bind(path)
+    finally:
+        os.umask(umask)
+
+def same_user(sock : socket.socket) -> bool:
+    """
+    the process on the other end of a Unix socket runs as our user (SO_PEERCRED is pid, uid, gid)
+    """
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    return struct.unpack("3i", creds)[1] == os.geteuid()
+
+def hand_off(client, channel : socket.socket, deadline : float = HANDOFF_DEADLINE) -> int:
+    """
+    old process side, send everything to the process on channel and leave client ready for stop()
+    returns the number of connections handed over
+    """
+    logger = get_logger("conn")
+    until = time.monotonic() + deadline
+    remaining = lambda: max(until - time.monotonic(), 0)
+
+    # no new conns, no conn becomes pausable from here on, dials wait in the backlog
+    with client.handoff_lock:
+        client.handing_off = True
+        pausable = [conn for conn in client.connections if conn.streams.pause is not None]
+    if client.listening_thread:
+        client.listening_thread.join(timeout=remaining())
+
+    # readers stop between chunks, a conn whose reader does not (stuck in a handler) stays and is ended by stop()
+    for conn in pausable:
+        conn.streams.pause.set()
+    paused = [conn for conn in pausable if conn.streams.paused.wait(remaining())]
+    while client.handler_pool.pending() and remaining():
+        time.sleep(0.01)
+
+    # no chunk half written: hold each write lock while snapshotting, then fail the mux so later sends give up
+    if client.datagrams:
+        client.datagrams.release()
+    conns = []
+    for conn in paused:
+        client.acks.flush(conn) # the new process cannot ack what this one read
+    for conn in paused:
+        if not conn.streams.write_lock.acquire(timeout=remaining()):
+            continue
+        try:
+            conns.append((conn, {
+                "peer" : conn.get_receiver().to_string(),
+                "streams" : conn.streams.snapshot(),
+                "datagram" : conn.datagram.snapshot() if conn.datagram else None,
+            }))
+            conn.streams.fail(ConnectionError("connection handed to another process"))
+        finally:
+            conn.streams.write_lock.release()
+
+    # the new process loads history after this, so it is saved here and never again by this process
+    if client.backups:
+        client.backups.stop()
+    client.directory.save()
+    client.hash_table.save()
+    client.handed_off = True
+
+    fds = [client.listening_socket.fileno()]
+    if client.datagrams:
+        fds.append(client.datagrams.sock.fileno())
+    fds += [conn.get_socket().fileno() for conn, _ in conns]
+    body = json.dumps({
+        "host" : client.identification.to_string(),
+        "datagrams" : client.datagrams is not None,
+        "conns" : [state for _, state in conns],
+    }).encode("utf-8")
+    channel.sendall(HEADER.pack(len(body), len(fds)))
+    for i in range(0, len(fds), FD_BATCH):
+        socket.send_fds(channel, [b"F"], fds[i:i + FD_BATCH])
+    channel.sendall(body)
+
+    # our copies only: close() without shutdown() leaves the sockets working in the new process
+    client.listening_socket.close()
+    client.listening_socket = None
+    for conn, _ in conns:
+        conn.get_socket().close()
+        if conn.datagram:
+            client.datagrams.detach(conn.datagram)
+        if conn in client.connections:
+            client.connections.remove(conn)
+    logger.info("Handed off %d connections", len(conns))
+    return len(conns)
+
+def request_handoff(path : str) -> tuple:
+    """
+    new process side, (state, fds, channel) from the process serving path, keep channel open until take_over is done
+    """
+    channel = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        channel.connect(path)
+        channel.sendall(REQUEST)
+        length, count = HEADER.unpack(recv_exact(channel, HEADER.size))
+        fds = []
+        while len(fds) < count:
+            _, batch, flags, _ = socket.recv_fds(channel, 1, FD_BATCH)
+            if not batch or flags & socket.MSG_CTRUNC:
+                raise CustomException("Handoff lost file descriptors")
+            fds += batch
+        state = json.loads(recv_exact(channel, length))
+    except CustomException:
+        channel.close()
+        raise
+    except Exception as e:
+        channel.close()
+        raise CustomException(f"Unable to take over from {path}! - {e}")
+    return state, fds, channel
+
+def take_over(client, state : dict, fds : list) -> int:
+    """
+    carry on with the sockets and state from request_handoff, client was made with bind=False
+    returns the number of connections resumed
+    """
+    if state["host"] != client.identification.to_string():
+        for fd in fds:
+            os.close(fd)
+        raise CustomException(f"Handoff is for {state['host']}, not {client.identification.to_string()}")
+    fds = list(fds)
+    client.listening_socket = socket.socket(fileno=fds.pop(0))
+    client.listening_socket.settimeout(PAUSE_POLL if client.handoff else None)
+    if state["datagrams"]:
+        client.start_datagrams(socket.socket(fileno=fds.pop(0)))
+
+    conns = []
+    for entry, fd in zip(state["conns"], fds):
+        sock = socket.socket(fileno=fd)
+        sock.settimeout(None)
+        receiver = Identification.from_string(entry["peer"])
+        conn = LiveConnection(client.identification, receiver, sock)
+        conn.streams.restore(entry["streams"])
+        conn.overwrite_history(client.hash_table.read_history(receiver))
+        if entry["datagram"] and client.datagrams:
+            conn.datagram = client.datagrams.attach(conn, tuple(entry["datagram"]["addr"]))
+            with client.datagrams.lock:
+                conn.datagram.restore(entry["datagram"])
+                client.datagrams.timer.notify()
+        client.connections.append(conn)
+        conns.append(conn)
+    for conn in conns:
+        client.start_thread(client.resume_conn, (conn,))
+    client.start_listening()
+    get_logger("conn").info("Took over %d connections", len(conns))
+    return len(conns)
+
+
+class HandoffServer:
+    """
+    waits on a Unix socket for a new process, hands the client to the first one that asks, then calls on_done
+    (the owner's stop) before closing the channel
+    """
+
+    def __init__(self, client, path : str, on_done = None):
+        self.client = client
+        self.path = path
+        self.on_done = on_done
+        if os.path.exists(path):
+            os.remove(path) # stale socket from a previous run
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        bind_private(self.sock, path) # the sockets are only for our user
+        self.sock.listen(1)
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.logger = get_logger("conn")
+
+    def start(self):
+        self.thread.start()
+        self.logger.info("Handoff listening on %s", self.path)
+
+    def serve(self):
+        while True:
+            try:
+                channel, _ = self.sock.accept()
+            except OSError:
+                return # stop() closed the socket
+            if not same_user(channel):
+                self.logger.warning("Refused handoff to a process of another user")
+                channel.close()
+                continue
+            try:
+                channel.settimeout(HANDOFF_DEADLINE)
+                if recv_exact(channel, len(REQUEST)) != REQUEST:
+                    raise CustomException("Bad handoff request")
+                channel.settimeout(None)
+                hand_off(self.client, channel)
+            except Exception as e:
+                self.logger.error("Exception raised handing off: %s", e)
+                channel.close()
+                if not self.client.handing_off:
+                    continue
+                # too late to carry on serving, stop like a normal shutdown
+                if self.on_done:
+                    self.on_done()
+                return
+            if self.on_done:
+                self.on_done()
+            channel.close()
+            return
+
+    def stop(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -3,14 +3,28 @@ Anthony Silva
 UNR, CPE 400, S24
 hash_table.py
 HashTable class which is essentially a python dictionary / json that just stores message histories separate from connections
+
+on disk: <data>/<id>_history/manifest.json lists every peer (identity, message count, last message time) and each peer's
+history lives in its own file next to it. only the manifest is read at startup, a peer's history is read the first
+time something touches it, so startup cost does not grow with history size. columns/ holds the same histories as
+HistoryColumns for analytics. archive/ holds the older part of each history compressed (see archive.py), the peer files
+only keep the hot window once a Compactor runs
 """
 
 import json
+import os
+import hashlib
+import heapq
+import threading
+from bisect import bisect_left, bisect_right
 from copy import deepcopy
 
 from identification import Identification
 from message import Message
 from exception import CustomException
+from metrics import timed
+from columns import HistoryColumns, seconds
+from archive import HistoryArchive, LAST, matches, message_datetime
 
 class HashTable:
 
@@ -20,31 +34,302 @@ class HashTable:
 
     def __init__(
             self,
-            host : Identification
+            host : Identification,
+            data_dir : str = "../data",
         ):
         # init stuff
-        self.table = {}
+        self.table = {
+            "host" : host.to_string(),
+            "histories" : {} # only peers loaded so far
+        }
+        self.manifest = {} # peer id -> entry without message_history, plus count, last, and file
+        self.compacted = True # false for a manifest written before only user messages were kept, see compact
+        self.dirty = set() # loaded peers changed since the last save
+        self.deleted = set() # peer files to remove on the next save
         self.host = host
-        self.fp = f"../data/{host.get_id()}_table.json"   
+        self.op_latency = None # histogram family labeled by op, set by the client to time operations
+        self.lock = threading.Lock()
+        self.dir = f"{data_dir}/{host.get_id()}_history"
+        self.manifest_fp = f"{self.dir}/manifest.json"
+        self.fp = f"{data_dir}/{host.get_id()}_table.json" # single file layout from before, migrated on first load
+        self.columns = HistoryColumns(f"{self.dir}/columns", host.get_id())
+        self.archive = HistoryArchive(f"{self.dir}/archive")
 
-        # load hash table if it exists in memory, otherwise create new table
+        # load manifest if it exists in memory, otherwise create new table
         try:
             self.load()
         except CustomException:
-            self.table = {
-                "host" : host.to_string(),
-                "histories" : {}
-            }
-        
-        
+            self.manifest = {}
+        # peers the columns disagree with (first run with columns, or a crash between saves), rebuilt by analytics()
+        counts = {peer_id : entry.get("count", 0) + self.archive.count(peer_id) for peer_id, entry in self.manifest.items()}
+        self.stale = self.columns.stale(counts)
+        if not self.compacted:
+            self.compact()
+
+    def ensure_loaded(self, receiver_id : str):
+        """
+        read a peer's history file the first time it is needed
+        """
+        if receiver_id in self.table["histories"] or receiver_id not in self.manifest:
+            return
+        with self.lock:
+            if receiver_id in self.table["histories"]: # another thread got here first
+                return
+            try:
+                with open(f"{self.dir}/{self.manifest[receiver_id]['file']}", 'r') as file:
+                    entry = json.load(file)
+                if not entry.get("compacted"):
+                    self.compact_entry(entry)
+                    self.dirty.add(receiver_id)
+                    self.stale.add(receiver_id)
+                self.table["histories"][receiver_id] = entry
+            except Exception:
+                # file missing or broken, start the peer over rather than failing the connection
+                entry = {k : v for k, v in self.manifest[receiver_id].items() if k not in ("count", "first", "last", "bytes", "file")}
+                entry["message_history"] = []
+                entry["compacted"] = True
+                self.table["histories"][receiver_id] = entry
+
+    def compact_entry(self, entry : dict) -> int:
+        """
+        one time cleanup of histories written before only user messages were kept: drops protocol frames and
+        HISTORY_RESPONSE copies of the whole history, returns how many were dropped
+        """
+        history = entry.get("message_history", [])
+        kept = [s for s in history if Message.category(json.loads(s)["type"]) == "user"]
+        entry["message_history"] = kept
+        entry["compacted"] = True
+        return len(history) - len(kept)
+
+    def compact(self) -> int:
+        """
+        compact every peer not compacted yet and save, run once when a table from before is opened (the manifest
+        remembers it), peers loaded only for this are let go again, returns how many messages were dropped
+        """
+        dropped = 0
+        loaded = set(self.table["histories"])
+        for receiver_id, summary in list(self.manifest.items()):
+            if summary.get("compacted"):
+                continue
+            self.ensure_loaded(receiver_id) # compacts it
+            dropped += summary.get("count", 0) - len(self.table["histories"][receiver_id]["message_history"])
+        self.compacted = True
+        self.save()
+        with self.lock:
+            for receiver_id in set(self.table["histories"]) - loaded - self.dirty:
+                del self.table["histories"][receiver_id]
+        return dropped
+
+    def is_loaded(self, receiver : Identification) -> bool:
+        return receiver.get_id() in self.table["histories"]
+
+    def peers(self) -> dict:
+        """
+        peer id -> manifest entry for every peer with a history, without loading any of them
+        """
+        peers = {peer_id : dict(entry) for peer_id, entry in self.manifest.items()}
+        for peer_id, entry in list(self.table["histories"].items()):
+            peers[peer_id] = self.manifest_entry(peer_id, entry)
+        return peers
+
+    def summary(self, receiver_id : str) -> dict:
+        """
+        one peer's manifest entry, without loading it
+        """
+        entry = self.table["histories"].get(receiver_id)
+        return self.manifest_entry(receiver_id, entry) if entry is not None else dict(self.manifest.get(receiver_id, {}))
+
+    def manifest_entry(self, receiver_id : str, entry : dict) -> dict:
+        summary = {k : v for k, v in entry.items() if k != "message_history"}
+        history = entry.get("message_history", [])
+        summary["count"] = len(history)
+        summary["first"] = message_datetime(history[0]) if history else None
+        summary["last"] = message_datetime(history[-1]) if history else None
+        summary["bytes"] = sum(len(s) for s in history)
+        summary["file"] = self.manifest.get(receiver_id, {}).get("file") or hashlib.sha1(receiver_id.encode("utf-8")).hexdigest()[:16] + ".json"
+        return summary
+
+    def analytics(self) -> HistoryColumns:
+        """
+        the columns for every peer, stale peers are loaded and rebuilt first (only once, later writes keep them current)
+        """
+        while self.stale:
+            receiver_id = self.stale.pop()
+            self.ensure_loaded(receiver_id)
+            entry = self.table["histories"].get(receiver_id)
+            self.columns.replace(receiver_id, self.archive.read(receiver_id) + (entry.get("message_history", []) if entry else []))
+        return self.columns
+
+    def refresh_columns(self, receiver_id : str):
+        """
+        the archived part of a history changed, its rows are rebuilt by the next analytics()
+        """
+        self.stale.add(receiver_id)
+
+    def archive_oldest(self, receiver_id : str, keep : int, cutoff : str = None) -> int:
+        """
+        move a peer's messages past the hot window (all but the newest keep, and any older than cutoff) into the archive
+        returns how many moved, the columns already hold them so they do not change
+        """
+        self.ensure_loaded(receiver_id)
+        with self.lock:
+            entry = self.table["histories"].get(receiver_id)
+            if not entry:
+                return 0
+            history = entry.get("message_history", [])
+            cut = max(len(history) - keep, 0)
+            if cutoff:
+                cut = max(cut, bisect_left(history, cutoff, key=message_datetime))
+            if cut == 0:
+                return 0
+            # a crash before the next save leaves copies in both, never in neither
+            self.archive.append(receiver_id, history[:cut])
+            del history[:cut]
+            self.dirty.add(receiver_id)
+        return cut
+
+    def trim_hot(self, receiver_id : str, max_count : int = None, max_bytes : int = None, cutoff : str = None) -> int:
+        """
+        drop a peer's oldest hot messages until what is left (with anything archived) is within the limits
+        returns how many were dropped
+        """
+        self.ensure_loaded(receiver_id)
+        with self.lock:
+            entry = self.table["histories"].get(receiver_id)
+            if not entry:
+                return 0
+            history = entry.get("message_history", [])
+            archived = self.archive.count(receiver_id)
+            cut = bisect_left(history, cutoff, key=message_datetime) if cutoff else 0
+            if max_count is not None:
+                cut = max(cut, len(history) + archived - max_count)
+            if max_bytes is not None:
+                size = sum(len(s) for s in history[cut:]) + self.archive.size(receiver_id)
+                while cut < len(history) and size > max_bytes:
+                    size -= len(history[cut])
+                    cut += 1
+            cut = min(max(cut, 0), len(history))
+            if cut == 0:
+                return 0
+            del history[:cut]
+            self.dirty.add(receiver_id)
+            self.stale.add(receiver_id)
+        return cut
+
+    def read_archive(self, receiver : Identification, start : int = 0, stop : int = None) -> list:
+        """
+        archived messages [start, stop) of a history, oldest is 0, everything before read_history's first message
+        """
+        return [Message.deserialize(s) for s in self.archive.read(receiver.get_id(), start, stop)]
+
+    @timed("search")
+    def search_history(self, text : str = None, peers : list = None, since : str = None, until : str = None, limit : int = 50) -> list:
+        """
+        newest first, at most limit messages from the given peers (every peer if None) containing text and sent within
+        [since, until], hot and archived history alike, archived blocks outside the time range are not read
+        """
+        peer_ids = list(peers) if peers is not None else list(set(self.inbox_ends()) | set(self.archive.peers()))
+        found = []
+        for peer_id in peer_ids:
+            hits = []
+            self.ensure_loaded(peer_id)
+            entry = self.table["histories"].get(peer_id)
+            for serialized in reversed(list(entry.get("message_history", [])) if entry else []):
+                if until and message_datetime(serialized) > until:
+                    continue
+                if since and message_datetime(serialized) < since:
+                    break
+                if matches(serialized, text):
+                    hits.append(serialized)
+                    if len(hits) >= limit:
+                        break
+            if len(hits) < limit:
+                hits += self.archive.search(peer_id, text, since, until, limit - len(hits))
+            found += hits
+        found.sort(key=message_datetime, reverse=True)
+        return [Message.deserialize(s) for s in found[:limit]]
+
+
+    def inbox_ends(self) -> dict:
+        """
+        peer id -> messages in their history right now, unloaded peers answered from the manifest
+        """
+        ends = {peer_id : entry.get("count", 0) for peer_id, entry in self.manifest.items()}
+        for peer_id, entry in list(self.table["histories"].items()):
+            ends[peer_id] = len(entry.get("message_history", []))
+        return ends
 
+    @timed("inbox")
+    def inbox(self, limit : int = 50, cursor : dict = None) -> tuple:
+        """
+        newest `limit` messages across every peer, newest first, and the cursor for the next (older) page, None once
+        there is nothing older. a cursor is peer id -> how many of that peer's messages are not paged through yet
+        each history is already time ordered, so this is a k-way merge from their ends: a peer's file is only read
+        once its newest message (known from the manifest) is next, and only returned messages are deserialized
+        """
+        ends = self.inbox_ends() if cursor is None else dict(cursor)
+        heap = []
+        for peer_id, end in ends.items():
+            self.push_newest(heap, peer_id, end)
+        messages = []
+        while heap and len(messages) < limit:
+            _, peer_id, index, message = heapq.heappop(heap)
+            if message is None: # manifest stand in, now read the history for the real one
+                self.ensure_loaded(peer_id)
+                self.push_newest(heap, peer_id, ends[peer_id])
+                continue
+            messages.append(message)
+            ends[peer_id] = index
+            self.push_newest(heap, peer_id, index)
+        remaining = {peer_id : end for peer_id, end in ends.items() if end > 0}
+        return messages, remaining if remaining else None
+
+    def push_newest(self, heap : list, peer_id : str, end : int):
+        """
+        queue a peer's message end - 1 on the inbox heap, keyed newest first
+        an unloaded peer paged from its newest message is queued with the manifest's last time and no message
+        """
+        if end <= 0:
+            return
+        entry = self.table["histories"].get(peer_id)
+        if entry is None:
+            summary = self.manifest.get(peer_id)
+            if summary is None:
+                return
+            if end == summary.get("count") and summary.get("last"):
+                heapq.heappush(heap, (-seconds(summary["last"]), peer_id, end, None))
+                return
+            self.ensure_loaded(peer_id)
+            entry = self.table["histories"].get(peer_id)
+        history = entry.get("message_history", [])
+        end = min(end, len(history))
+        if end > 0:
+            message = Message.deserialize(history[end - 1])
+            heapq.heappush(heap, (-seconds(message.get_datetime()), peer_id, end - 1, message))
 
+    def inbox_since(self, head : dict) -> tuple:
+        """
+        messages stored after head (from inbox_ends, or a previous call), newest first, and the new head
+        """
+        now = self.inbox_ends()
+        messages = []
+        for peer_id, end in now.items():
+            start = head.get(peer_id, 0)
+            if end > start:
+                self.ensure_loaded(peer_id)
+                history = self.table["histories"][peer_id].get("message_history", [])
+                messages += [Message.deserialize(s) for s in history[start:end]]
+        messages.sort(key=lambda message: message.get_datetime(), reverse=True)
+        return messages, now
+
+    @timed("read_history")
     def read_history(self, receiver : Identification) -> list:
         """
         read a history from the hashtable
         """
         # get receiver id
         receiver_id = receiver.get_id()
+        self.ensure_loaded(receiver_id)
 
         # check if receiver id in table
         if receiver_id in self.table["histories"]:
@@ -61,6 +346,32 @@ class HashTable:
             # raise CustomException("ID not in table.")
             return []
 
+    def read_serialized(self, receiver_id : str) -> list:
+        """
+        a peer's history as stored (serialized strings), a copy so the caller can hold it while writes go on
+        """
+        self.ensure_loaded(receiver_id)
+        entry = self.table["histories"].get(receiver_id)
+        return list(entry.get("message_history", [])) if entry else []
+
+    def history_length(self, receiver : Identification) -> int:
+        receiver_id = receiver.get_id()
+        self.ensure_loaded(receiver_id)
+        entry = self.table["histories"].get(receiver_id)
+        return len(entry.get("message_history", [])) if entry else 0
+
+    def read_range(self, receiver : Identification, start : int, stop : int) -> list:
+        """
+        messages [start, stop) of a history, only that slice is deserialized (for scrolling views)
+        """
+        receiver_id = receiver.get_id()
+        self.ensure_loaded(receiver_id)
+        entry = self.table["histories"].get(receiver_id)
+        if not entry:
+            return []
+        return [Message.deserialize(s) for s in entry.get("message_history", [])[max(start, 0):stop]]
+
+    @timed("write_message")
     def write_message(self, message : Message, receive_flag: bool) -> int:
         """
         write a new message to a history, returns int based on execution status
@@ -87,12 +398,20 @@ class HashTable:
             else:
                 raise CustomException("Sender mismatch from message and table.")
         
+        self.ensure_loaded(receiver_id)
+        self.dirty.add(receiver_id)
         # check if receiver already in table
         if receiver_id in self.table["histories"]:
             
             # if in table, append to history
 
-            self.table["histories"][receiver_id]["message_history"].append(message.serialize())
+            # datagrams and streams can deliver out of order, history stays sorted by datetime
+            history = self.table["histories"][receiver_id]["message_history"]
+            if history and message.get_datetime() < message_datetime(history[-1]):
+                history.insert(bisect_right(history, message.get_datetime(), key=message_datetime), message.serialize())
+            else:
+                history.append(message.serialize())
+            self.columns.append(receiver_id, message)
             return 1 # appended to entry
         else:
             # if not in table, create table appropriately 
@@ -103,10 +422,13 @@ class HashTable:
                 "ip" : receiver.get_ip(),
                 "port" : receiver.get_port(),
                 "receiver" : receiver.to_string(),
+                "compacted" : True,
                 "message_history" : [message.serialize(),]
             }
+            self.columns.append(receiver_id, message)
             return 0 # new entry made
     
+    @timed("overwrite_history")
     def overwrite_history(self, receiver : Identification, new_history : list):
         """
         completely overwrite a history 
@@ -116,6 +438,8 @@ class HashTable:
             # do nothing
             return
         receiver_id = receiver.get_id()
+        self.ensure_loaded(receiver_id)
+        self.dirty.add(receiver_id)
         # check if receiver is in table
         if receiver_id not in self.table["histories"]:
             # not in table! create new entry and write the new history
@@ -126,6 +450,7 @@ class HashTable:
                     "ip" : receiver.get_ip(),
                     "port" : receiver.get_port(),
                     "receiver" : receiver.to_string(),
+                    "compacted" : True,
                     "message_history" : deepcopy(Message.msg_history_prep(new_history))
                 }
             else:
@@ -135,6 +460,7 @@ class HashTable:
                     "ip" : receiver.get_ip(),
                     "port" : receiver.get_port(),
                     "receiver" : receiver.to_string(),
+                    "compacted" : True,
                     "message_history" : deepcopy(new_history) # assuming it is already serialized 
                 }
         else:
@@ -144,7 +470,12 @@ class HashTable:
                 self.table["histories"][receiver_id]["message_history"] = Message.msg_history_prep(new_history)
             else:
                 self.table["histories"][receiver_id]["message_history"] = new_history # assuming it is already serialized 
+        if self.archive.count(receiver_id):
+            self.stale.add(receiver_id) # rows for the archived part too, rebuilt by analytics()
+        else:
+            self.columns.replace(receiver_id, new_history)
 
+    @timed("merge_history")
     def merge_history(self, receiver : Identification, new_history : list):
         """
         update a message history of a receiver to include any new messages in the new histry, (no duplicates)
@@ -155,6 +486,21 @@ class HashTable:
             return
         
         receiver_id = receiver.get_id()
+        self.ensure_loaded(receiver_id)
+
+        # anything as old as what is archived already came by once, merging it again would put it back in the hot window
+        archived = self.archive.index.get(receiver_id)
+        if archived:
+            newest = archived[-1][LAST]
+            dated = lambda m: m.get_datetime() if isinstance(m, Message) else message_datetime(m)
+            new_history = [m for m in new_history if dated(m) >= newest]
+            if any(dated(m) == newest for m in new_history):
+                # the newest archived second can also hold messages that stayed hot or never arrived, only skip the archived ones
+                archived_keys = {Message.deserialize(s).get_key() for s in self.archive.search(receiver_id, since=newest, until=newest, limit=float("inf"))}
+                keyed = lambda m: (m if isinstance(m, Message) else Message.deserialize(m)).get_key()
+                new_history = [m for m in new_history if dated(m) > newest or keyed(m) not in archived_keys]
+            if len(new_history) == 0:
+                return
         
         # check if receiver in table
         if receiver_id not in self.table["histories"]:
@@ -183,6 +529,51 @@ class HashTable:
         return
         
 
+    def set_watermark(self, receiver : Identification, field : str, mark : list) -> bool:
+        """
+        cumulative read state for a peer, one [key, datetime] per direction instead of a flag per message
+            "read": we have read their messages up to mark
+            "read_sent": the last "read" mark we got out to them
+            "peer_read": they have read ours up to mark
+        returns False (and keeps the old one) if mark is not newer
+        """
+        receiver_id = receiver.get_id()
+        self.ensure_loaded(receiver_id)
+        if receiver_id not in self.table["histories"]:
+            self.table["histories"][receiver_id] = {
+                "name" : receiver.get_name(),
+                "id" : receiver_id,
+                "ip" : receiver.get_ip(),
+                "port" : receiver.get_port(),
+                "receiver" : receiver.to_string(),
+                "compacted" : True,
+                "message_history" : []
+            }
+        entry = self.table["histories"][receiver_id]
+        current = entry.get(field)
+        if current is not None and (mark[1] < current[1] or mark[0] == current[0]):
+            return False
+        entry[field] = list(mark)
+        self.dirty.add(receiver_id)
+        return True
+
+    def get_watermark(self, receiver : Identification, field : str) -> list:
+        """
+        [key, datetime] or None, answered from the manifest when the history is not loaded
+        """
+        receiver_id = receiver.get_id()
+        if receiver_id in self.table["histories"]:
+            return self.table["histories"][receiver_id].get(field)
+        return self.manifest.get(receiver_id, {}).get(field)
+
+    def is_read(self, message : Message, field : str) -> bool:
+        """
+        is this message covered by a read watermark, "read" for messages we received, "peer_read" for ones we sent
+        """
+        peer = message.get_sender() if field == "read" else message.get_receiver()
+        mark = self.get_watermark(peer, field)
+        return mark is not None and message.get_datetime() <= mark[1]
+
     def delete_history(self, receiver : Identification) -> int:
         """
         delete a history from the hashtable (clean slate!), overwrite with empty list, return int based on execution success
@@ -190,6 +581,7 @@ class HashTable:
         
         # get receiver id
         receiver_id = receiver.get_id()
+        self.ensure_loaded(receiver_id)
 
         # check if receiver_id in table
         if receiver_id in self.table["histories"]:
@@ -197,6 +589,9 @@ class HashTable:
             # if in table, check if history exists
             if "message_history" in self.table["histories"][receiver_id]:
                 self.table["histories"][receiver_id]["message_history"] = []
+                self.dirty.add(receiver_id)
+                self.columns.drop(receiver_id)
+                self.archive.delete(receiver_id)
                 return 1 # successfully overwritted with empty list
             else:
                 # if no message history, raise error
@@ -215,33 +610,74 @@ class HashTable:
         # get receiver id
         receiver_id = receiver.get_id()
 
+        self.ensure_loaded(receiver_id)
         # check if receiver_id in table
         if receiver_id in self.table["histories"]:
             # if in table, remove it
             del self.table["histories"][receiver_id]
+            self.dirty.discard(receiver_id)
+            self.columns.drop(receiver_id)
+            self.archive.delete(receiver_id)
+            if receiver_id in self.manifest:
+                self.deleted.add(self.manifest.pop(receiver_id)["file"])
             return 1 # succesfully deleted
         else:
             return 0 # nothing to delete!
 
 
     
+    @timed("save")
     def save(self):
         """
-        save dict attribute to disk somewhere
+        save changed peer files and the manifest to disk, untouched peers are not rewritten
         """
         try: 
-            with open(self.fp, 'w') as file:
-                json.dump(self.table, file)
+            os.makedirs(self.dir, exist_ok=True)
+            self.archive.save() # before the peer files that no longer hold what moved there
+            with self.lock:
+                dirty, self.dirty = self.dirty, set()
+                deleted, self.deleted = self.deleted, set()
+            for receiver_id in dirty:
+                entry = self.table["histories"].get(receiver_id)
+                if entry is None:
+                    continue
+                self.manifest[receiver_id] = self.manifest_entry(receiver_id, entry)
+                self._write(f"{self.dir}/{self.manifest[receiver_id]['file']}", entry)
+            for file_name in deleted:
+                if os.path.exists(f"{self.dir}/{file_name}"):
+                    os.remove(f"{self.dir}/{file_name}")
+            self.columns.save()
+            self._write(self.manifest_fp, {"host" : self.table["host"], "compacted" : self.compacted, "peers" : self.manifest})
         except Exception as e:
             raise CustomException(f"Unable to save to file! - {e}")
     
+    @timed("load")
     def load(self):
         """
-        load dict attribute from disk somewhere
+        load the manifest from disk somewhere, histories load later per peer
+        a table in the old single file layout is loaded whole once and split into the new layout
         """
         try:
-            with open(self.fp, 'r') as file:
+            if not os.path.exists(self.manifest_fp) and os.path.exists(self.fp):
+                with open(self.fp, 'r') as file:
+                    self.table["histories"] = json.load(file)["histories"]
+                for entry in self.table["histories"].values():
+                    self.compact_entry(entry)
+                self.dirty = set(self.table["histories"])
+                self.save()
+                return
+            with open(self.manifest_fp, 'r') as file:
                 data = json.load(file)
-                self.table = data
+            self.manifest = data["peers"]
+            self.compacted = data.get("compacted", False)
         except Exception as e:
             raise CustomException(f"Unable to load from file! - {e}")
+
+    def _write(self, fp : str, data : dict):
+        """
+        written to a temp file first so a crash never leaves half a file
+        """
+        tmp_fp = fp + ".tmp"
+        with open(tmp_fp, 'w') as file:
+            json.dump(data, file)
+        os.replace(tmp_fp, fp)
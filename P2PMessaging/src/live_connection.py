@@ -2,14 +2,19 @@
 Anthony Silva
 UNR, CPE 400, S24
 live_connection.py
-LiveConnection class for handling conversation message histories and socket object
+LiveConnection class for handling conversation message histories and socket object, with the stream multiplexer for that socket
 """
 
+from bisect import bisect_right
+from collections import OrderedDict
 from copy import deepcopy
 from datetime import datetime
 
 from identification import Identification
 from message import Message
+from streams import StreamMux
+
+RECENT_KEYS = 4096 # received keys remembered per conn to drop a datagram that also came in on the stream
 
 class LiveConnection:
     """
@@ -26,13 +31,31 @@ class LiveConnection:
         self.receiver = receiver
         self.socket = socket
         self.message_history = []
+        self.streams = StreamMux(socket) # prioritized, chunked frames on this socket
+        self.datagram = None # DatagramPeer when both ends offered the UDP path
+        self.recent_keys = OrderedDict() # newest RECENT_KEYS stored keys received here
     
     def add_message(self, new_msg : Message):
         """
-        Add a message to history 
+        Add a message to history, in datetime order (datagrams and streams can deliver out of order)
         """
         # self.message_history.append(new_msg.serialize()) # TEST
-        self.message_history.append(new_msg) # TEST
+        history = self.message_history
+        if history and new_msg.get_datetime() < history[-1].get_datetime():
+            history.insert(bisect_right(history, new_msg.get_datetime(), key=lambda m: m.get_datetime()), new_msg)
+        else:
+            self.message_history.append(new_msg) # TEST
+
+    def seen(self, key : str) -> bool:
+        """
+        True if key was received on this conn before, otherwise remember it
+        """
+        if key in self.recent_keys:
+            return True
+        self.recent_keys[key] = None
+        if len(self.recent_keys) > RECENT_KEYS:
+            self.recent_keys.popitem(last=False)
+        return False
 
     def overwrite_history(self, new_history : list):
         """
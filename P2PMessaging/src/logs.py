@@ -0,0 +1,156 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+logs.py
+Logging pipeline: per category loggers under 'client_logger', sampling for per frame events, and a QueueHandler so file writes happen on a background thread
+
+callers pass arguments instead of f-strings so nothing is formatted for records that get dropped:
+    logger = get_logger("message")
+    logger.debug("Sent a message: %s", message) # message.__str__ only runs if debug is on
+"""
+
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import itertools
+
+ROOT = 'client_logger'
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+MAX_BYTES = 5 * 1024 * 1024 # rotate the log file at this size
+BACKUPS = 3 # rotated files kept next to it
+
+CATEGORIES = ("conn", "message", "sync", "outbox", "attachment", "discovery", "dispatch", "metrics", "control", "shard", "datagram")
+DEFAULT_LEVELS = {category : logging.INFO for category in CATEGORIES}
+DEFAULT_SAMPLES = {"message" : 100} # keep 1 in N records, per frame logs are the bulk of the file
+
+def get_logger(category : str) -> logging.Logger:
+    """
+    'client_logger.<category>', propagates to the pipeline handler on 'client_logger'
+    """
+    return logging.getLogger(f"{ROOT}.{category}")
+
+def set_level(category : str, level):
+    """
+    level is a logging constant or a name like "DEBUG"
+    """
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+    get_logger(category).setLevel(level)
+
+def set_sample(category : str, every : int):
+    """
+    keep 1 in `every` records of a category, 1 keeps all of them
+    """
+    logger = get_logger(category)
+    for old in [f for f in logger.filters if isinstance(f, SampleFilter)]:
+        logger.removeFilter(old)
+    if every > 1:
+        logger.addFilter(SampleFilter(every))
+
+def configure(levels : dict = None, samples : dict = None):
+    """
+    apply per category levels and sample rates, anything not given keeps the defaults
+    """
+    for category, level in dict(DEFAULT_LEVELS, **(levels or {})).items():
+        set_level(category, level)
+    for category, every in dict(DEFAULT_SAMPLES, **(samples or {})).items():
+        set_sample(category, every)
+
+
+class SampleFilter(logging.Filter):
+    """
+    passes every Nth record, warnings and errors always pass
+    """
+
+    def __init__(self, every : int):
+        super().__init__()
+        self.every = every
+        self.counter = itertools.count()
+
+    def filter(self, record : logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        return next(self.counter) % self.every == 0
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler.prepare formats the message on the calling thread, this one leaves msg and args alone
+    so the listener thread does the formatting (args must not change after the call, ours are Messages and strings)
+    """
+
+    def prepare(self, record : logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            # tracebacks hold frames, render them now
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LogPipeline:
+    """
+    one per process: a QueueHandler on 'client_logger' feeding a QueueListener that writes a size rotated file
+    clients in the same process share it (the first one's data_dir holds the file), stop() when the last one leaves
+    """
+
+    lock = threading.Lock()
+    active = None
+    users = 0
+
+    def __init__(self, path : str, max_bytes : int = MAX_BYTES, backups : int = BACKUPS):
+        self.path = path
+        self.queue = queue.SimpleQueue()
+        self.file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, delay=True)
+        self.file_handler.setFormatter(logging.Formatter(FORMAT))
+        self.queue_handler = DeferredQueueHandler(self.queue)
+        self.listener = logging.handlers.QueueListener(self.queue, self.file_handler)
+
+    @classmethod
+    def acquire(cls : object, data_dir : str, host_id : str) -> object:
+        """
+        start the process pipeline if needed, every acquire needs a release
+        """
+        with cls.lock:
+            if cls.active is None:
+                root = logging.getLogger(ROOT)
+                root.setLevel(logging.INFO)
+                root.propagate = False # file only, keep log lines out of the terminal UI
+                configure()
+                pipeline = cls(os.path.join(data_dir, f"{host_id}_log.log"))
+                root.addHandler(pipeline.queue_handler)
+                pipeline.listener.start()
+                cls.active = pipeline
+            cls.users += 1
+            return cls.active
+
+    @classmethod
+    def release(cls : object):
+        """
+        flush and close once the last client is done
+        """
+        with cls.lock:
+            if cls.active is None:
+                return
+            cls.users -= 1
+            if cls.users > 0:
+                return
+            pipeline, cls.active = cls.active, None
+        logging.getLogger(ROOT).removeHandler(pipeline.queue_handler)
+        pipeline.listener.stop()
+        pipeline.file_handler.close()
+
+    @classmethod
+    def after_fork(cls : object):
+        """
+        a forked child inherits the handler but not the listener thread, drop it so the queue can't grow forever
+        """
+        if cls.active is not None:
+            logging.getLogger(ROOT).removeHandler(cls.active.queue_handler)
+        cls.lock = threading.Lock()
+        cls.active = None
+        cls.users = 0
+
+
+os.register_at_fork(after_in_child=LogPipeline.after_fork)
@@ -7,16 +7,19 @@ Message class that holds message information. Provides a standard interface for
 
 from datetime import datetime
 import json 
+import hashlib
 
 from identification import Identification
 
+CUSTOM_OPCODES = 256 # first opcode of a registered type, standard types stay below it
+
 class Message:
     """
     holds message info
     """
 
     encoding = "utf-8"
-    standard_types = [
+    standard_types = [ # only ever append, a type's position is its opcode
         "BEGIN_CONVERSATION_REQUEST",
         "BEGIN_CONVERSATION_RESPONSE",
         #
@@ -36,10 +39,52 @@ class Message:
         #
         "READ_RECEIPT",
         #
+        "BATCH_MESSAGE", # content is a list of serialized messages flushed from an outbox
+        "ACK", # content is a list of message keys that were delivered
+        #
+        "ATTACHMENT_OFFER", # content is a dict describing a file streamed over a separate data socket
+        "ATTACHMENT_RESUME", # content is a transfer id the receiver wants re-offered
+        "ATTACHMENT_COMPLETE", # content is a transfer id the receiver finished and verified
+        #
         "ERROR",
         #
         "PULSECHECK_REQUEST", # will be removed
         "PULSECHECK_RESPONSE", # will be removed
+        #
+        "BACKUP_STORE", # content is a sealed history segment (see backup.py) for a friend to keep
+        "BACKUP_STORED", # content says whether the friend kept it
+        "BACKUP_FETCH", # content names a segment we want back
+        "BACKUP_DATA", # content is that segment, or none
+    ]
+
+    # types added at runtime by register_type, in registration order
+    custom_types = []
+
+    # type -> opcode: a standard type's index in standard_types (append only, so these never move), a custom type's
+    # CUSTOM_OPCODES + its index in custom_types (registration order, only meaningful inside one process)
+    opcodes = {}
+
+    # what a type is for, decides whether it is kept in history (see Client.persisted_categories)
+    #   user: things a person wrote or did, shown in the conversation
+    #   bulk: carries other messages (history sync, outbox batches), unpacked instead of stored as is
+    #   control: protocol traffic, types not listed here count as control
+    categories = {
+        "TEXT_MESSAGE_REQUEST" : "user",
+        "TEXT_MESSAGE_RESPONSE" : "user",
+        "FRIEND_REQUEST" : "user",
+        "FRIEND_RESPONSE" : "user",
+        "END_FRIENDS" : "user",
+        "HISTORY_REQUEST" : "bulk",
+        "HISTORY_RESPONSE" : "bulk",
+        "BATCH_MESSAGE" : "bulk",
+        "BACKUP_STORE" : "bulk",
+        "BACKUP_DATA" : "bulk",
+    }
+
+    # local delivery states, never sent over the wire
+    delivery_states = [
+        "QUEUED", # waiting in the outbox
+        "SENT", # written to a socket, waiting for an ack
     ]
 
     def __init__(
@@ -58,18 +103,50 @@ class Message:
             self.datetime = dt
         else:
             self.datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.key = None
+        self.state = None
+        self.ack = None # optional [key, datetime] read receipt riding along on this frame, never stored
+        self.duplicate = False # local only, set on receive when this conn already delivered the same key
     
-    def serialize(self) -> str:
+    def __str__(self) -> str:
+        return self.serialize()
+
+    @classmethod
+    def register_type(cls : object, type : str, category : str = None) -> int:
+        """
+        add a new message type (for third party handlers), returns its opcode
+        custom types are numbered after CUSTOM_OPCODES, so registering one never moves a standard type's opcode
+        new types are control (not stored) unless given a category
+        """
+        if category is not None:
+            cls.categories[type] = category
+        if type not in cls.opcodes:
+            cls.custom_types.append(type)
+            cls.opcodes[type] = CUSTOM_OPCODES + len(cls.custom_types) - 1
+        return cls.opcodes[type]
+
+    @classmethod
+    def opcode(cls : object, type : str) -> int:
+        return cls.opcodes.get(type, -1)
+
+    @classmethod
+    def category(cls : object, type : str) -> str:
+        return cls.categories.get(type, "control")
+
+    def serialize(self, with_ack : bool = True) -> str:
         """
         put a message obj into json dumps string format for sending
         """
-        return json.dumps({
+        data = {
             "sender" : self.sender.to_string(),
             "receiver" : self.receiver.to_string(),
             "content" : self.content,
             "type" : self.type,
             "datetime" : self.datetime,
-        })
+        }
+        if with_ack and self.ack is not None:
+            data["ack"] = self.ack
+        return json.dumps(data)
 
     @classmethod
     def deserialize(cls : object, json_str : str) -> object:
@@ -77,13 +154,15 @@ class Message:
         create a message obj from json dumps string format
         """
         data = json.loads(json_str)
-        return cls(
+        message = cls(
             sender=Identification.from_string(data["sender"]),
             receiver=Identification.from_string(data["receiver"]),
             content=data["content"],
             type=data["type"],
             dt=data["datetime"],
         )
+        message.ack = data.get("ack")
+        return message
 
     @classmethod
     def encode_msg(cls : object, message : str) -> bytes:  
@@ -172,4 +251,21 @@ class Message:
         return self.type
     
     def get_datetime(self) -> str:
-        return self.datetime
\ No newline at end of file
+        return self.datetime
+
+    def get_key(self) -> str:
+        """
+        short stable id for this message, the same on both sides of a conversation (a piggybacked ack does not change it)
+        """
+        if self.key is None:
+            self.key = hashlib.sha1(self.serialize(with_ack=False).encode(self.encoding)).hexdigest()[:16]
+        return self.key
+
+    def get_state(self) -> str:
+        return self.state
+
+    def set_state(self, state : str):
+        self.state = state
+
+
+Message.opcodes.update({type : opcode for opcode, type in enumerate(Message.standard_types)})
@@ -0,0 +1,336 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+metrics.py
+MetricsRegistry class for cheap counters, gauges, and streaming histograms, plus an optional localhost Prometheus text endpoint
+"""
+
+from bisect import bisect_left
+import functools
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# histogram bucket upper bounds, 1-2-5 steps from 1 microsecond to 1000 (seconds or bytes / 1e6 etc, unit is up to the metric)
+def make_buckets(low : float = 1e-6, high : float = 1e3) -> list:
+    buckets = []
+    step = low
+    while step <= high:
+        for mult in (1, 2, 5):
+            buckets.append(step * mult)
+        step *= 10
+    return buckets
+
+TIME_BUCKETS = make_buckets(1e-6, 1e2)
+SIZE_BUCKETS = make_buckets(1e1, 1e10)
+
+class Counter:
+    """
+    monotonically increasing number
+    updates are not locked to stay cheap on the hot path, a thread switch mid update can rarely drop an increment
+    """
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n : float = 1):
+        self.value += n
+
+    def get(self) -> float:
+        return self.value
+
+
+class Traffic:
+    """
+    message and byte counts for one kind of traffic, one object so the hot path does one lookup for both
+    """
+
+    __slots__ = ("messages", "bytes")
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+
+    def get(self) -> dict:
+        return {"messages" : self.messages, "bytes" : self.bytes}
+
+
+class Gauge:
+    """
+    number that goes up and down, or a function read only when metrics are read (free on the hot path)
+    """
+
+    def __init__(self, func = None):
+        self.value = 0
+        self.func = func
+
+    def set(self, value : float):
+        self.value = value
+
+    def get(self) -> float:
+        if self.func:
+            try:
+                return self.func()
+            except Exception:
+                return float("nan")
+        return self.value
+
+
+class Histogram:
+    """
+    streaming histogram over fixed buckets, keeps count, sum, min, and max, never stores samples
+    unlocked like Counter, count is derived from the buckets so it always matches them
+    """
+
+    def __init__(self, buckets : list = TIME_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # last slot is +Inf
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def observe(self, value : float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def time(self):
+        """
+        context manager that observes elapsed seconds
+        """
+        return _Timer(self)
+
+    def quantile(self, q : float) -> float:
+        """
+        estimate a quantile as the upper bound of the bucket it falls in
+        """
+        counts = list(self.counts)
+        total = sum(counts)
+        if total == 0:
+            return 0.0
+        target = q * total
+        seen = 0
+        for index, n in enumerate(counts):
+            seen += n
+            if seen >= target:
+                if index < len(self.buckets):
+                    return min(self.buckets[index], self.max)
+                return self.max
+        return self.max
+
+    def get(self) -> dict:
+        count = self.count
+        return {
+            "count" : count,
+            "sum" : self.sum,
+            "min" : self.min if count else None,
+            "max" : self.max if count else None,
+            "p50" : self.quantile(0.5),
+            "p99" : self.quantile(0.99),
+        }
+
+
+class _Timer:
+
+    def __init__(self, histogram : Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Family:
+    """
+    a named metric with optional labels, children are created once and cached
+    """
+
+    def __init__(self, name : str, help : str, kind : str, labels : tuple, factory):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.label_names = labels
+        self.factory = factory
+        self.children = {}
+        self.lock = threading.Lock()
+        if not labels:
+            self.children[()] = factory()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.factory())
+        return child
+
+    # unlabeled shortcuts
+    def inc(self, n : float = 1):
+        self.children[()].inc(n)
+
+    def set(self, value : float):
+        self.children[()].set(value)
+
+    def observe(self, value : float):
+        self.children[()].observe(value)
+
+    def time(self):
+        return self.children[()].time()
+
+    def record(self, value : str, nbytes : int):
+        """
+        traffic fast path for families with a single label, about one dict lookup per message
+        """
+        child = self.children.get((value,))
+        if child is None:
+            child = self.labels(value)
+        child.messages += 1
+        child.bytes += nbytes
+
+
+class MetricsRegistry:
+    """
+    holds every metric for one client
+    """
+
+    def __init__(self):
+        self.families = {}
+        self.lock = threading.Lock()
+
+    def _family(self, name : str, help : str, kind : str, labels : tuple, factory) -> Family:
+        with self.lock:
+            if name not in self.families:
+                self.families[name] = Family(name, help, kind, tuple(labels), factory)
+            return self.families[name]
+
+    def counter(self, name : str, help : str = "", labels : tuple = ()) -> Family:
+        return self._family(name, help, "counter", labels, Counter)
+
+    def gauge(self, name : str, help : str = "", labels : tuple = (), func = None) -> Family:
+        return self._family(name, help, "gauge", labels, lambda: Gauge(func))
+
+    def histogram(self, name : str, help : str = "", labels : tuple = (), buckets : list = TIME_BUCKETS) -> Family:
+        return self._family(name, help, "histogram", labels, lambda: Histogram(buckets))
+
+    def traffic(self, name : str, help : str = "", labels : tuple = ("type",)) -> Family:
+        """
+        messages and bytes per label, exported as {name}_messages_total and {name}_bytes_total
+        """
+        return self._family(name, help, "traffic", labels, Traffic)
+
+    def snapshot(self) -> dict:
+        """
+        every metric as plain python data, labeled children keyed by their label values joined with ','
+        """
+        with self.lock:
+            families = list(self.families.values())
+        snap = {}
+        for family in families:
+            if family.label_names:
+                snap[family.name] = {",".join(values) : child.get() for values, child in list(family.children.items())}
+            else:
+                snap[family.name] = family.children[()].get()
+        return snap
+
+    def to_prometheus(self) -> str:
+        """
+        Prometheus text exposition format
+        """
+        with self.lock:
+            families = list(self.families.values())
+        lines = []
+        for family in families:
+            if family.kind == "traffic":
+                for field in ("messages", "bytes"):
+                    name = f"{family.name}_{field}_total"
+                    if family.help:
+                        lines.append(f"# HELP {name} {family.help} ({field})")
+                    lines.append(f"# TYPE {name} counter")
+                    for values, child in list(family.children.items()):
+                        labels = ",".join(f'{label}="{value}"' for label, value in zip(family.label_names, values))
+                        suffix = f"{{{labels}}}" if labels else ""
+                        lines.append(f"{name}{suffix} {getattr(child, field)}")
+                continue
+            if family.help:
+                lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for values, child in list(family.children.items()):
+                labels = ",".join(f'{name}="{value}"' for name, value in zip(family.label_names, values))
+                if family.kind == "histogram":
+                    cumulative = 0
+                    for bound, n in zip(child.buckets + [float("inf")], list(child.counts)):
+                        cumulative += n
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        bucket_labels = ",".join(filter(None, [labels, f'le="{le}"']))
+                        lines.append(f"{family.name}_bucket{{{bucket_labels}}} {cumulative}")
+                    suffix = f"{{{labels}}}" if labels else ""
+                    lines.append(f"{family.name}_sum{suffix} {child.sum}")
+                    lines.append(f"{family.name}_count{suffix} {child.count}")
+                else:
+                    suffix = f"{{{labels}}}" if labels else ""
+                    lines.append(f"{family.name}{suffix} {child.get()}")
+        return "\n".join(lines) + "\n"
+
+
+def timed(op : str):
+    """
+    method decorator for objects with an op_latency attribute (histogram family labeled by op), free when it is None
+    """
+    def wrap(func):
+        @functools.wraps(func)
+        def inner(self, *args, **kwargs):
+            family = self.op_latency
+            if family is None:
+                return func(self, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                family.labels(op).observe(time.perf_counter() - start)
+        return inner
+    return wrap
+
+
+class MetricsServer:
+    """
+    serves a registry as Prometheus text on localhost only
+    """
+
+    def __init__(self, registry : MetricsRegistry, port : int, host : str = "127.0.0.1"):
+        self.registry = registry
+
+        registry_ref = registry
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry_ref.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # keep http noise out of the terminal
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
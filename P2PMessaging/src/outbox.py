@@ -0,0 +1,233 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+outbox.py
+Outbox class that durably stores undelivered messages per peer until they are acknowledged
+
+on disk: <data>/<id>_outbox.json is a snapshot (peer id -> entries) and <data>/<id>_outbox.log a journal of changes
+since, one JSON line each ({"op": "add" | "state" | "ack", ...}). a change is one appended line, an add is fsynced
+before enqueue returns. once the journal is long compared to what is queued, the snapshot is rewritten and the
+journal emptied. replaying is idempotent, so a crash between the two only replays changes already in the snapshot
+"""
+
+import json
+import os
+import threading
+import time
+
+from identification import Identification
+from message import Message
+from exception import CustomException
+
+COMPACT_LINES = 1000 # journal lines before a snapshot is considered, at least twice the queued entries
+
+class Outbox:
+    """
+    per peer store and forward queue, journaled on every change so nothing is lost if we crash
+    """
+
+    # message types worth holding on to for a peer that is not connected
+    queued_types = [
+        "TEXT_MESSAGE_REQUEST",
+        "FRIEND_REQUEST",
+        "FRIEND_RESPONSE",
+        "END_FRIENDS",
+    ]
+
+    def __init__(
+            self,
+            host : Identification,
+            data_dir : str = "../data",
+        ):
+        self.host = host
+        self.fp = f"{data_dir}/{host.get_id()}_outbox.json"
+        self.journal_fp = f"{data_dir}/{host.get_id()}_outbox.log"
+        self.queues = {} # peer id -> key -> entry {"key", "message", "state", "queued_at"}, oldest first
+        self.lock = threading.Lock()
+        self.journal = None # append handle, opened on the first change
+        self.journal_lines = 0
+
+        # load outbox if it exists, otherwise start empty
+        try:
+            self.load()
+        except CustomException:
+            self.queues = {}
+
+    @classmethod
+    def should_queue(cls, message : Message) -> bool:
+        return message.get_type() in cls.queued_types
+
+    def enqueue(self, message : Message):
+        """
+        add a message to its receiver's queue, state QUEUED
+        """
+        message.set_state("QUEUED")
+        entry = {
+            "key" : message.get_key(),
+            "message" : message.serialize(),
+            "state" : "QUEUED",
+            "queued_at" : time.time(),
+        }
+        peer_id = message.get_receiver().get_id()
+        with self.lock:
+            queue = self.queues.setdefault(peer_id, {})
+            if entry["key"] not in queue:
+                queue[entry["key"]] = entry
+                self._journal({"op" : "add", "peer" : peer_id, "entry" : entry}, sync=True)
+
+    def pending(self, peer_id : str) -> list:
+        """
+        every message not yet acknowledged by a peer, oldest first
+        """
+        with self.lock:
+            entries = list(self.queues.get(peer_id, {}).values())
+        messages = []
+        for entry in entries:
+            message = Message.deserialize(entry["message"])
+            message.set_state(entry["state"])
+            messages.append(message)
+        return messages
+
+    def mark_sent(self, peer_id : str, keys : list):
+        """
+        messages were written to a socket, they stay queued until acked
+        """
+        self._set_state(peer_id, keys, "SENT")
+
+    def acknowledge(self, peer_id : str, keys : list) -> int:
+        """
+        remove delivered messages, returns number removed
+        """
+        with self.lock:
+            queue = self.queues.get(peer_id, {})
+            removed = [key for key in keys if queue.pop(key, None) is not None]
+            if not queue:
+                self.queues.pop(peer_id, None)
+            if removed:
+                # not fsynced, an ack lost in a crash only means the message is sent again and dropped as a duplicate
+                self._journal({"op" : "ack", "peer" : peer_id, "keys" : removed})
+        return len(removed)
+
+    def depth(self, peer_id : str = None) -> int:
+        """
+        number of undelivered messages for one peer, or all peers if peer_id is None
+        """
+        with self.lock:
+            if peer_id is not None:
+                return len(self.queues.get(peer_id, []))
+            return sum(len(queue) for queue in self.queues.values())
+
+    def oldest_age(self, peer_id : str = None) -> float:
+        """
+        seconds the oldest undelivered message has been waiting, 0 if nothing is waiting
+        """
+        now = time.time()
+        with self.lock:
+            if peer_id is not None:
+                queues = [self.queues.get(peer_id, {})]
+            else:
+                queues = self.queues.values()
+            times = [entry["queued_at"] for queue in queues for entry in queue.values()]
+        return now - min(times) if times else 0.0
+
+    def stats(self) -> dict:
+        """
+        depth and oldest age per peer, for monitoring
+        """
+        with self.lock:
+            peer_ids = list(self.queues.keys())
+        return {peer_id : {"depth" : self.depth(peer_id), "oldest_age" : self.oldest_age(peer_id)} for peer_id in peer_ids}
+
+    def _set_state(self, peer_id : str, keys : list, state : str):
+        with self.lock:
+            queue = self.queues.get(peer_id, {})
+            changed = [key for key in keys if key in queue]
+            for key in changed:
+                queue[key]["state"] = state
+            if changed:
+                self._journal({"op" : "state", "peer" : peer_id, "keys" : changed, "state" : state})
+
+    def _journal(self, change : dict, sync : bool = False):
+        """
+        append one change, caller holds the lock. compacts into the snapshot once the journal is mostly dead lines
+        """
+        try:
+            if self.journal is None:
+                self.journal = open(self.journal_fp, 'a')
+            self.journal.write(json.dumps(change) + "\n")
+            self.journal.flush()
+            if sync:
+                os.fsync(self.journal.fileno())
+            self.journal_lines += 1
+            if self.journal_lines >= COMPACT_LINES and self.journal_lines >= 2 * sum(len(queue) for queue in self.queues.values()):
+                self._save()
+        except Exception as e:
+            raise CustomException(f"Unable to save to file! - {e}")
+
+    @staticmethod
+    def _apply(queues : dict, change : dict):
+        op = change["op"]
+        if op == "add":
+            queues.setdefault(change["peer"], {}).setdefault(change["entry"]["key"], change["entry"])
+            return
+        queue = queues.get(change["peer"], {})
+        for key in change["keys"]:
+            if op == "ack":
+                queue.pop(key, None)
+            elif key in queue:
+                queue[key]["state"] = change["state"]
+        if not queue:
+            queues.pop(change["peer"], None)
+
+    def _save(self):
+        """
+        write the snapshot and empty the journal, caller holds the lock. written to a temp file and fsynced first so a
+        crash never leaves half a file
+        """
+        try:
+            tmp_fp = self.fp + ".tmp"
+            with open(tmp_fp, 'w') as file:
+                json.dump({peer_id : list(queue.values()) for peer_id, queue in self.queues.items()}, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_fp, self.fp)
+            if self.journal is not None:
+                self.journal.close()
+            self.journal = open(self.journal_fp, 'w')
+            self.journal_lines = 0
+        except Exception as e:
+            raise CustomException(f"Unable to save to file! - {e}")
+
+    def save(self):
+        """
+        save outbox to disk
+        """
+        with self.lock:
+            self._save()
+
+    def load(self):
+        """
+        load the snapshot then replay the journal, a line cut short by a crash ends the replay
+        and the snapshot is rewritten
+        """
+        try:
+            queues = {}
+            torn = False
+            if os.path.exists(self.fp):
+                with open(self.fp, 'r') as file:
+                    queues = {peer_id : {entry["key"] : entry for entry in entries} for peer_id, entries in json.load(file).items()}
+            if os.path.exists(self.journal_fp):
+                with open(self.journal_fp, 'r') as file:
+                    for line in file:
+                        try:
+                            change = json.loads(line)
+                        except ValueError:
+                            torn = True
+                            break
+                        self._apply(queues, change)
+                        self.journal_lines += 1
+            self.queues = queues
+            if torn: # later lines must not be appended after half a line
+                self._save()
+        except Exception as e:
+            raise CustomException(f"Unable to load from file! - {e}")
@@ -0,0 +1,217 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+profiling.py
+Profiler class for timing pipeline stages per message type and for turning on cProfile / stack sampling / tracemalloc for a window at runtime
+"""
+
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter as TallyCounter
+from functools import lru_cache
+
+from metrics import MetricsRegistry
+from logs import get_logger
+
+SAMPLE_INTERVAL = 0.005 # seconds between stack samples
+TOP_ALLOCATORS = 10 # per subsystem
+
+@lru_cache(maxsize=1024)
+def subsystem_of(filename : str) -> str:
+    """
+    group a source file into a subsystem, our modules by name and everything else by top level package
+    """
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    if os.path.dirname(os.path.abspath(filename)) == src_dir:
+        return os.path.splitext(os.path.basename(filename))[0]
+    parts = filename.replace("\\", "/").split("/")
+    for marker in ("site-packages", "dist-packages"):
+        if marker in parts:
+            return "lib:" + parts[parts.index(marker) + 1]
+    if parts and parts[-1].endswith(".py"):
+        return "stdlib:" + os.path.splitext(parts[-1])[0]
+    return "other"
+
+class Profiler:
+    """
+    stage tracing is a flag checked on the hot path, profiling windows run on their own thread and dump to the data directory
+    """
+
+    def __init__(
+            self,
+            host_id : str,
+            metrics : MetricsRegistry,
+            data_dir : str = "../data",
+        ):
+        self.host_id = host_id
+        self.dump_dir = f"{data_dir}/profiles"
+        self.stage_latency = metrics.histogram("stage_seconds", "time spent in each pipeline stage", ("stage", "type"))
+
+        self.tracing = False # time stages per message type
+        self.cprofile_active = False # stages also run under a per thread cProfile
+        self.window_thread = None
+        self.thread_profiles = {} # thread ident -> cProfile.Profile for the current window
+        self.profiles_lock = threading.Lock()
+        self.local = threading.local() # stage nesting depth per thread, only the outermost stage toggles cProfile
+        self.last_dump = []
+        self.logger = get_logger("metrics")
+
+    def set_tracing(self, on : bool):
+        self.tracing = on
+
+    def observe(self, stage : str, msg_type : str, seconds : float):
+        """
+        record one stage timing, callers check self.tracing first so this costs nothing when off
+        """
+        self.stage_latency.labels(stage, msg_type).observe(seconds)
+
+    def call(self, stage : str, msg_type : str, func, *args):
+        """
+        run func as a traced stage, under this thread's cProfile if a window is open
+        msg_type None means label by the type of whatever func returns (decoding)
+        """
+        if not self.tracing and not self.cprofile_active:
+            return func(*args)
+        depth = getattr(self.local, "depth", 0)
+        profile = self._thread_profile() if self.cprofile_active and depth == 0 else None
+        result = None
+        self.local.depth = depth + 1
+        start = time.perf_counter()
+        if profile:
+            profile.enable()
+        try:
+            result = func(*args)
+            return result
+        finally:
+            if profile:
+                profile.disable()
+            self.local.depth = depth
+            if self.tracing:
+                self.observe(stage, msg_type if msg_type else getattr(result, "type", "UNKNOWN"), time.perf_counter() - start)
+
+    def _thread_profile(self) -> cProfile.Profile:
+        ident = threading.get_ident()
+        profile = self.thread_profiles.get(ident)
+        if profile is None:
+            with self.profiles_lock:
+                profile = self.thread_profiles.setdefault(ident, cProfile.Profile())
+        return profile
+
+    def start_window(self, seconds : float, cpu : bool = True, memory : bool = True, interval : float = SAMPLE_INTERVAL) -> bool:
+        """
+        profile everything for a window without restarting, returns False if a window is already open
+        """
+        if self.window_thread and self.window_thread.is_alive():
+            return False
+        self.window_thread = threading.Thread(target=self._run_window, args=(seconds, cpu, memory, interval), daemon=True)
+        self.window_thread.start()
+        return True
+
+    def wait(self, timeout : float = None):
+        if self.window_thread:
+            self.window_thread.join(timeout)
+
+    def _run_window(self, seconds : float, cpu : bool, memory : bool, interval : float):
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        started_tracemalloc = False
+        stacks = TallyCounter()
+        try:
+            if memory and not tracemalloc.is_tracing():
+                tracemalloc.start(25)
+                started_tracemalloc = True
+            if cpu:
+                with self.profiles_lock:
+                    self.thread_profiles = {}
+                self.cprofile_active = True
+
+            # sample every thread's stack until the window closes
+            end = time.perf_counter() + seconds
+            me = threading.get_ident()
+            while time.perf_counter() < end:
+                if cpu:
+                    for ident, frame in sys._current_frames().items():
+                        if ident != me:
+                            stacks[self._fold(frame)] += 1
+                time.sleep(interval)
+
+            self.cprofile_active = False
+            os.makedirs(self.dump_dir, exist_ok=True)
+            dumped = []
+            if cpu:
+                dumped += self._dump_cpu(stamp, stacks)
+            if memory:
+                dumped.append(self._dump_memory(stamp))
+            self.last_dump = dumped
+            self.logger.info("Profiling window done, wrote %s", dumped)
+        except Exception as e:
+            self.logger.error("Exception raised while profiling: %s", e)
+        finally:
+            self.cprofile_active = False
+            if started_tracemalloc:
+                tracemalloc.stop()
+
+    @staticmethod
+    def _fold(frame) -> str:
+        """
+        one stack in flame graph folded format, root first
+        """
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{subsystem_of(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _dump_cpu(self, stamp : str, stacks : TallyCounter) -> list:
+        """
+        folded stacks for flamegraph.pl / speedscope, plus merged cProfile stats of every traced thread
+        """
+        dumped = []
+        folded_path = f"{self.dump_dir}/{self.host_id}_{stamp}.folded"
+        with open(folded_path, 'w') as file:
+            for stack, count in stacks.most_common():
+                file.write(f"{stack} {count}\n")
+        dumped.append(folded_path)
+
+        with self.profiles_lock:
+            profiles = list(self.thread_profiles.values())
+            self.thread_profiles = {}
+        stats = None
+        for profile in profiles:
+            try:
+                if stats is None:
+                    stats = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+            except TypeError:
+                continue # thread never ran a stage under this profile
+        if stats is not None:
+            pstats_path = f"{self.dump_dir}/{self.host_id}_{stamp}.pstats"
+            stats.dump_stats(pstats_path)
+            dumped.append(pstats_path)
+        return dumped
+
+    def _dump_memory(self, stamp : str) -> str:
+        """
+        top allocating lines per subsystem
+        """
+        snapshot = tracemalloc.take_snapshot()
+        by_subsystem = {}
+        for stat in snapshot.statistics("lineno"):
+            frame = stat.traceback[0]
+            by_subsystem.setdefault(subsystem_of(frame.filename), []).append(stat)
+
+        totals = sorted(((sum(s.size for s in stats), name) for name, stats in by_subsystem.items()), reverse=True)
+        path = f"{self.dump_dir}/{self.host_id}_{stamp}_alloc.txt"
+        with open(path, 'w') as file:
+            for total, name in totals:
+                file.write(f"{name}: {total / 1024:.1f} KiB\n")
+                for stat in by_subsystem[name][:TOP_ALLOCATORS]:
+                    frame = stat.traceback[0]
+                    file.write(f"    {stat.size / 1024:9.1f} KiB {stat.count:8d} blocks  {frame.filename}:{frame.lineno}\n")
+        return path
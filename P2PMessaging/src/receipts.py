@@ -0,0 +1,130 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+receipts.py
+ReadReceipts class that collapses read receipts per peer into one cumulative "read up to" mark and sends it late.
+DeliveryAcks class that does the same for outbox acks, the keys received on a conn go out together in one ACK frame
+
+a receipt waits DELAY seconds, any newer read replaces it, and if we send the peer a text message in the meantime the
+mark rides along on that frame (Message.ack) instead of costing a frame of its own
+"""
+
+import threading
+
+from transport import start_timer
+
+DELAY = 0.5 # seconds a receipt may wait for a frame to piggyback on
+ACK_DELAY = 0.05 # seconds an ack waits for more keys, the sender only resends on reconnect so this is not on any path
+MAX_ACK_KEYS = 256 # keys in one ACK, a full one goes out at once
+
+class ReadReceipts:
+    """
+    pending [key, datetime] mark per peer, send(peer_id, mark) is called for marks nothing picked up
+    """
+
+    def __init__(self, send, delay : float = DELAY, timer = start_timer):
+        self.send = send
+        self.delay = delay
+        self.timer = timer # timer(delay, func, *args), a transport's timer so a simulated client runs on virtual time
+        self.pending = {} # peer id -> [key, datetime]
+        self.timers = {} # peer id -> timer
+        self.lock = threading.Lock()
+        self.running = True
+
+    def schedule(self, peer_id : str, mark : list):
+        """
+        remember the newest mark for a peer and start its timer if one is not already running
+        """
+        with self.lock:
+            if not self.running:
+                return
+            current = self.pending.get(peer_id)
+            if current is None or mark[1] >= current[1]:
+                self.pending[peer_id] = mark
+            if peer_id not in self.timers:
+                self.timers[peer_id] = self.timer(self.delay, self.flush, peer_id)
+
+    def take(self, peer_id : str) -> list:
+        """
+        hand the pending mark to an outgoing frame, None if there is nothing to send
+        """
+        if not self.pending: # no lock on the common path
+            return None
+        with self.lock:
+            return self.pending.pop(peer_id, None)
+
+    def flush(self, peer_id : str):
+        """
+        timer fired, send whatever was not piggybacked
+        """
+        with self.lock:
+            self.timers.pop(peer_id, None)
+            mark = self.pending.pop(peer_id, None)
+        if mark is not None:
+            self.send(peer_id, mark)
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+            for timer in self.timers.values():
+                timer.cancel()
+            self.timers = {}
+            self.pending = {}
+
+
+class DeliveryAcks:
+    """
+    pending ack keys per conn, send(conn, keys) is called once per ACK_DELAY (or per MAX_ACK_KEYS) instead of per message
+    """
+
+    def __init__(self, send, delay : float = ACK_DELAY, max_keys : int = MAX_ACK_KEYS, timer = start_timer):
+        self.send = send
+        self.delay = delay
+        self.max_keys = max_keys
+        self.timer = timer # same as ReadReceipts.timer
+        self.pending = {} # conn -> keys
+        self.timers = {} # conn -> timer
+        self.lock = threading.Lock()
+        self.running = True
+
+    def schedule(self, conn, key : str):
+        with self.lock:
+            if not self.running:
+                return
+            keys = self.pending.setdefault(conn, [])
+            keys.append(key)
+            full = len(keys) >= self.max_keys
+            if not full and conn not in self.timers:
+                self.timers[conn] = self.timer(self.delay, self.flush, conn)
+        if full:
+            self.flush(conn)
+
+    def flush(self, conn):
+        """
+        send what is pending for conn now, the timer firing or a goodbye about to go out
+        """
+        with self.lock:
+            timer = self.timers.pop(conn, None)
+            keys = self.pending.pop(conn, None)
+        if timer is not None:
+            timer.cancel()
+        if keys:
+            self.send(conn, keys)
+
+    def discard(self, conn):
+        """
+        conn is gone, the sender keeps the messages queued and sends them again on the next conn
+        """
+        with self.lock:
+            timer = self.timers.pop(conn, None)
+            self.pending.pop(conn, None)
+        if timer is not None:
+            timer.cancel()
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+            for timer in self.timers.values():
+                timer.cancel()
+            self.timers = {}
+            self.pending = {}
@@ -0,0 +1,156 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+replay.py
+Replayer class, feeds the frames a Client received (from a capture.py file) into another Client, at the recorded pace,
+faster, or as fast as it can, so a real traffic mix can be profiled and benchmarked
+
+python3 replay.py ../data/<id>_capture.p2pcap --speed 10
+python3 replay.py capture.p2pcap --speed 0 --trace
+
+frames go through the same decode, record, ack, and dispatch steps as frames read in handle_conn, on one thread in
+capture order. each captured connection becomes a LiveConnection on a SinkSocket, so replies are counted and dropped.
+handshake frames (conn 0) are counted but not fed, the connections already exist
+"""
+
+import argparse
+import json
+import tempfile
+import time
+
+from client import Client
+from identification import Identification
+from live_connection import LiveConnection
+from outbox import Outbox
+from streams import wire_size
+from capture import read_capture, INBOUND
+
+class SinkSocket:
+    """
+    stands in for a peer's socket, writes are counted and dropped and reads see a closed connection
+    """
+
+    def __init__(self):
+        self.sent = 0
+
+    def sendall(self, data : bytes):
+        self.sent += len(data)
+
+    def recv(self, size : int) -> bytes:
+        return b""
+
+    def settimeout(self, timeout : float):
+        pass
+
+    def getpeername(self) -> tuple:
+        return ("0.0.0.0", 0)
+
+    def shutdown(self, how : int):
+        pass
+
+    def close(self):
+        pass
+
+
+class Replayer:
+    """
+    one capture into one Client
+    """
+
+    def __init__(self, client : Client, meta : dict):
+        self.client = client
+        self.meta = meta
+        self.conns = {} # conn id -> LiveConnection
+        self.types = {} # message type -> frames fed
+        self.skipped = 0
+
+    def conn(self, conn_id : int) -> LiveConnection:
+        conn = self.conns.get(conn_id)
+        if conn is None:
+            peer = Identification.from_string(self.meta["conns"][str(conn_id)])
+            conn = self.conns[conn_id] = LiveConnection(self.client.identification, peer, SinkSocket())
+            self.client.connections.append(conn)
+        return conn
+
+    def feed(self, conn_id : int, payload : bytes):
+        """
+        one received frame, handled the way handle_conn and manage_histories would
+        """
+        if conn_id == 0:
+            self.skipped += 1
+            return
+        conn = self.conn(conn_id)
+        message = self.client.accept_message(payload, conn, wire_size(len(payload)))
+        self.types[message.type] = self.types.get(message.type, 0) + 1
+        if message.type == "HISTORY_RESPONSE":
+            self.client.apply_history_response(message, conn)
+            return
+        if Outbox.should_queue(message):
+            self.client.send_ack([message.get_key()], conn)
+        if message.duplicate:
+            return
+        if not self.client.dispatch_message(message, conn): # conversation over, a later frame starts a new one
+            self.client.cleanup_conn(conn)
+            del self.conns[conn_id]
+
+    def run(self, records : list, speed : float = 1.0) -> dict:
+        """
+        feed every inbound record, speed 1 keeps the recorded gaps, 10 is ten times faster, 0 does not wait at all
+        """
+        frames = 0
+        size = 0
+        start = time.perf_counter()
+        for offset, conn_id, direction, payload in records:
+            if direction != INBOUND:
+                continue
+            if speed:
+                wait = offset / speed - (time.perf_counter() - start)
+                if wait > 0:
+                    time.sleep(wait)
+            self.feed(conn_id, payload)
+            frames += 1
+            size += len(payload)
+        elapsed = time.perf_counter() - start
+        return {
+            "frames" : frames,
+            "bytes" : size,
+            "seconds" : elapsed,
+            "frames_per_s" : frames / elapsed if elapsed else 0.0,
+            "handshake_frames" : self.skipped,
+            "types" : self.types,
+            "replies_bytes" : sum(conn.get_socket().sent for conn in self.conns.values()),
+        }
+
+
+def replay(fp : str, data_dir : str, speed : float = 1.0, trace : bool = False) -> dict:
+    """
+    replay a capture into a fresh Client (same identity as the captured one, no listening socket) and stop it
+    """
+    meta, records = read_capture(fp)
+    client = Client(Identification.from_string(meta["host"]), data_dir, bind=False)
+    client.profiler.set_tracing(trace)
+    try:
+        summary = Replayer(client, meta).run(records, speed)
+        summary["dropped_before_capture"] = meta["dropped"]
+        if trace:
+            summary["stages"] = client.get_stats().get("stage_seconds")
+        return summary
+    finally:
+        client.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="feed a capture file back into a Client")
+    parser.add_argument("capture", help="file from Client.save_capture or the control capture op")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 keeps the recorded pace, 10 is ten times faster, 0 is as fast as possible")
+    parser.add_argument("--data-dir", dest="data_dir", help="where the replaying client keeps history, a temporary directory by default")
+    parser.add_argument("--trace", action="store_true", help="time every pipeline stage per message type and print them")
+    args = parser.parse_args()
+    if args.data_dir:
+        summary = replay(args.capture, args.data_dir, args.speed, args.trace)
+    else:
+        with tempfile.TemporaryDirectory() as data_dir:
+            summary = replay(args.capture, data_dir, args.speed, args.trace)
+    print(json.dumps(summary, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -2,14 +2,19 @@
 Anthony Silva
 UNR, CPE 400, S24
 runner.py
-Entry point for the program
+Entry point for the program, python3 runner.py for the CLI or python3 runner.py --tui for the curses interface
 """
 
-from ui import UI
+import sys
 
 def main():
+    if "--tui" in sys.argv[1:]:
+        from tui import main as tui_main
+        tui_main()
+        return
+    from ui import UI
     my_ui = UI()
     my_ui.mutuals()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main() 
@@ -0,0 +1,240 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+shard.py
+ShardSupervisor class that owns the listening socket and hands accepted connections to N worker processes, pinning each peer to a shard by id
+
+SO_REUSEPORT would let every worker accept on the port, but the kernel spreads connections by address hash, so a peer could land on a
+different shard (and a different slice of history) each time it connects. Instead the supervisor peeks at the first frame (the peer's
+BEGIN_CONVERSATION_REQUEST, which carries its id) without consuming it, and passes the socket to the owning shard with SCM_RIGHTS.
+Each shard runs a normal Client with its own data directory, so a peer's history only ever lives in one process.
+"""
+
+import json
+import multiprocessing
+import os
+import selectors
+import socket
+import threading
+import time
+import zlib
+
+from client import Client
+from admission import AdmissionPolicy
+from identification import Identification
+from message import Message
+from streams import HEADER, MAX_FRAME_BYTES
+from logs import get_logger
+
+PEEK_DEADLINE = 5 # seconds to wait for a first frame before routing by address
+BACKLOG = 128
+
+def shard_for(key : str, shards : int) -> int:
+    """
+    stable shard index for a peer id (python's hash() is salted per process, crc32 is not)
+    """
+    return zlib.crc32(key.encode("utf-8")) % shards
+
+def run_shard(index : int, host : str, data_dir : str, channel : socket.socket, admission : AdmissionPolicy = None):
+    """
+    worker process body, adopts sockets the supervisor sends until told to stop
+    """
+    shard_dir = os.path.join(data_dir, f"shard{index}")
+    os.makedirs(shard_dir, exist_ok=True)
+    client = Client(Identification.from_string(host), shard_dir, bind=False, admission=admission)
+    while True:
+        try:
+            data, fds, _, _ = socket.recv_fds(channel, 65536, 1)
+        except OSError:
+            break
+        if not data:
+            break
+        request = json.loads(data)
+        op = request["op"]
+        if op == "adopt":
+            client.adopt_conn(socket.socket(fileno=fds[0]), tuple(request["peer"]))
+        elif op == "dial":
+            client.start_conn(tuple(request["peer"]))
+        elif op == "stats":
+            stats = client.get_stats()
+            stats["shard"] = index
+            channel.send(json.dumps(stats).encode("utf-8"))
+        elif op == "stop":
+            break
+    client.stop()
+    channel.close()
+
+
+class ShardSupervisor:
+    """
+    parent process: accepts, routes by peer id, and keeps the shard processes running
+    """
+
+    def __init__(
+            self,
+            identification : Identification,
+            data_dir : str = "../data",
+            shards : int = None,
+            backlog : int = BACKLOG,
+            admission : AdmissionPolicy = None,
+        ):
+        """
+        admission applies to each shard on its own, every shard counts and rate limits only the conns it adopts
+        """
+        self.identification = identification
+        self.admission = admission
+        self.data_dir = data_dir
+        self.shards = shards if shards else os.cpu_count() or 1
+        self.binding = (identification.get_ip(), int(identification.get_port()))
+
+        self.listening_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listening_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listening_socket.bind(self.binding)
+        self.listening_socket.listen(backlog)
+        self.listening_socket.setblocking(False)
+
+        self.selector = selectors.DefaultSelector()
+        self.processes = []
+        self.channels = []
+        self.channel_locks = []
+        self.running = False
+        self.thread = None
+        self.logger = get_logger("shard")
+
+    def start(self):
+        """
+        fork shard processes, then accept and route on a background thread
+        """
+        context = multiprocessing.get_context("fork")
+        for index in range(self.shards):
+            parent_end, child_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            process = context.Process(
+                target=run_shard,
+                args=(index, self.identification.to_string(), self.data_dir, child_end, self.admission),
+                daemon=True,
+            )
+            process.start()
+            child_end.close()
+            self.processes.append(process)
+            self.channels.append(parent_end)
+            self.channel_locks.append(threading.Lock())
+
+        self.running = True
+        self.selector.register(self.listening_socket, selectors.EVENT_READ, None)
+        self.thread = threading.Thread(target=self.route_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=2)
+        for index in range(len(self.channels)):
+            try:
+                self.send(index, {"op" : "stop"})
+            except OSError:
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for channel in self.channels:
+            channel.close()
+        self.listening_socket.close()
+        self.selector.close()
+
+    def send(self, index : int, request : dict, fds : list = ()):
+        with self.channel_locks[index]:
+            socket.send_fds(self.channels[index], [json.dumps(request).encode("utf-8")], list(fds))
+
+    def connect(self, peer_tuple : tuple, peer_id : str) -> int:
+        """
+        dial a peer from the shard that owns it, returns the shard index
+        """
+        index = shard_for(peer_id, self.shards)
+        self.send(index, {"op" : "dial", "peer" : list(peer_tuple)})
+        return index
+
+    def stats(self) -> list:
+        """
+        metrics snapshot from every shard
+        """
+        results = []
+        for index in range(self.shards):
+            with self.channel_locks[index]:
+                socket.send_fds(self.channels[index], [json.dumps({"op" : "stats"}).encode("utf-8")], [])
+                results.append(json.loads(self.channels[index].recv(1 << 20)))
+        return results
+
+    def route_loop(self):
+        """
+        accept new sockets, watch them until their first frame is readable, then hand them off
+        """
+        waiting = {} # socket -> (peer tuple, deadline)
+        while self.running:
+            for key, _ in self.selector.select(timeout=0.5):
+                if key.fileobj is self.listening_socket:
+                    self.accept_ready(waiting)
+                else:
+                    self.route_if_ready(key.fileobj, waiting)
+            # peers that never sent a full first frame get routed by address
+            now = time.monotonic()
+            for sock, (peer_tuple, deadline) in list(waiting.items()):
+                if now > deadline:
+                    self.hand_off(sock, peer_tuple, f"{peer_tuple[0]}:{peer_tuple[1]}", waiting)
+
+    def accept_ready(self, waiting : dict):
+        while True:
+            try:
+                sock, peer_tuple = self.listening_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                self.logger.error("Exception raised accepting for shards: %s", e)
+                return
+            sock.setblocking(False)
+            waiting[sock] = (peer_tuple, time.monotonic() + PEEK_DEADLINE)
+            self.selector.register(sock, selectors.EVENT_READ, None)
+
+    def route_if_ready(self, sock : socket.socket, waiting : dict):
+        """
+        peek (never consume) the first frame, route on the sender id inside it
+        a first frame claiming more than MAX_FRAME_BYTES is never waited on, the conn is closed like read_frame would
+        """
+        peer_tuple, _ = waiting[sock]
+        try:
+            header = sock.recv(HEADER.size, socket.MSG_PEEK)
+            if len(header) < HEADER.size:
+                if not header: # closed before saying anything
+                    self.drop(sock, waiting)
+                return
+            frame_len, _, _ = HEADER.unpack(header)
+            if frame_len > HEADER.size - 4 + MAX_FRAME_BYTES:
+                self.logger.warning("Dropped conn from %s:%s, first frame of %d bytes", peer_tuple[0], peer_tuple[1], frame_len)
+                self.drop(sock, waiting)
+                return
+            data = sock.recv(4 + frame_len, socket.MSG_PEEK)
+            if len(data) < 4 + frame_len:
+                return # rest of the frame not here yet
+            message = Message.prepare_receive(data[HEADER.size:])
+            key = message.get_sender().get_id()
+        except (BlockingIOError, InterruptedError):
+            return
+        except Exception:
+            key = f"{peer_tuple[0]}:{peer_tuple[1]}"
+        self.hand_off(sock, peer_tuple, key, waiting)
+
+    def hand_off(self, sock : socket.socket, peer_tuple : tuple, key : str, waiting : dict):
+        self.selector.unregister(sock)
+        del waiting[sock]
+        index = shard_for(key, self.shards)
+        try:
+            sock.setblocking(True)
+            self.send(index, {"op" : "adopt", "peer" : list(peer_tuple)}, [sock.fileno()])
+        except OSError as e:
+            self.logger.error("Exception raised handing conn to shard %d: %s", index, e)
+        sock.close() # the shard has its own copy of the fd now
+
+    def drop(self, sock : socket.socket, waiting : dict):
+        self.selector.unregister(sock)
+        del waiting[sock]
+        sock.close()
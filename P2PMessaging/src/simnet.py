@@ -0,0 +1,623 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+simnet.py
+SimNetwork class, an in-memory network with a virtual clock so thousands of Clients can run in one process
+
+every Client gets its own transport, ideally its own ip:
+    net = SimNetwork(latency=0.02, loss=0.01, seed=1)
+    client = Client(Identification("a", "a", "10.0.0.1", "5000"), data_dir, transport=net.transport("10.0.0.1"))
+    client.start_listening()
+    net.run(until=lambda: ..., timeout=60)
+
+bytes sent on a link arrive after its latency, plus the time to push them through its bandwidth, plus one rto for
+every MSS sized segment that is lost. the clock never moves on its own, run() (or start() on a background thread)
+waits until every node is blocked on the network, then jumps to the next delivery or socket timeout. delays and
+losses are drawn from one random.Random per socket seeded from seed and the socket's addresses, so a scenario that
+dials in the same order replays exactly
+
+a Client reads the clock through its transport too: admission rate limits, the handshake deadline, and the read
+receipt and ack timers all run on virtual time, the timers fire from step() on the thread running the clock instead
+of on threads of their own. only Client's own sockets are simulated, attachment transfers, discovery and the metrics
+server still use real ones
+"""
+
+import errno
+import heapq
+import itertools
+import random
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+MSS = 1460 # bytes per segment, loss is drawn per segment
+SETTLE = 0.001 # real seconds without network activity before the clock may jump
+RESOLUTION = 0.001 # virtual seconds, events this close together are delivered in one step
+MAX_SETTLE = 1.0 # real seconds to wait for a busy node before moving the clock anyway
+FIRST_PORT = 40000 # ephemeral ports handed to dialing sockets, per ip
+
+class LinkProfile:
+    """
+    how a link between two ips behaves, applies to both directions
+    """
+
+    def __init__(
+            self,
+            latency : float = 0.001,
+            bandwidth : float = None,
+            loss : float = 0.0,
+            rto : float = 0.2,
+            jitter : float = 0.0,
+        ):
+        self.latency = latency # one way, seconds
+        self.bandwidth = bandwidth # bytes per second, None for unlimited
+        self.loss = loss # chance a segment is lost and has to be resent
+        self.rto = rto # extra delay for each lost segment
+        self.jitter = jitter # up to this much extra one way delay per send
+
+    def copy(self, **overrides) -> "LinkProfile":
+        values = dict(vars(self))
+        values.update(overrides)
+        return LinkProfile(**values)
+
+
+class VirtualClock:
+    """
+    seconds since the network was made, only SimNetwork moves it
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self) -> float:
+        return self.now
+
+
+class SimTimer:
+    """
+    func(*args) once the clock reaches its event, unless cancelled first
+    """
+
+    __slots__ = ("func", "args", "cancelled")
+
+    def __init__(self, func, args : tuple):
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class SimSocket:
+    """
+    one end of a simulated TCP connection, the subset of socket.socket that Client uses
+    """
+
+    def __init__(self, net : "SimNetwork", local : tuple, remote : tuple):
+        self.net = net
+        self.local = local
+        self.remote = remote
+        self.peer = None # the SimSocket at the other end
+        self.chunks = deque() # delivered bytes not read yet
+        self.offset = 0 # read position in chunks[0]
+        self.eof = False
+        self.reset = False
+        self.closed = False
+        self.shut_wr = False
+        self.linger_reset = False # SO_LINGER 0, close sends RST
+        self.timeout = None
+        self.fresh = True # nobody has read from it yet, see SimNetwork.quiet
+        self.ready = threading.Condition(net.lock)
+        self.waiters = 0
+        self.busy_until = 0.0 # when the link is done pushing what was sent so far
+        self.last_arrival = 0.0 # bytes never overtake earlier bytes
+        self.stalled = [] # (kind, data) held back by a partition
+        self.rng = random.Random(f"{net.seed}/{local[0]}:{local[1]}/{remote[0]}:{remote[1]}")
+
+    def sendall(self, data):
+        net = self.net
+        with net.lock:
+            if self.closed:
+                raise OSError(errno.EBADF, "Bad file descriptor")
+            if self.reset:
+                raise ConnectionResetError(errno.ECONNRESET, "Connection reset by peer")
+            if self.shut_wr:
+                raise BrokenPipeError(errno.EPIPE, "Broken pipe")
+            net.transmit(self, "data", bytes(data))
+            net.activity += 1
+
+    def send(self, data) -> int:
+        self.sendall(data)
+        return len(data)
+
+    def recv(self, n : int, flags : int = 0) -> bytes:
+        return self.read(n, peek=bool(flags & socket.MSG_PEEK))
+
+    def recv_into(self, buffer, nbytes : int = 0, flags : int = 0) -> int:
+        data = self.read(nbytes or len(buffer), peek=bool(flags & socket.MSG_PEEK))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def read(self, n : int, peek : bool = False) -> bytes:
+        net = self.net
+        with net.lock:
+            if self.fresh:
+                self.fresh = False
+                net.unread -= 1
+            deadline = None if not self.timeout else net.clock.now + self.timeout
+            while not self.chunks:
+                if self.closed:
+                    raise OSError(errno.EBADF, "Bad file descriptor")
+                if self.reset:
+                    raise ConnectionResetError(errno.ECONNRESET, "Connection reset by peer")
+                if self.eof:
+                    return b""
+                if self.timeout == 0:
+                    raise BlockingIOError(errno.EAGAIN, "Resource temporarily unavailable")
+                if deadline is not None and net.clock.now >= deadline:
+                    raise socket.timeout("timed out")
+                net.wait(self, deadline)
+            if self.closed:
+                raise OSError(errno.EBADF, "Bad file descriptor")
+            net.activity += 1
+            return self.take(n, peek)
+
+    def take(self, n : int, peek : bool) -> bytes:
+        """
+        up to n buffered bytes, caller holds the lock
+        """
+        parts = []
+        offset = self.offset
+        index = 0
+        while n and index < len(self.chunks):
+            head = self.chunks[index]
+            piece = head[offset:offset + n]
+            parts.append(piece)
+            n -= len(piece)
+            offset += len(piece)
+            if offset == len(head):
+                index += 1
+                offset = 0
+        if not peek:
+            for _ in range(index):
+                self.chunks.popleft()
+            self.offset = offset
+        return parts[0] if len(parts) == 1 else b"".join(parts)
+
+    def settimeout(self, timeout : float):
+        self.timeout = timeout
+
+    def gettimeout(self) -> float:
+        return self.timeout
+
+    def setblocking(self, flag : bool):
+        self.timeout = None if flag else 0.0
+
+    def setsockopt(self, level : int, option : int, value):
+        if level == socket.SOL_SOCKET and option == socket.SO_LINGER:
+            onoff, linger = struct.unpack("ii", value)
+            self.linger_reset = bool(onoff) and linger == 0
+
+    def shutdown(self, how : int):
+        net = self.net
+        with net.lock:
+            if self.closed:
+                raise OSError(errno.EBADF, "Bad file descriptor")
+            if how in (socket.SHUT_WR, socket.SHUT_RDWR) and not self.shut_wr:
+                self.shut_wr = True
+                net.transmit(self, "fin", None)
+            if how in (socket.SHUT_RD, socket.SHUT_RDWR):
+                self.eof = True
+                net.notify(self)
+            net.activity += 1
+
+    def close(self):
+        net = self.net
+        with net.lock:
+            if self.closed:
+                return
+            self.closed = True
+            if self.fresh:
+                self.fresh = False
+                net.unread -= 1
+            if self.linger_reset:
+                net.transmit(self, "rst", None)
+            elif not self.shut_wr:
+                net.transmit(self, "fin", None)
+            self.chunks.clear()
+            net.notify(self) # a thread blocked in recv gets EBADF instead of hanging
+            net.activity += 1
+
+    def getpeername(self) -> tuple:
+        return self.remote
+
+    def getsockname(self) -> tuple:
+        return self.local
+
+    def fileno(self) -> int:
+        return -1
+
+
+class SimListener:
+    """
+    listening socket, accept() for an accept thread or on_accept when the transport serves connections itself
+    """
+
+    def __init__(self, net : "SimNetwork", addr : tuple, backlog : int):
+        self.net = net
+        self.addr = addr
+        self.backlog = backlog
+        self.pending = deque()
+        self.on_accept = None
+        self.closed = False
+        self.ready = threading.Condition(net.lock)
+        self.waiters = 0
+
+    def accept(self) -> tuple:
+        net = self.net
+        with net.lock:
+            while not self.pending:
+                if self.closed:
+                    raise OSError(errno.EINVAL, "Invalid argument")
+                net.wait(self, None)
+            sock = self.pending.popleft()
+            net.activity += 1
+            return sock, sock.remote
+
+    def shutdown(self, how : int):
+        self.close()
+
+    def close(self):
+        net = self.net
+        with net.lock:
+            if self.closed:
+                return
+            self.closed = True
+            if net.listeners.get(self.addr) is self:
+                del net.listeners[self.addr]
+            while self.pending:
+                net.refuse(self.pending.popleft())
+            net.notify(self)
+
+    def getsockname(self) -> tuple:
+        return self.addr
+
+    def fileno(self) -> int:
+        return -1
+
+
+class SimTransport:
+    """
+    transport (see transport.py) for one node on a SimNetwork
+    """
+
+    def __init__(self, net : "SimNetwork", ip : str = None):
+        self.net = net
+        self.ip = ip
+
+    def listen(self, binding : tuple, backlog : int) -> SimListener:
+        if self.ip is None:
+            self.ip = binding[0]
+        return self.net.listen((binding[0], int(binding[1])), backlog)
+
+    def connect(self, peer_tuple : tuple) -> SimSocket:
+        return self.net.connect(self.ip or "127.0.0.1", (peer_tuple[0], int(peer_tuple[1])))
+
+    def serve(self, listening_socket : SimListener, on_conn) -> bool:
+        """
+        accepted connections are handed to on_conn by whoever runs the clock, no accept thread per node
+        """
+        listening_socket.on_accept = on_conn
+        return True
+
+    def now(self) -> float:
+        return self.net.clock.now
+
+    def timer(self, delay : float, func, *args) -> SimTimer:
+        return self.net.call_later(delay, func, *args)
+
+
+class SimNetwork:
+    """
+    listeners, links, partitions and the event queue, one lock for all of it
+    """
+
+    def __init__(
+            self,
+            latency : float = 0.001,
+            bandwidth : float = None,
+            loss : float = 0.0,
+            rto : float = 0.2,
+            jitter : float = 0.0,
+            seed : int = 0,
+            settle : float = SETTLE,
+            resolution : float = RESOLUTION,
+        ):
+        self.default = LinkProfile(latency, bandwidth, loss, rto, jitter)
+        self.links = {} # frozenset of two ips -> LinkProfile
+        self.groups = {} # ip -> partition group, ips in different groups cannot reach each other
+        self.seed = seed
+        self.settle_time = settle
+        self.resolution = resolution
+        self.clock = VirtualClock()
+        self.lock = threading.Lock()
+        self.listeners = {} # (ip, port) -> SimListener
+        self.ports = {} # ip -> next ephemeral port
+        self.events = [] # heap of (time, seq, kind, target, payload)
+        self.seq = itertools.count()
+        self.stalled = set() # sockets holding data back because of a partition
+        self.threads = set() # threads that have blocked on the network at least once
+        self.idle = 0 # of those, how many are blocked right now
+        self.unread = 0 # sockets nobody has read from yet, their thread is about to show up
+        self.activity = 0 # bumped on every socket call, the clock waits for it to stop changing
+        self.pilot = None
+        self.piloting = False
+        self.stats = {"steps" : 0, "bytes" : 0, "deliveries" : 0, "segments_lost" : 0}
+
+    def transport(self, ip : str = None) -> SimTransport:
+        return SimTransport(self, ip)
+
+    """
+    topology
+    """
+
+    def link(self, ip_a : str, ip_b : str) -> LinkProfile:
+        return self.links.get(frozenset((ip_a, ip_b)), self.default)
+
+    def set_link(self, ip_a : str, ip_b : str, **profile):
+        """
+        override latency, bandwidth, loss, rto or jitter between two ips
+        """
+        with self.lock:
+            self.links[frozenset((ip_a, ip_b))] = self.link(ip_a, ip_b).copy(**profile)
+
+    def partition(self, *groups):
+        """
+        split the network, ips in different groups cannot reach each other, ips in no group reach everyone
+        data sent across the split waits (like TCP retransmitting) until heal()
+        """
+        with self.lock:
+            self.groups = {}
+            for index, group in enumerate(groups):
+                for ip in group:
+                    self.groups[ip] = index
+
+    def heal(self):
+        with self.lock:
+            self.groups = {}
+            stalled, self.stalled = self.stalled, set()
+            for sock in stalled:
+                held, sock.stalled = sock.stalled, []
+                for kind, data in held:
+                    self.transmit(sock, kind, data)
+
+    def partitioned(self, ip_a : str, ip_b : str) -> bool:
+        group_a = self.groups.get(ip_a)
+        group_b = self.groups.get(ip_b)
+        return group_a is not None and group_b is not None and group_a != group_b
+
+    """
+    sockets, all called with the lock held except listen and connect
+    """
+
+    def listen(self, addr : tuple, backlog : int) -> SimListener:
+        with self.lock:
+            if addr in self.listeners:
+                raise OSError(errno.EADDRINUSE, "Address already in use")
+            listener = self.listeners[addr] = SimListener(self, addr, backlog)
+            return listener
+
+    def connect(self, ip : str, addr : tuple) -> SimSocket:
+        """
+        returns right away, the socket's first bytes leave after the handshake round trip
+        """
+        with self.lock:
+            self.activity += 1
+            if self.partitioned(ip, addr[0]):
+                raise socket.timeout("timed out")
+            listener = self.listeners.get(addr)
+            if listener is None:
+                raise ConnectionRefusedError(errno.ECONNREFUSED, "Connection refused")
+            port = self.ports.get(ip, FIRST_PORT)
+            self.ports[ip] = port + 1
+            client = self.new_socket((ip, port), addr, True)
+            server = self.new_socket(addr, (ip, port), False) # fresh once it is accepted
+            client.peer = server
+            server.peer = client
+            latency = self.link(ip, addr[0]).latency
+            client.busy_until = self.clock.now + 2 * latency
+            self.schedule(self.clock.now + latency, "accept", listener, server)
+            return client
+
+    def new_socket(self, local : tuple, remote : tuple, fresh : bool) -> SimSocket:
+        sock = SimSocket(self, local, remote)
+        sock.fresh = fresh
+        self.unread += fresh
+        return sock
+
+    def refuse(self, sock : SimSocket):
+        """
+        a connection the listener could not take, the dialer gets a RST
+        """
+        sock.closed = True
+        if sock.fresh:
+            sock.fresh = False
+            self.unread -= 1
+        self.transmit(sock, "rst", None)
+
+    def transmit(self, sock : SimSocket, kind : str, data : bytes):
+        """
+        schedule data, fin or rst for the other end of sock
+        """
+        profile = self.link(sock.local[0], sock.remote[0])
+        if sock.stalled or self.partitioned(sock.local[0], sock.remote[0]):
+            sock.stalled.append((kind, data))
+            self.stalled.add(sock)
+            return
+        size = len(data) if data else 0
+        start = max(self.clock.now, sock.busy_until)
+        done = start + (size / profile.bandwidth if profile.bandwidth else 0)
+        sock.busy_until = done
+        delay = profile.latency
+        if profile.jitter:
+            delay += sock.rng.uniform(0, profile.jitter)
+        if profile.loss and size:
+            segments = -(-size // MSS)
+            lost = sum(1 for _ in range(segments) if sock.rng.random() < profile.loss)
+            delay += lost * profile.rto
+            self.stats["segments_lost"] += lost
+        arrival = max(done + delay, sock.last_arrival)
+        sock.last_arrival = arrival
+        self.stats["bytes"] += size
+        self.schedule(arrival, kind, sock.peer, data)
+
+    def schedule(self, when : float, kind : str, target, payload):
+        heapq.heappush(self.events, (when, next(self.seq), kind, target, payload))
+
+    def call_later(self, delay : float, func, *args) -> SimTimer:
+        """
+        a timer on the virtual clock, called without the lock held
+        """
+        timer = SimTimer(func, args)
+        with self.lock:
+            self.schedule(self.clock.now + delay, "timer", timer, None)
+        return timer
+
+    def wait(self, owner, deadline : float):
+        """
+        block on owner.ready until notify(owner), with a wake event at deadline if there is one
+        """
+        self.threads.add(threading.current_thread())
+        if deadline is not None:
+            self.schedule(deadline, "wake", owner, None)
+        owner.waiters += 1
+        self.idle += 1
+        owner.ready.wait()
+
+    def notify(self, owner):
+        self.idle -= owner.waiters
+        owner.waiters = 0
+        owner.ready.notify_all()
+
+    def deliver(self, kind : str, target, payload, due : list):
+        self.stats["deliveries"] += 1
+        if kind == "timer":
+            if not target.cancelled:
+                due.append((target.func, target.args))
+            return
+        if kind == "data":
+            if target.closed:
+                if not target.peer.closed: # writing to a closed socket earns a RST
+                    self.transmit(target, "rst", None)
+                return
+            target.chunks.append(payload)
+        elif kind == "fin":
+            target.eof = True
+        elif kind == "rst":
+            target.reset = True
+        elif kind == "accept":
+            if target.closed or len(target.pending) >= target.backlog:
+                self.refuse(payload)
+                return
+            payload.fresh = True
+            self.unread += 1
+            if target.on_accept is not None:
+                due.append((target.on_accept, (payload, payload.remote)))
+                return
+            target.pending.append(payload)
+        self.notify(target)
+
+    """
+    clock
+    """
+
+    def quiet(self) -> bool:
+        """
+        every thread that uses the network is blocked on it and every new socket has been read, caller holds the lock
+        """
+        if self.unread > 0:
+            return False
+        me = 1 if threading.current_thread() in self.threads else 0
+        if len(self.threads) - me > self.idle:
+            self.threads = {thread for thread in self.threads if thread.is_alive()}
+            me = 1 if threading.current_thread() in self.threads else 0
+        return len(self.threads) - me <= self.idle
+
+    def settle(self):
+        """
+        wait (real time) until nodes have done everything they can at the current virtual time
+        """
+        end = time.perf_counter() + MAX_SETTLE
+        while True:
+            with self.lock:
+                before = self.activity
+            time.sleep(self.settle_time)
+            with self.lock:
+                if self.activity == before and self.quiet():
+                    return
+            if time.perf_counter() > end:
+                return
+
+    def step(self, end : float = None) -> bool:
+        """
+        jump to the next event time and deliver everything due within resolution of it, False if there is nothing before end
+        """
+        due = [] # (func, args) for accepted connections and timers
+        with self.lock:
+            if not self.events or (end is not None and self.events[0][0] > end):
+                if end is not None:
+                    self.clock.now = max(self.clock.now, end)
+                return False
+            horizon = self.events[0][0] + self.resolution
+            while self.events and self.events[0][0] <= horizon:
+                when, _, kind, target, payload = heapq.heappop(self.events)
+                self.clock.now = max(self.clock.now, when)
+                self.deliver(kind, target, payload, due)
+            self.stats["steps"] += 1
+            self.activity += 1
+        for func, args in due: # outside the lock, on_accept starts threads and reads sockets, timers send
+            func(*args)
+        return True
+
+    def run(self, until = None, timeout : float = None) -> bool:
+        """
+        run the clock until until() is true or timeout virtual seconds pass or nothing is left to deliver
+        returns until() (True if there is none)
+        """
+        end = None if timeout is None else self.clock.now + timeout
+        while True:
+            self.settle()
+            if until is not None and until():
+                return True
+            if not self.step(end):
+                return until() if until is not None else True
+
+    def start(self):
+        """
+        run the clock on a background thread, for driving clients from code that waits in real time
+        """
+        self.piloting = True
+        self.pilot = threading.Thread(target=self.autopilot, daemon=True)
+        self.pilot.start()
+
+    def autopilot(self):
+        while self.piloting:
+            self.settle()
+            if not self.step():
+                time.sleep(self.settle_time)
+
+    def stop(self):
+        self.piloting = False
+        if self.pilot:
+            self.pilot.join()
+            self.pilot = None
+
+    def now(self) -> float:
+        return self.clock.now
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return dict(self.stats, now=self.clock.now, pending_events=len(self.events), listeners=len(self.listeners))
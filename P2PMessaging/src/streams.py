@@ -0,0 +1,291 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+streams.py
+StreamMux class that carries many logical streams over one peer socket, so a multi megabyte bulk frame never holds
+control or interactive frames up behind it
+
+every message goes out on its own stream as chunks of at most CHUNK_SIZE bytes:
+    length (4) | stream id (4) | flags (1) | payload
+length counts everything after itself, the chunk with FIN set is the last one of its message. the receiver joins the
+chunks of each stream and hands a message up as soon as its FIN arrives, whatever else is still half received. every
+chunk of a weighted (bulk) stream has BULK set, so the receiver can decode those messages off its reading thread
+
+a mux with a pause event stops its reader between chunks when the event is set, so the socket, the half received
+streams, and the queued chunks can be handed to another process (handoff.py) without losing or splitting a chunk
+"""
+
+import base64
+import select
+import socket
+import struct
+import threading
+from collections import deque
+
+HEADER = struct.Struct("!IIB") # length, stream id, flags
+FIN = 0x01
+BULK = 0x02 # on every chunk of a stream sent with a weight, peers that predate it send 0 and everything is handled inline
+CHUNK_SIZE = 16 * 1024 # payload per chunk, a waiting control frame is never more than one of these behind
+HANDSHAKE_STREAM = 0 # single chunk frames sent before a LiveConnection exists, see write_frame
+PAUSE_POLL = 0.2 # seconds a pausable reader waits for data before checking its pause event again
+MAX_OPEN_STREAMS = 1024 # half received streams per connection, one more fails the connection
+MAX_STREAM_BYTES = 256 * 1024 * 1024 # largest message a peer may send, a longer stream fails the connection
+MAX_FRAME_BYTES = 64 * 1024 # largest handshake frame, read before anything is known about the peer
+SEND_BUFFER = 4 * CHUNK_SIZE # kernel send buffer, chunks already in it can not be overtaken (autotuned it holds MBs)
+
+class Paused(Exception):
+    """
+    raised by StreamMux.receive when its pause event stopped it at a chunk boundary
+    """
+
+def recv_exact(sock : socket.socket, n : int) -> bytes:
+    """
+    read exactly n bytes, recv_into one buffer instead of joining parts
+    """
+    buffer = bytearray(n)
+    view = memoryview(buffer)
+    got = 0
+    while got < n:
+        count = sock.recv_into(view[got:], n - got)
+        if not count:
+            raise ConnectionError("Conn closed b4 full message could be read!")
+        got += count
+    return bytes(buffer)
+
+def read_chunk(sock : socket.socket, max_payload : int = MAX_STREAM_BYTES) -> tuple:
+    """
+    (stream id, flags, payload) of the next chunk on the socket, a length over max_payload is refused before reading it
+    """
+    header = recv_exact(sock, HEADER.size)
+    length, stream_id, flags = HEADER.unpack(header)
+    if length < HEADER.size - 4 or length - (HEADER.size - 4) > max_payload:
+        raise ValueError(f"Bad chunk length {length}")
+    return stream_id, flags, recv_exact(sock, length - (HEADER.size - 4))
+
+def pack_chunk(stream_id : int, flags : int, payload) -> bytes:
+    return HEADER.pack(HEADER.size - 4 + len(payload), stream_id, flags) + payload
+
+def write_frame(sock : socket.socket, data : bytes):
+    """
+    whole message as one chunk, for the handshake where nothing else shares the socket yet
+    """
+    sock.sendall(pack_chunk(HANDSHAKE_STREAM, FIN, data))
+
+def read_frame(sock : socket.socket, max_payload : int = MAX_FRAME_BYTES) -> bytes:
+    """
+    one whole message sent with write_frame
+    """
+    stream_id, flags, payload = read_chunk(sock, max_payload)
+    if not flags & FIN:
+        raise ValueError(f"Chunked frame on stream {stream_id} before the connection was set up")
+    return payload
+
+def wire_size(n : int, chunk_size : int = CHUNK_SIZE) -> int:
+    """
+    bytes a message of n bytes takes on the wire, headers included
+    """
+    chunks = max(1, -(-n // chunk_size))
+    return n + chunks * HEADER.size
+
+
+class OutStream:
+    """
+    one outgoing message and how much of it has been written
+    """
+
+    __slots__ = ("id", "data", "offset", "weight", "turn", "done")
+
+    def __init__(self, stream_id : int, data : bytes, weight : int):
+        self.id = stream_id
+        self.data = data
+        self.offset = 0
+        self.weight = weight # chunks per round robin turn, None keeps its place until it is done
+        self.turn = 0
+        self.done = False
+
+
+class StreamMux:
+    """
+    outgoing: one queue per priority, the lowest priority number with anything queued always goes next, streams in
+    the same priority take turns `weight` chunks at a time. there is no writer thread, every thread in send() writes
+    whichever chunk is next (maybe someone else's) until its own message is out, so send() still returns only once
+    the data is on the socket
+    incoming: chunks are collected per stream id by the one thread that reads the socket, at most max_streams half
+    received at once and max_bytes in any one, a peer going over either gets a ConnectionError and the connection ends
+    """
+
+    def __init__(
+            self,
+            sock : socket.socket,
+            chunk_size : int = CHUNK_SIZE,
+            max_streams : int = MAX_OPEN_STREAMS,
+            max_bytes : int = MAX_STREAM_BYTES,
+            send_buffer : int = SEND_BUFFER,
+        ):
+        self.sock = sock
+        if send_buffer:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, send_buffer)
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock() # queues and stream ids
+        self.write_lock = threading.Lock() # one chunk on the socket at a time
+        self.levels = {} # priority -> deque of OutStream with chunks left
+        self.next_id = HANDSHAKE_STREAM + 1
+        self.error = None # set once a write fails, every later send fails the same way
+        self.inbound = {} # stream id -> payload parts received so far
+        self.inbound_bytes = {} # stream id -> bytes in its parts
+        self.max_streams = max_streams
+        self.max_bytes = max_bytes
+        self.pause = None # Event, when set the reader stops at the next chunk boundary, None never pauses
+        self.paused = threading.Event() # the reader has stopped and will not touch the socket again
+
+    def send(self, data : bytes, priority : int = 0, weight : int = None):
+        """
+        queue a message and help write chunks until all of it is on the socket
+        weight None keeps messages of that priority in order, bulk streams pass a weight to share fairly
+        """
+        with self.lock:
+            if self.error:
+                raise self.error
+            stream = OutStream(self.next_id, data, weight)
+            self.next_id = self.next_id % 0xFFFFFFFF + 1 # never HANDSHAKE_STREAM
+            self.levels.setdefault(priority, deque()).append(stream)
+
+        while not stream.done:
+            with self.write_lock:
+                if stream.done:
+                    break
+                if self.error:
+                    raise self.error
+                with self.lock:
+                    current, chunk, last = self.next_chunk()
+                try:
+                    self.sock.sendall(chunk)
+                except OSError as e:
+                    self.fail(e)
+                    raise
+                if last:
+                    current.done = True
+
+    def next_chunk(self) -> tuple:
+        """
+        (stream, chunk bytes, whether it is the stream's last), caller holds both locks
+        """
+        priority = min(p for p, queue in self.levels.items() if queue)
+        queue = self.levels[priority]
+        stream = queue[0]
+        start = stream.offset
+        end = min(start + self.chunk_size, len(stream.data))
+        stream.offset = end
+        last = end == len(stream.data)
+        if last:
+            queue.popleft()
+        elif stream.weight is not None:
+            stream.turn += 1
+            if stream.turn >= stream.weight:
+                stream.turn = 0
+                queue.rotate(-1)
+        flags = (FIN if last else 0) | (BULK if stream.weight is not None else 0)
+        chunk = pack_chunk(stream.id, flags, memoryview(stream.data)[start:end])
+        return stream, chunk, last
+
+    def fail(self, error : Exception):
+        """
+        the socket is gone, drop everything queued so waiting senders give up
+        """
+        with self.lock:
+            self.error = error
+            self.levels = {}
+
+    def receive(self) -> bytes:
+        """
+        read chunks until some stream's message is complete, return that message
+        """
+        return self.receive_marked()[0]
+
+    def receive_marked(self) -> tuple:
+        """
+        (message, whether its sender marked it BULK), read chunks until some stream's message is complete
+        """
+        while True:
+            if self.pause is not None:
+                self.wait_readable()
+            stream_id, flags, payload = read_chunk(self.sock, self.max_bytes)
+            size = self.inbound_bytes.get(stream_id, 0) + len(payload)
+            if size > self.max_bytes:
+                raise ConnectionError(f"Stream {stream_id} is over {self.max_bytes} bytes")
+            if flags & FIN:
+                bulk = bool(flags & BULK)
+                parts = self.inbound.pop(stream_id, None)
+                if parts is None:
+                    return payload, bulk
+                del self.inbound_bytes[stream_id]
+                parts.append(payload)
+                return b"".join(parts), bulk
+            if stream_id not in self.inbound:
+                if len(self.inbound) >= self.max_streams:
+                    raise ConnectionError(f"Over {self.max_streams} streams open at once")
+                self.inbound[stream_id] = []
+            self.inbound[stream_id].append(payload)
+            self.inbound_bytes[stream_id] = size
+
+    def wait_readable(self):
+        """
+        block until the next chunk starts arriving, raise Paused instead once the pause event is set
+        """
+        while True:
+            if self.pause.is_set():
+                self.paused.set()
+                raise Paused()
+            if select.select([self.sock], [], [], PAUSE_POLL)[0]:
+                return
+
+    def queued(self) -> int:
+        """
+        outgoing messages not completely written yet
+        """
+        return sum(len(queue) for queue in list(self.levels.values()))
+
+    def snapshot(self) -> dict:
+        """
+        the stream state another process needs to carry on this socket, taken once the reader is paused and with
+        write_lock held so no chunk is half written
+        """
+        encode = lambda data: base64.b64encode(data).decode("ascii")
+        with self.lock:
+            return {
+                "next_id" : self.next_id,
+                "inbound" : {str(stream_id) : [encode(part) for part in parts] for stream_id, parts in self.inbound.items()},
+                "outbound" : [
+                    [priority, stream.id, encode(stream.data[stream.offset:]), stream.weight]
+                    for priority, queue in self.levels.items() for stream in queue
+                ],
+            }
+
+    def restore(self, state : dict):
+        """
+        take over the stream state from snapshot, queued chunks go out on the next send or flush
+        """
+        with self.lock:
+            self.next_id = state["next_id"]
+            self.inbound = {int(stream_id) : [base64.b64decode(part) for part in parts] for stream_id, parts in state["inbound"].items()}
+            self.inbound_bytes = {stream_id : sum(len(part) for part in parts) for stream_id, parts in self.inbound.items()}
+            for priority, stream_id, data, weight in state["outbound"]:
+                self.levels.setdefault(priority, deque()).append(OutStream(stream_id, base64.b64decode(data), weight))
+
+    def flush(self):
+        """
+        write whatever is queued with nobody in send() to write it (restored streams)
+        """
+        while True:
+            with self.write_lock:
+                with self.lock:
+                    if self.error or not self.queued():
+                        return
+                    current, chunk, last = self.next_chunk()
+                try:
+                    self.sock.sendall(chunk)
+                except OSError as e:
+                    self.fail(e)
+                    raise
+                if last:
+                    current.done = True
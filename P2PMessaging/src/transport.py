@@ -0,0 +1,57 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+transport.py
+TcpTransport class, where Client gets its sockets from. simnet.py has an in-memory one with the same methods
+
+a transport has:
+    listen(binding, backlog) -> listening socket with accept(), shutdown(), close()
+    connect(peer_tuple) -> connected socket with sendall(), recv(), recv_into(), settimeout(), getpeername(), close()
+    serve(listening_socket, on_conn) -> True if the transport calls on_conn(sock, peer_tuple) itself, False if the
+        client needs an accept thread
+    now() -> seconds on the clock socket timeouts run on, for deadlines and rate limits
+    timer(delay, func, *args) -> calls func(*args) once delay seconds have passed on that clock, returns something
+        with cancel()
+"""
+
+import socket
+import threading
+import time
+
+def start_timer(delay : float, func, *args) -> threading.Timer:
+    """
+    wall clock timer on its own daemon thread
+    """
+    timer = threading.Timer(delay, func, args=args)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+class TcpTransport:
+    """
+    real TCP sockets, the default
+    """
+
+    def listen(self, binding : tuple, backlog : int) -> socket.socket:
+        listening_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listening_socket.bind(binding)
+        listening_socket.listen(backlog)
+        return listening_socket
+
+    def connect(self, peer_tuple : tuple) -> socket.socket:
+        receiver_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            receiver_socket.connect(peer_tuple)
+        except OSError:
+            receiver_socket.close()
+            raise
+        return receiver_socket
+
+    def serve(self, listening_socket : socket.socket, on_conn) -> bool:
+        return False
+
+    def now(self) -> float:
+        return time.monotonic()
+
+    def timer(self, delay : float, func, *args) -> threading.Timer:
+        return start_timer(delay, func, *args)
@@ -0,0 +1,381 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+tui.py
+TUI class, a curses interface driven by Client events: new messages show up as they arrive and only the lines that changed are redrawn
+
+python3 runner.py --tui
+
+Tab / Shift+Tab pick a conversation, PgUp / PgDn scroll, End jumps back to the newest message, Enter sends
+/connect <ip> <port>, /friend, /accept, /unfriend, /quit
+"""
+
+import curses
+import queue
+import socket
+import threading
+import uuid
+
+from identification import Identification
+from client import Client
+from message import Message
+
+PEER_WIDTH = 24 # columns for the conversation list
+TICK_MS = 50 # how long getch waits before checking for client events
+
+class TUI:
+    """
+    left: peers, right: the visible slice of the selected conversation, bottom: input line
+    network threads only queue events, every curses call happens on the main thread
+    """
+
+    def __init__(self, client : Client):
+        self.client = client
+        self.events = queue.SimpleQueue()
+        self.outgoing = queue.SimpleQueue() # sends run on their own thread so typing never waits on a socket
+        self.peers = []
+        self.current = None # Identification of the open conversation
+        self.offset = 0 # messages scrolled up from the newest, 0 = following new messages
+        self.unseen = 0 # arrived in the open conversation while scrolled up
+        self.unread = {} # peer id -> count for the other conversations
+        self.input = ""
+        self.status = "Tab to pick a conversation, /help for commands"
+        self.running = False
+
+    def run(self):
+        curses.wrapper(self.main)
+
+    def main(self, stdscr):
+        self.stdscr = stdscr
+        curses.curs_set(1)
+        curses.use_default_colors()
+        curses.init_pair(1, curses.COLOR_CYAN, -1) # us
+        curses.init_pair(2, curses.COLOR_YELLOW, -1) # them
+        curses.init_pair(3, curses.COLOR_GREEN, -1) # system lines, read marks
+        curses.init_pair(4, curses.COLOR_BLACK, curses.COLOR_WHITE) # header, selection
+        stdscr.timeout(TICK_MS)
+        stdscr.keypad(True)
+
+        self.running = True
+        self.client.subscribe(self.on_event)
+        sender = threading.Thread(target=self.send_loop, daemon=True)
+        sender.start()
+        try:
+            self.layout()
+            self.refresh_peers()
+            self.draw_all()
+            while self.running:
+                self.drain_events()
+                try:
+                    key = stdscr.get_wch()
+                except curses.error:
+                    continue # timed out, go check events
+                self.handle_key(key)
+        finally:
+            self.client.unsubscribe(self.on_event)
+            self.outgoing.put(None)
+
+    # events, called on network threads
+
+    def on_event(self, event : str, **data):
+        self.events.put((event, data))
+
+    def drain_events(self):
+        """
+        apply every queued event, then push the changed windows to the screen once
+        """
+        changed = False
+        while True:
+            try:
+                event, data = self.events.get_nowait()
+            except queue.Empty:
+                break
+            self.apply_event(event, data)
+            changed = True
+        if changed:
+            self.place_cursor()
+            curses.doupdate()
+
+    def apply_event(self, event : str, data : dict):
+        peer = data.get("peer")
+        if event in ("message", "sent"):
+            message = data["message"]
+            if Message.category(message.get_type()) != "user":
+                return
+            if self.current is not None and peer.get_id() == self.current.get_id():
+                if self.offset == 0:
+                    self.append_message(message, data.get("result"))
+                else:
+                    self.unseen += 1
+                    self.draw_header()
+            elif event == "message":
+                self.unread[peer.get_id()] = self.unread.get(peer.get_id(), 0) + 1
+                self.draw_peers()
+        elif event in ("connected", "disconnected"):
+            self.status = f"{peer.get_name()} {event}"
+            self.refresh_peers()
+            self.draw_peers()
+            self.draw_header()
+        elif event == "read":
+            if self.current is not None and peer.get_id() == self.current.get_id():
+                self.draw_messages() # read marks moved, only this pane
+        elif event == "friend_request":
+            self.status = f"{peer.get_name()} wants to be friends, open them and /accept"
+            self.draw_header()
+        elif event in ("friends", "unfriended"):
+            self.status = f"{'Now friends with' if event == 'friends' else 'No longer friends with'} {peer.get_name()}"
+            self.draw_header()
+        elif event == "status": # from send_loop
+            self.refresh_peers()
+            self.draw_peers()
+            self.draw_header()
+
+    # drawing
+
+    def layout(self):
+        height, width = self.stdscr.getmaxyx()
+        self.msg_h = max(height - 2, 1)
+        self.msg_w = max(width - PEER_WIDTH - 1, 10)
+        self.header = curses.newwin(1, width, 0, 0)
+        self.peer_win = curses.newwin(self.msg_h, PEER_WIDTH, 1, 0)
+        self.msg_win = curses.newwin(self.msg_h, self.msg_w, 1, PEER_WIDTH + 1)
+        self.msg_win.scrollok(True)
+        self.input_win = curses.newwin(1, width, height - 1, 0)
+        self.width = width
+
+    def draw_all(self):
+        self.stdscr.erase()
+        self.stdscr.noutrefresh()
+        self.draw_header()
+        self.draw_peers()
+        self.draw_messages()
+        self.draw_input()
+        self.place_cursor()
+        curses.doupdate()
+
+    def draw_header(self):
+        me = self.client.identification
+        title = f" {me.get_name()} ({me.get_id()}) :{me.get_port()} | {len(self.client.connections)} connected"
+        if self.unseen:
+            title += f" | {self.unseen} new below (End)"
+        title += f" | {self.status}"
+        self.header.erase()
+        self.header.addnstr(0, 0, title.ljust(self.width), self.width - 1, curses.color_pair(4))
+        self.header.noutrefresh()
+
+    def draw_peers(self):
+        self.peer_win.erase()
+        live = {conn.get_receiver().get_id() for conn in list(self.client.connections)}
+        for row, peer in enumerate(self.peers[:self.msg_h]):
+            mark = "*" if peer.get_id() in live else " "
+            unread = self.unread.get(peer.get_id())
+            label = f"{mark}{peer.get_name()}" + (f" ({unread})" if unread else "")
+            selected = self.current is not None and peer.get_id() == self.current.get_id()
+            self.peer_win.addnstr(row, 0, label, PEER_WIDTH - 1, curses.color_pair(4) if selected else 0)
+        self.peer_win.noutrefresh()
+
+    def draw_messages(self):
+        """
+        full redraw of the message pane, only reads the slice of history that fits on screen
+        """
+        self.msg_win.erase()
+        if self.current is None:
+            self.msg_win.addnstr(0, 0, "No conversation selected.", self.msg_w - 1)
+            self.msg_win.noutrefresh()
+            return
+        table = self.client.hash_table
+        end = max(table.history_length(self.current) - self.offset, 0)
+        messages = [m for m in table.read_range(self.current, end - self.msg_h, end) if Message.category(m.get_type()) == "user"]
+        lines = []
+        for message in messages:
+            lines += self.render(message)
+        lines = lines[-self.msg_h:]
+        for row, (text, attr) in enumerate(lines, start=self.msg_h - len(lines)):
+            self.msg_win.addnstr(row, 0, text, self.msg_w - 1, attr)
+        self.msg_win.noutrefresh()
+        if self.offset == 0:
+            self.mark_read(messages)
+
+    def append_message(self, message : Message, result : str = None):
+        """
+        incremental redraw: scroll the pane up by the new message's lines and draw only those
+        """
+        for text, attr in self.render(message, result):
+            self.msg_win.scroll(1)
+            self.msg_win.addnstr(self.msg_h - 1, 0, text, self.msg_w - 1, attr)
+        self.msg_win.noutrefresh()
+        self.mark_read([message])
+
+    def render(self, message : Message, result : str = None) -> list:
+        """
+        one message as wrapped (text, attr) lines
+        """
+        ours = message.get_sender().get_id() == self.client.identification.get_id()
+        time = message.get_datetime()[11:]
+        name = message.get_sender().get_name()
+        attr = curses.color_pair(1 if ours else 2)
+        type = message.get_type()
+        if type in ("TEXT_MESSAGE_REQUEST", "TEXT_MESSAGE_RESPONSE"):
+            text = f"[{time}] {name}: {message.get_content()}"
+        else:
+            text = f"[{time}] * {name}: {type.lower().replace('_', ' ')}"
+            attr = curses.color_pair(3)
+        if ours and result == "Queued Message!":
+            text += " (queued)"
+        elif ours and self.client.hash_table.is_read(message, "peer_read"):
+            text += " (read)"
+        width = self.msg_w - 1
+        lines = []
+        for paragraph in text.split("\n"):
+            while len(paragraph) > width:
+                lines.append((paragraph[:width], attr))
+                paragraph = "  " + paragraph[width:]
+            lines.append((paragraph, attr))
+        return lines
+
+    def draw_input(self):
+        self.input_win.erase()
+        visible = ("> " + self.input)[-(self.width - 1):]
+        self.input_win.addnstr(0, 0, visible, self.width - 1)
+        self.input_win.noutrefresh()
+
+    def place_cursor(self):
+        column = min(len(self.input) + 2, self.width - 1)
+        self.input_win.move(0, column)
+        self.input_win.noutrefresh()
+
+    def mark_read(self, messages : list):
+        for message in reversed(messages):
+            if message.get_sender().get_id() == self.current.get_id():
+                self.client.mark_read(self.current, message)
+                return
+
+    # input
+
+    def handle_key(self, key):
+        if key == curses.KEY_RESIZE:
+            self.layout()
+            self.draw_all()
+            return
+        if key in ("\t", curses.KEY_BTAB):
+            self.select(1 if key == "\t" else -1)
+        elif key == curses.KEY_PPAGE:
+            self.scroll(self.msg_h // 2)
+        elif key == curses.KEY_NPAGE:
+            self.scroll(-(self.msg_h // 2))
+        elif key == curses.KEY_END:
+            self.scroll(-self.offset)
+        elif key in ("\n", "\r", curses.KEY_ENTER):
+            line, self.input = self.input.strip(), ""
+            if line:
+                self.submit(line)
+            self.draw_input()
+        elif key in (curses.KEY_BACKSPACE, "\b", "\x7f"):
+            self.input = self.input[:-1]
+            self.draw_input()
+        elif isinstance(key, str) and key.isprintable():
+            self.input += key
+            self.draw_input()
+        else:
+            return
+        self.place_cursor()
+        curses.doupdate()
+
+    def select(self, step : int):
+        self.refresh_peers()
+        if not self.peers:
+            return
+        index = 0
+        if self.current is not None:
+            ids = [peer.get_id() for peer in self.peers]
+            index = (ids.index(self.current.get_id()) + step) % len(ids) if self.current.get_id() in ids else 0
+        self.current = self.peers[index]
+        self.unread.pop(self.current.get_id(), None)
+        self.offset = 0
+        self.unseen = 0
+        self.draw_peers()
+        self.draw_messages()
+        self.draw_header()
+
+    def scroll(self, messages : int):
+        if self.current is None:
+            return
+        total = self.client.hash_table.history_length(self.current)
+        self.offset = min(max(self.offset + messages, 0), max(total - 1, 0))
+        if self.offset == 0:
+            self.unseen = 0
+        self.draw_messages()
+        self.draw_header()
+
+    def submit(self, line : str):
+        if not line.startswith("/"):
+            if self.current is None:
+                self.status = "Pick a conversation with Tab first"
+                self.draw_header()
+                return
+            if self.offset:
+                self.scroll(-self.offset)
+            self.outgoing.put((self.client.send_to, self.current, line))
+            return
+        command, *args = line.split()
+        if command == "/quit":
+            self.running = False
+        elif command == "/connect" and len(args) == 2 and args[1].isdigit():
+            self.outgoing.put((self.client.start_conn, (args[0], int(args[1]))))
+        elif command in ("/friend", "/accept", "/unfriend") and self.current is not None:
+            action = {"/friend" : self.client.request_friend, "/accept" : self.client.accept_friend, "/unfriend" : self.client.end_friendship}[command]
+            self.outgoing.put((action, self.current))
+        else:
+            self.status = "/connect <ip> <port>, /friend, /accept, /unfriend, /quit"
+            self.draw_header()
+
+    def send_loop(self):
+        """
+        runs queued client calls in order, results come back as status text through the event queue
+        """
+        while True:
+            job = self.outgoing.get()
+            if job is None:
+                return
+            func, *args = job
+            try:
+                result = func(*args)
+            except Exception as e:
+                result = f"Failed: {e}"
+            if isinstance(result, str) and func != self.client.send_to:
+                self.status = result
+                self.events.put(("status", {}))
+
+    def refresh_peers(self):
+        """
+        live connections first, then peers seen on the LAN, then anyone we have history with
+        """
+        seen = {}
+        for conn in list(self.client.connections):
+            seen.setdefault(conn.get_receiver().get_id(), conn.get_receiver())
+        for peer in self.client.directory.get_peers():
+            seen.setdefault(peer.get_id(), peer)
+        for peer_id, entry in self.client.hash_table.peers().items():
+            if "receiver" in entry:
+                seen.setdefault(peer_id, Identification.from_string(entry["receiver"]))
+        self.peers = list(seen.values())
+
+
+def main():
+    # same identity setup as the CLI
+    mac = ':'.join(['{:02x}'.format((uuid.getnode() >> elements) & 0xff) for elements in range(0, 2 * 6, 8)][::-1])
+    ip = socket.gethostbyname(socket.gethostname())
+    port = input("Enter what port you want to use for this conversation: ")
+    while not port.isdigit() or not 0 < int(port) < 65536:
+        port = input("Not a valid port, try again: ")
+    name = input("What name do you want to use: ")
+    client = Client(Identification(name=name, id=mac, ip=ip, port=port))
+    client.start_listening()
+    client.start_discovery()
+    try:
+        TUI(client).run()
+    finally:
+        client.stop()
+
+if __name__ == "__main__":
+    main()
@@ -43,11 +43,7 @@ class UI:
         # get machine ip
         self.ip = socket.gethostbyname(socket.gethostname())
         # ask for port user wants to use
-        self.port = input("Enter what port you want to use for this conversation: ")
-
-        # user port input check
-
-        # self.port = int(self.port)
+        self.port = UI.get_port("Enter what port you want to use for this conversation: ")
 
         # id stuff inniting
         self.name = input("What name do you want to use: ")
@@ -62,7 +58,7 @@ class UI:
         self.client = Client(self.id)
 
         # useful lists
-        self.menu_commands = ["quit", "add_connection",  "view_connection", "view_log"]
+        self.menu_commands = ["quit", "add_connection", "connect_known_peer", "message_known_peer", "view_connection", "view_log", "view_outbox", "stats", "start_metrics_endpoint", "toggle_tracing", "profile"]
         self.connection_commands = ["quit", "send_message", "friend_status", "clear_history", "see_all_connections_view", "refresh"]
         self.running = False
 
@@ -71,7 +67,9 @@ class UI:
         # init
         self.welcome_message()
         self.running = True
+        self.client.subscribe(self.on_client_event) # connection notices, the client itself never prints
         self.client.start_listening() # start listening for requests in the background
+        self.client.start_discovery() # announce ourselves and find peers on the LAN
 
         print(f"You are using IP: {self.ip}")
         print(f"You are using port: {self.port}")
@@ -85,12 +83,36 @@ class UI:
                 if menu_cmd == "add_connection":
                     self.add_conn()
 
+                elif menu_cmd == "connect_known_peer":
+                    self.connect_known_peer()
+
                 elif menu_cmd == "view_connection":
                     self.view_conn()
 
+                elif menu_cmd == "message_known_peer":
+                    self.message_known_peer()
+
                 elif menu_cmd == "view_log":
                     self.view_log()
 
+                elif menu_cmd == "view_outbox":
+                    self.view_outbox()
+
+                elif menu_cmd == "stats":
+                    self.view_stats()
+
+                elif menu_cmd == "toggle_tracing":
+                    self.client.profiler.set_tracing(not self.client.profiler.tracing)
+                    print(PURPLE + BRIGHT + f"Stage tracing {'on' if self.client.profiler.tracing else 'off'}" + RESET)
+
+                elif menu_cmd == "profile":
+                    self.profile()
+
+                elif menu_cmd == "start_metrics_endpoint":
+                    port = int(UI.get_port("Enter port for the metrics endpoint: "))
+                    port = self.client.start_metrics_server(port)
+                    print(PURPLE + BRIGHT + f"Metrics at http://127.0.0.1:{port}/metrics" + RESET)
+
                 elif menu_cmd == "quit":
                     self.running = False
                     self.client.stop()
@@ -105,11 +127,38 @@ class UI:
         
         self.client.stop() # when loop is done, stop the client for cleanup
     
+    def on_client_event(self, event : str, **data):
+        if event == "connected":
+            print(GREEN + BRIGHT + f"\nConnected to {data['peer'].get_name()}!\n" + RESET)
+        elif event == "disconnected":
+            print("\nConnection with " + data["peer"].get_name() + " ended.\n")
+
     def add_conn(self):
         peer_ip = input("Enter peer IP: ")
-        peer_port = int(input("Enter peer port: "))
+        peer_port = int(UI.get_port("Enter peer port: "))
         peer_tuple = (peer_ip, peer_port)
         print(PURPLE + BRIGHT + self.client.start_conn(peer_tuple) + RESET)
+
+    def connect_known_peer(self):
+        peers = self.client.directory.get_peers()
+        peer_names = ["quit"]
+        for peer in peers:
+            peer_names.append(f"{peer.get_name()} ({peer.get_id()}) @ {peer.get_ip()}:{peer.get_port()}")
+        choice = UI.get_menu_option("Select a known peer: \n", peer_names) - 1
+        if choice == -1: # quit
+            return
+        print(PURPLE + BRIGHT + self.client.start_conn_by_id(peers[choice].get_id()) + RESET)
+
+    def message_known_peer(self):
+        peers = self.client.directory.get_peers()
+        peer_names = ["quit"]
+        for peer in peers:
+            peer_names.append(f"{peer.get_name()} ({peer.get_id()})")
+        choice = UI.get_menu_option("Select a known peer to message: \n", peer_names) - 1
+        if choice == -1: # quit
+            return
+        content = input("Enter Message to Send: ")
+        print(PURPLE + BRIGHT + self.client.send_to(peers[choice], content) + RESET)
     
     def view_conn(self):
         while self.running:
@@ -137,12 +186,11 @@ class UI:
             # handle user input
             if command == "send_message":
                 content = input("Enter Message to Send: ")
-                message = Message(self.id, conn_choice.get_receiver(), content, "TEXT_MESSAGE_REQUEST")
-                self.client.send_message(message, conn_choice.get_socket(), conn_choice)
+                self.client.send_to(conn_choice.get_receiver(), content)
             elif command == "see_all_connections_view":
                 return 0
             elif command == "friend_status":
-                print("not implemented")
+                self.friend_status(conn_choice.get_receiver())
                 continue
             elif command == "clear_history":
                 print("not implemented")
@@ -150,8 +198,7 @@ class UI:
             elif command == "quit":
                 return 1
             elif command == "refresh":
-                # read_receipt = Message(self.id, conn_choice.get_receiver(), "", "READ_RECEIPT")
-                # self.client.send_message(read_receipt, conn_choice.get_socket(), conn_choice)
+                # reprinting the history marks new messages read, see print_message_history
                 continue
             else:
                 print(RED + "Unknown Command! Try Again")
@@ -163,7 +210,7 @@ class UI:
         top = len(message_history)
         # print("TOP: ", top)
         message_counter = 0
-        types_to_display = ["TEXT_MESSAGE_REQUEST", "TEXT_MESSAGE_RESPONSE", "FRIEND_REQUEST", "FRIEND_RESPONSE", "END_FRIENDS", "READ_RECEIPT"]
+        types_to_display = ["TEXT_MESSAGE_REQUEST", "TEXT_MESSAGE_RESPONSE", "FRIEND_REQUEST", "FRIEND_RESPONSE", "END_FRIENDS"]
         # get k most recent messages
         try:
             for i in reversed(range(top)):
@@ -182,6 +229,11 @@ class UI:
                     break
         except Exception as e:
             print(f"THE PROBLEM: {e}")
+        # everything shown is read, one cumulative receipt for the newest message from them
+        for msg in display_messages:
+            if msg.get_sender().get_id() == conn.get_receiver().get_id():
+                self.client.mark_read(conn.get_receiver(), msg)
+                break
         # display conversation
         # print("MESSAGE COUNTER: ", message_counter)
         print(WHITE + BRIGHT + "***CONVERSATION WITH: " + conn.get_receiver().get_name() + "***\n" + RESET)
@@ -198,6 +250,8 @@ class UI:
             print(YELLOW + BRIGHT + f"From: {sender.get_name()}" + RESET)
             print(YELLOW + BRIGHT + f"To: {receiver.get_name()}" + RESET)
             print(BLUE + BRIGHT + f"Content: {content}" + RESET)
+            if sender.get_id() == self.id.get_id() and self.client.hash_table.is_read(display_messages[i], "peer_read"):
+                print(GREEN + BRIGHT + "Read" + RESET)
             print(WHITE + NORMAL + "******************************" + RESET)
 
     def view_log(self):
@@ -205,6 +259,72 @@ class UI:
         for conn in self.client.connections:
             print(f"HISTORY WITH {conn.get_receiver().get_name()}:", conn.get_history())
 
+    def friend_status(self, peer : Identification):
+        roster = self.client.friends
+        if roster.is_friend(peer.get_id()):
+            print(GREEN + BRIGHT + f"You are friends with {peer.get_name()} since {roster.get(peer.get_id()).get_datetime()}." + RESET)
+            options = ["back", "end_friendship"]
+        elif peer.get_id() in roster.pending:
+            print(YELLOW + BRIGHT + f"{peer.get_name()} sent you a friend request." + RESET)
+            options = ["back", "accept_friend_request"]
+        elif peer.get_id() in roster.requested:
+            print(YELLOW + BRIGHT + f"Waiting for {peer.get_name()} to accept your friend request." + RESET)
+            return
+        else:
+            print(WHITE + BRIGHT + f"You are not friends with {peer.get_name()}." + RESET)
+            options = ["back", "send_friend_request"]
+        option = options[UI.get_menu_option("What would you like to do: ", options)]
+        if option == "end_friendship":
+            print(self.client.end_friendship(peer))
+        elif option == "accept_friend_request":
+            print(self.client.accept_friend(peer))
+        elif option == "send_friend_request":
+            print(self.client.request_friend(peer))
+
+    def view_outbox(self):
+        stats = self.client.outbox_stats()
+        print(WHITE + BRIGHT + f"Undelivered messages: {stats['total_depth']} (oldest {stats['oldest_age']:.0f}s)" + RESET)
+        for peer_id, peer_stats in stats["peers"].items():
+            print(YELLOW + BRIGHT + f"{peer_id}: {peer_stats['depth']} waiting, oldest {peer_stats['oldest_age']:.0f}s" + RESET)
+
+    def profile(self):
+        try:
+            seconds = float(input("Profile for how many seconds: "))
+        except ValueError:
+            print(RED + BRIGHT + "Not a valid number.")
+            return
+        if self.client.profiler.start_window(seconds):
+            print(PURPLE + BRIGHT + f"Profiling for {seconds}s, results go to {self.client.profiler.dump_dir}" + RESET)
+        else:
+            print(RED + BRIGHT + "A profiling window is already running.")
+
+    def view_stats(self):
+        for name, value in self.client.get_stats().items():
+            if isinstance(value, dict) and value and all(isinstance(v, dict) for v in value.values()):
+                # labeled histograms or traffic
+                print(CYAN + BRIGHT + f"{name}:" + RESET)
+                for label, inner in value.items():
+                    if "count" in inner:
+                        inner_str = UI.format_histogram(inner)
+                    else:
+                        inner_str = " ".join(f"{k}={v}" for k, v in inner.items())
+                    print(WHITE + NORMAL + f"    {label}: " + inner_str + RESET)
+            elif isinstance(value, dict) and "count" in value:
+                print(CYAN + BRIGHT + f"{name}: " + RESET + UI.format_histogram(value))
+            elif isinstance(value, dict):
+                # labeled counters
+                print(CYAN + BRIGHT + f"{name}:" + RESET)
+                for label, n in value.items():
+                    print(WHITE + NORMAL + f"    {label}: {n}" + RESET)
+            else:
+                print(CYAN + BRIGHT + f"{name}: " + RESET + f"{value}")
+
+    @classmethod
+    def format_histogram(cls, hist):
+        if not hist["count"]:
+            return "no samples"
+        return f"count={hist['count']} mean={hist['sum'] / hist['count']:.6g} p50={hist['p50']:.6g} p99={hist['p99']:.6g} max={hist['max']:.6g}"
+
     def bad_option(self):
         print("\nBAD OPTION!\n")
 
@@ -227,6 +347,22 @@ class UI:
             if color_index >= num_colors:
                 color_index = 0
     
+    @classmethod
+    def get_port(cls, message):
+        while True:
+            raw_input = input(message)
+            try:
+                port = int(raw_input)
+            except Exception as e:
+                print(RED + BRIGHT + "Not a valid port. Try again.")
+                continue
+
+            if 0 >= port or 65535 < port:
+                print(RED + BRIGHT + "Port must be between 1 and 65535. Try again.")
+                continue
+
+            return str(port)
+
     @classmethod
     def get_menu_option(cls, message, commands):
         n = len(commands)
@@ -0,0 +1,11 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+conftest.py
+puts src on the path so tests import modules the same bare way the app does
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
@@ -0,0 +1,114 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+test_archive.py
+HistoryArchive round trips (append, read, search, drop_oldest, delete, reload) and merging into an archived history
+"""
+
+import os
+
+import pytest
+
+from archive import BLOCK_MESSAGES, COUNT, FIRST, LAST, Compactor, HistoryArchive
+from hash_table import HashTable
+from identification import Identification
+from message import Message
+
+HOST = Identification("host", "1", "127.0.0.1", "5000")
+PEER = Identification("peer", "2", "127.0.0.1", "5001")
+
+
+def history(n : int, per_second : int = 1) -> list:
+    """
+    n serialized messages, oldest first, per_second of them share each second
+    """
+    return [
+        Message(HOST, PEER, f"message {i}", "TEXT_MESSAGE_REQUEST", f"2024-01-01 {i // per_second // 3600:02d}:{i // per_second // 60 % 60:02d}:{i // per_second % 60:02d}").serialize()
+        for i in range(n)
+    ]
+
+
+@pytest.fixture
+def archive(tmp_path):
+    return HistoryArchive(str(tmp_path / "archive"))
+
+
+def test_append_splits_into_blocks(archive):
+    messages = history(BLOCK_MESSAGES * 2 + 10)
+    archive.append("p", messages)
+    blocks = archive.index["p"]
+    assert [block[COUNT] for block in blocks] == [BLOCK_MESSAGES, BLOCK_MESSAGES, 10]
+    assert blocks[0][FIRST] == Message.deserialize(messages[0]).get_datetime()
+    assert blocks[-1][LAST] == Message.deserialize(messages[-1]).get_datetime()
+    assert archive.count("p") == len(messages)
+    assert archive.oldest("p") == blocks[0][FIRST]
+
+
+def test_read_ranges(archive):
+    messages = history(BLOCK_MESSAGES + 50)
+    archive.append("p", messages[:BLOCK_MESSAGES])
+    archive.append("p", messages[BLOCK_MESSAGES:])
+    assert archive.read("p") == messages
+    assert archive.read("p", 10, 20) == messages[10:20]
+    assert archive.read("p", BLOCK_MESSAGES - 5, BLOCK_MESSAGES + 5) == messages[BLOCK_MESSAGES - 5:BLOCK_MESSAGES + 5]
+    assert archive.read("unknown") == []
+
+
+def test_search_newest_first(archive):
+    messages = history(BLOCK_MESSAGES * 3)
+    archive.append("p", messages)
+    found = archive.search("p", text="message 7", limit=3)
+    assert [Message.deserialize(s).get_content() for s in found] == ["message 767", "message 766", "message 765"]
+    since, until = (Message.deserialize(messages[i]).get_datetime() for i in (100, 104))
+    assert archive.search("p", since=since, until=until, limit=50) == list(reversed(messages[100:105]))
+    assert archive.search("p", text="not there") == []
+
+
+def test_drop_oldest_and_delete(archive):
+    messages = history(BLOCK_MESSAGES + 1)
+    archive.append("p", messages)
+    assert archive.drop_oldest("p") == BLOCK_MESSAGES
+    assert archive.read("p") == messages[BLOCK_MESSAGES:]
+    assert archive.drop_oldest("p") == 1
+    assert archive.drop_oldest("p") == 0
+    assert "p" not in archive.peers()
+
+    archive.append("q", messages)
+    archive.delete("q")
+    assert archive.count("q") == 0
+
+
+def test_save_reload_and_segment_removal(archive):
+    messages = history(BLOCK_MESSAGES * 2)
+    archive.append("p", messages)
+    archive.append("q", messages[:5])
+    archive.save()
+
+    reloaded = HistoryArchive(archive.dir)
+    assert reloaded.read("p") == messages
+    assert reloaded.read("q") == messages[:5]
+
+    segment = reloaded.segment_fp("q", 0)
+    reloaded.delete("q")
+    assert os.path.exists(segment) # only removed once the index without it is saved
+    reloaded.save()
+    assert not os.path.exists(segment)
+    assert HistoryArchive(archive.dir).peers() == ["p"]
+
+
+def test_merge_keeps_new_messages_in_the_newest_archived_second(tmp_path):
+    table = HashTable(HOST, str(tmp_path))
+    old = [Message.deserialize(s) for s in history(30, per_second=3)]
+    for message in old:
+        table.write_message(message, False)
+    table.save()
+
+    table = HashTable(HOST, str(tmp_path))
+    Compactor(table, hot_messages=10).run()
+    newest = table.archive.index[PEER.get_id()][-1][LAST]
+    late = Message(HOST, PEER, "late in the same second", "TEXT_MESSAGE_REQUEST", newest)
+
+    table.merge_history(PEER, [Message.deserialize(m.serialize()) for m in old] + [late])
+    contents = [m.get_content() for m in table.read_history(PEER)]
+    assert "late in the same second" in contents
+    assert len(contents) == 11 # archived messages are not merged back into the hot window
@@ -0,0 +1,54 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+test_columns.py
+HistoryColumns keeps type names with the columns, so labels survive a restart whatever was registered in between
+"""
+
+import json
+
+import pytest
+
+from columns import HistoryColumns, np
+from identification import Identification
+from message import Message
+
+HOST = Identification("host", "1", "127.0.0.1", "5000")
+PEER = Identification("peer", "2", "127.0.0.1", "5001")
+
+
+def message(msg_type : str, content : str = "hi") -> Message:
+    return Message(PEER, HOST, content, msg_type, "2024-01-01 00:00:00")
+
+
+@pytest.mark.parametrize("vectorized", [pytest.param(True, marks=pytest.mark.skipif(np is None, reason="needs numpy")), False])
+def test_type_labels_survive_reload(tmp_path, vectorized):
+    directory = str(tmp_path / "columns")
+    columns = HistoryColumns(directory, HOST.get_id())
+    Message.register_type("TEST_COLUMNS_LATE_TYPE", "user")
+    for msg_type in ("TEST_COLUMNS_LATE_TYPE", "TEXT_MESSAGE_REQUEST", "TEXT_MESSAGE_REQUEST"):
+        columns.append(PEER.get_id(), message(msg_type))
+    columns.save()
+
+    reloaded = HistoryColumns(directory, HOST.get_id())
+    reloaded.vectorized = vectorized
+    assert reloaded.types == ["TEST_COLUMNS_LATE_TYPE", "TEXT_MESSAGE_REQUEST"]
+    assert reloaded.aggregate("type") == {"TEST_COLUMNS_LATE_TYPE" : 1, "TEXT_MESSAGE_REQUEST" : 2}
+    assert reloaded.aggregate("peer", types=["TEXT_MESSAGE_REQUEST"]) == {PEER.get_id() : 2}
+    assert reloaded.aggregate("peer", types=["NEVER_STORED"]) == {}
+
+
+def test_columns_without_type_table_are_rebuilt(tmp_path):
+    directory = str(tmp_path / "columns")
+    columns = HistoryColumns(directory, HOST.get_id())
+    columns.append(PEER.get_id(), message("TEXT_MESSAGE_REQUEST"))
+    columns.save()
+    with open(f"{directory}/meta.json") as file:
+        meta = json.load(file)
+    del meta["types"] # written before the type table, its codes were opcodes
+    with open(f"{directory}/meta.json", "w") as file:
+        json.dump(meta, file)
+
+    reloaded = HistoryColumns(directory, HOST.get_id())
+    assert reloaded.rows() == 0
+    assert reloaded.stale({PEER.get_id() : 1}) == {PEER.get_id()}
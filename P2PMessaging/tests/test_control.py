@@ -0,0 +1,38 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+test_control.py
+the control socket is private to our user and can only send text
+"""
+
+import os
+import stat
+
+import pytest
+
+from client import Client
+from control import ControlClient, ControlServer
+from exception import CustomException
+from identification import Identification
+
+
+@pytest.fixture
+def control(tmp_path):
+    client = Client(Identification("ctl", "test-ctl", "127.0.0.1", "0"), str(tmp_path))
+    path = str(tmp_path / "ctl.sock")
+    server = ControlServer(client, path)
+    server.start()
+    yield path
+    server.stop()
+    client.stop()
+
+
+def test_socket_has_no_group_or_other_access(control):
+    assert stat.S_IMODE(os.stat(control).st_mode) & 0o077 == 0
+    assert ControlClient(control).call("ping")
+
+
+@pytest.mark.parametrize("msg_type", ["FRIEND_RESPONSE", "BACKUP_STORE", "ACK"])
+def test_send_refuses_protocol_types(control, msg_type):
+    with pytest.raises(CustomException, match=msg_type):
+        ControlClient(control).call("send", peer_id="aa:bb", content="", type=msg_type)
@@ -0,0 +1,132 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+test_datagram.py
+sequence numbers, selective acks, and the sender's floor on the datagram path
+"""
+
+import pytest
+
+from datagram import ACK, ACK_HEADER, DATA, DATA_HEADER, DUP_THRESH, MAX_SACK, SACK_BLOCK, DatagramChannel, DatagramPeer
+
+ADDR = ("127.0.0.1", 9)
+
+
+def parse_ack(packet : bytes) -> tuple:
+    kind, cumulative, count = ACK_HEADER.unpack_from(packet)
+    assert kind == ACK
+    runs = [SACK_BLOCK.unpack_from(packet, ACK_HEADER.size + i * SACK_BLOCK.size) for i in range(count)]
+    return cumulative, runs
+
+
+@pytest.fixture
+def channel():
+    # everything it transmits is dropped (loss 1.0), the threads are never started
+    channel = DatagramChannel(("127.0.0.1", 0), deliver=lambda data, conn: None, fallback=lambda data, conn: None, loss=1.0)
+    yield channel
+    channel.stop()
+
+
+def test_in_order_advances_expected():
+    peer = DatagramPeer(ADDR, None)
+    assert all(peer.receive(seq, 0) for seq in range(3))
+    assert peer.expected == 3 and peer.above == set()
+    assert parse_ack(peer.ack_packet()) == (3, [])
+
+
+def test_duplicates_are_refused():
+    peer = DatagramPeer(ADDR, None)
+    assert peer.receive(0, 0)
+    assert peer.receive(2, 0)
+    assert not peer.receive(0, 0)
+    assert not peer.receive(2, 0)
+
+
+def test_gap_is_filled():
+    peer = DatagramPeer(ADDR, None)
+    for seq in (0, 2, 3, 5):
+        peer.receive(seq, 0)
+    assert parse_ack(peer.ack_packet()) == (1, [(2, 4), (5, 6)])
+    peer.receive(1, 0)
+    peer.receive(4, 0)
+    assert peer.expected == 6 and peer.above == set()
+
+
+def test_sack_runs_are_capped():
+    peer = DatagramPeer(ADDR, None)
+    for seq in range(1, 4 * MAX_SACK, 2): # every other seq, all separate runs
+        peer.receive(seq, 0)
+    cumulative, runs = parse_ack(peer.ack_packet())
+    assert cumulative == 0
+    assert runs == [(seq, seq + 1) for seq in range(1, 2 * MAX_SACK, 2)]
+
+
+def test_floor_skips_what_the_sender_gave_up_on():
+    peer = DatagramPeer(ADDR, None)
+    peer.receive(0, 0)
+    peer.receive(3, 0)
+    peer.receive(6, 0)
+    assert peer.receive(5, 4) # seqs 1 to 3 went over the stream instead
+    assert peer.expected == 4
+    assert peer.above == {5, 6}
+    assert not peer.receive(2, 4)
+
+
+def test_sender_floor_is_lowest_unacked(channel):
+    peer = channel.attach(None, ADDR)
+    assert peer.floor() == 0
+    for data in (b"a", b"b", b"c"):
+        channel.send(peer, data)
+    assert peer.floor() == 0
+    channel.handle_ack(peer, 1, [])
+    assert peer.floor() == 1
+    channel.handle_ack(peer, 3, [])
+    assert peer.floor() == peer.next_seq == 3
+
+
+def test_sent_packet_carries_seq_and_floor(channel):
+    peer = channel.attach(None, ADDR)
+    channel.send(peer, b"first")
+    channel.send(peer, b"second")
+    kind, seq, floor = DATA_HEADER.unpack_from(peer.unacked[1].packet)
+    assert (kind, seq, floor) == (DATA, 1, 0)
+    assert peer.unacked[1].packet[DATA_HEADER.size:] == b"second"
+
+
+def test_sack_removes_and_fast_retransmits_the_hole(channel):
+    peer = channel.attach(None, ADDR)
+    for i in range(DUP_THRESH + 2):
+        channel.send(peer, bytes([i]))
+    channel.handle_ack(peer, 1, [(2, DUP_THRESH + 2)]) # 1 missing, everything after it arrived
+    assert list(peer.unacked) == [1]
+    assert peer.unacked[1].fast and peer.unacked[1].retries == 1
+
+
+def test_no_fast_retransmit_below_threshold(channel):
+    peer = channel.attach(None, ADDR)
+    for i in range(DUP_THRESH):
+        channel.send(peer, bytes([i]))
+    channel.handle_ack(peer, 1, [(2, DUP_THRESH)])
+    assert list(peer.unacked) == [1]
+    assert not peer.unacked[1].fast
+
+
+def test_receiver_round_trip_through_channel(channel):
+    delivered = []
+    channel.deliver = lambda data, conn: delivered.append(data)
+    peer = channel.attach(None, ADDR)
+    for seq, data in ((0, b"a"), (2, b"c"), (0, b"a"), (1, b"b")):
+        channel.handle(DATA_HEADER.pack(DATA, seq, 0) + data, ADDR)
+    assert delivered == [b"a", b"c", b"b"]
+    assert peer.expected == 3
+
+
+def test_snapshot_restore(channel):
+    peer = channel.attach(None, ADDR)
+    channel.send(peer, b"x")
+    peer.receive(0, 0)
+    peer.receive(2, 0)
+    copy = DatagramPeer(ADDR, None)
+    copy.restore(peer.snapshot())
+    assert (copy.next_seq, copy.expected, copy.above) == (1, 1, {2})
+    assert copy.unacked[0].packet == peer.unacked[0].packet
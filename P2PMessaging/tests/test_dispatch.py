@@ -0,0 +1,79 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+test_dispatch.py
+HandlerPool ordering and slot accounting, and opcodes that registration never moves
+"""
+
+import threading
+import time
+
+from dispatch import HandlerPool, HandlerRegistry, HandlerSpec
+from message import CUSTOM_OPCODES, Message
+
+
+def wait_for(predicate, timeout : float = 5.0) -> bool:
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if predicate():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+def test_ordered_work_runs_in_submit_order():
+    pool = HandlerPool(workers=4)
+    seen = []
+    for i in range(50):
+        pool.submit("peer", True, seen.append, i)
+    assert wait_for(lambda: pool.pending() == 0)
+    assert seen == list(range(50))
+    pool.shutdown()
+
+
+def test_pending_counts_unordered_work():
+    pool = HandlerPool(workers=1)
+    release = threading.Event()
+    pool.submit(None, False, release.wait)
+    pool.submit(None, False, lambda: None)
+    assert pool.pending() == 2
+    release.set()
+    assert wait_for(lambda: pool.pending() == 0)
+    pool.shutdown()
+
+
+def test_shutdown_without_wait_gives_slots_back():
+    pool = HandlerPool(workers=1, max_pending=4)
+    release = threading.Event()
+    ran = []
+    pool.submit("a", True, release.wait) # holds the only worker
+    pool.submit("a", True, ran.append, "a") # behind it in its lane
+    pool.submit("b", True, ran.append, "b") # its own lane, queued in the executor
+    pool.submit(None, False, ran.append, "c") # queued in the executor
+    pool.shutdown(wait=False)
+    release.set()
+    assert wait_for(lambda: pool.pending() == 0)
+    assert ran == []
+    assert pool.lanes == {}
+    for _ in range(4): # every slot is free again
+        assert pool.slots.acquire(timeout=1)
+
+
+def test_submit_after_shutdown_is_dropped():
+    pool = HandlerPool(workers=1, max_pending=1)
+    pool.shutdown()
+    pool.submit("a", True, lambda: None)
+    pool.submit(None, False, lambda: None)
+    assert pool.pending() == 0
+    assert pool.slots.acquire(timeout=1)
+
+
+def test_registering_a_type_never_moves_standard_opcodes():
+    before = dict(Message.opcodes)
+    registry = HandlerRegistry(HandlerSpec(lambda msg, conn: None))
+    opcode = registry.register("TEST_PLUGIN_TYPE", lambda msg, conn: None)
+    assert opcode >= CUSTOM_OPCODES
+    assert "TEST_PLUGIN_TYPE" not in Message.standard_types
+    assert {type : Message.opcodes[type] for type in before} == before
+    assert registry.lookup("TEST_PLUGIN_TYPE").handler is not registry.fallback.handler
+    assert registry.lookup("TEXT_MESSAGE_REQUEST") is registry.fallback
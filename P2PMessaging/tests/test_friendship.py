@@ -0,0 +1,72 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+test_friendship.py
+friend requests between two live clients, only a response to a request we sent makes a friend
+"""
+
+import socket
+import threading
+import time
+
+import pytest
+
+from client import Client
+from identification import Identification
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_for(predicate, timeout : float = 5.0) -> bool:
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+def connect(a : Client, b : Client):
+    a.start_conn(b.binding)
+    assert wait_for(lambda: a.get_conn(b.identification.get_id()) and b.get_conn(a.identification.get_id()))
+
+
+@pytest.fixture
+def clients(tmp_path):
+    started = []
+
+    def make(name : str) -> Client:
+        client = Client(Identification(name, f"test-{name}", "127.0.0.1", str(free_port())), str(tmp_path))
+        client.start_listening()
+        started.append(client)
+        return client
+    yield make
+    threads = [threading.Thread(target=client.stop) for client in started]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_request_then_accept_makes_friends(clients):
+    alice, bob = clients("alice"), clients("bob")
+    connect(alice, bob)
+    alice.request_friend(bob.identification)
+    assert wait_for(lambda: alice.identification.get_id() in bob.friends.pending)
+    bob.accept_friend(alice.identification)
+    assert wait_for(lambda: alice.friends.is_friend(bob.identification.get_id()))
+    assert bob.friends.is_friend(alice.identification.get_id())
+
+
+def test_unsolicited_response_is_ignored(clients):
+    alice, mallory = clients("alice"), clients("mallory")
+    connect(mallory, alice)
+    mallory.send_to(alice.identification, "", "FRIEND_REQUEST")
+    mallory.send_to(alice.identification, "", "FRIEND_RESPONSE")
+    assert wait_for(lambda: mallory.identification.get_id() in alice.friends.pending)
+    # the response follows the request on the same connection, give it time to be handled
+    time.sleep(0.3)
+    assert not alice.friends.is_friend(mallory.identification.get_id())
+    assert mallory.identification.get_id() in alice.friends.pending
@@ -0,0 +1,30 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+test_handoff.py
+the handoff channel is a Unix socket only our user can reach
+"""
+
+import os
+import socket
+import stat
+
+from handoff import bind_private, same_user
+
+
+def test_bind_private_is_never_open(tmp_path):
+    path = str(tmp_path / "h.sock")
+    umask = os.umask(0)
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            bind_private(sock, path)
+            assert stat.S_IMODE(os.stat(path).st_mode) & 0o077 == 0
+            assert os.umask(0) == 0 # the process umask is put back after the bind
+    finally:
+        os.umask(umask)
+
+
+def test_same_user_over_socketpair():
+    a, b = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    with a, b:
+        assert same_user(a) and same_user(b)
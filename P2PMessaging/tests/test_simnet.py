@@ -0,0 +1,55 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+test_simnet.py
+timers and rate limits on a SimNetwork's virtual clock instead of wall clock time
+"""
+
+from admission import AdmissionControl, AdmissionPolicy
+from receipts import ACK_DELAY, DELAY, DeliveryAcks, ReadReceipts
+from simnet import SimNetwork
+
+
+def test_ack_timer_fires_on_virtual_time():
+    net = SimNetwork()
+    sent = []
+    acks = DeliveryAcks(lambda conn, keys: sent.append((net.now(), conn, keys)), timer=net.transport().timer)
+    acks.schedule("conn", "k1")
+    acks.schedule("conn", "k2")
+    assert sent == []
+    net.run()
+    assert sent == [(ACK_DELAY, "conn", ["k1", "k2"])]
+    assert acks.timers == {}
+
+
+def test_discarded_acks_never_fire():
+    net = SimNetwork()
+    sent = []
+    acks = DeliveryAcks(lambda conn, keys: sent.append(keys), timer=net.transport().timer)
+    acks.schedule("conn", "k1")
+    acks.discard("conn")
+    net.run()
+    assert sent == []
+
+
+def test_receipt_waits_for_the_clock():
+    net = SimNetwork()
+    sent = []
+    receipts = ReadReceipts(lambda peer_id, mark: sent.append((net.now(), peer_id, mark)), timer=net.transport().timer)
+    receipts.schedule("p", ["a", "2024-01-01 00:00:00"])
+    receipts.schedule("p", ["b", "2024-01-01 00:00:01"])
+    net.run(timeout=DELAY / 2)
+    assert sent == []
+    net.run()
+    assert sent == [(DELAY, "p", ["b", "2024-01-01 00:00:01"])]
+
+
+def test_rate_limit_refills_on_virtual_time():
+    net = SimNetwork()
+    admission = AdmissionControl(AdmissionPolicy(rate=1.0, burst=2), net.transport().now)
+    assert admission.admit("10.0.0.2", 0) is None
+    assert admission.admit("10.0.0.2", 0) is None
+    assert admission.admit("10.0.0.2", 0) == "rate"
+    net.run(timeout=1.0)
+    assert admission.admit("10.0.0.2", 0) is None
+    assert admission.admit("10.0.0.2", 0) == "rate"
@@ -0,0 +1,168 @@
+"""
+Anthony Silva
+UNR, CPE 400, S24
+test_streams.py
+chunk framing, priority interleaving, and the inbound limits of StreamMux
+"""
+
+import base64
+import socket
+
+import pytest
+
+from streams import BULK, FIN, HEADER, MAX_FRAME_BYTES, SEND_BUFFER, StreamMux, pack_chunk, read_chunk, read_frame, wire_size, write_frame
+
+
+class Recorder:
+    """
+    stands in for a socket, keeps every chunk written
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def sendall(self, data):
+        self.chunks.append(bytes(data))
+
+
+def chunk_ids(chunks : list) -> list:
+    return [HEADER.unpack_from(chunk)[1] for chunk in chunks]
+
+
+def queued_mux(*streams) -> StreamMux:
+    """
+    a mux with (priority, stream id, data, weight) already queued and nobody sending, chunks of 4 bytes
+    """
+    mux = StreamMux(Recorder(), chunk_size=4, send_buffer=None)
+    outbound = [[priority, stream_id, base64.b64encode(data).decode("ascii"), weight] for priority, stream_id, data, weight in streams]
+    mux.restore({"next_id" : len(streams) + 1, "inbound" : {}, "outbound" : outbound})
+    return mux
+
+
+def test_pack_read_round_trip():
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall(pack_chunk(7, 0, b"first") + pack_chunk(9, FIN, b"") + pack_chunk(7, FIN, b"last"))
+        assert read_chunk(b) == (7, 0, b"first")
+        assert read_chunk(b) == (9, FIN, b"")
+        assert read_chunk(b) == (7, FIN, b"last")
+
+
+def test_frame_round_trip():
+    a, b = socket.socketpair()
+    with a, b:
+        write_frame(a, b"hello")
+        assert read_frame(b) == b"hello"
+
+
+def test_read_chunk_refuses_bad_lengths():
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall(HEADER.pack(HEADER.size - 5, 1, 0))
+        with pytest.raises(ValueError):
+            read_chunk(b)
+        a.sendall(pack_chunk(1, FIN, b"x" * 11))
+        with pytest.raises(ValueError):
+            read_chunk(b, max_payload=10)
+
+
+def test_read_frame_refuses_oversized_handshake():
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall(pack_chunk(0, FIN, b"x" * (MAX_FRAME_BYTES + 1)))
+        with pytest.raises(ValueError):
+            read_frame(b)
+
+
+def test_wire_size():
+    assert wire_size(0, 10) == HEADER.size
+    assert wire_size(10, 10) == 10 + HEADER.size
+    assert wire_size(11, 10) == 11 + 2 * HEADER.size
+
+
+def test_lower_priority_number_goes_first():
+    mux = queued_mux((2, 1, b"a" * 12, 1), (0, 3, b"ctrl", None))
+    mux.flush()
+    assert chunk_ids(mux.sock.chunks) == [3, 1, 1, 1]
+
+
+def test_weighted_streams_take_turns():
+    mux = queued_mux((2, 1, b"a" * 12, 1), (2, 2, b"b" * 8, 1))
+    mux.flush()
+    assert chunk_ids(mux.sock.chunks) == [1, 2, 1, 2, 1]
+    assert mux.queued() == 0
+
+
+def test_unweighted_streams_keep_order():
+    mux = queued_mux((1, 1, b"a" * 8, None), (1, 2, b"b" * 8, None))
+    mux.flush()
+    assert chunk_ids(mux.sock.chunks) == [1, 1, 2, 2]
+
+
+def chunk_flags(chunks : list) -> list:
+    return [HEADER.unpack_from(chunk)[2] for chunk in chunks]
+
+
+def test_weighted_streams_are_marked_bulk():
+    mux = queued_mux((2, 1, b"a" * 8, 1), (1, 2, b"text", None))
+    mux.flush()
+    assert chunk_flags(mux.sock.chunks) == [FIN, BULK, BULK | FIN]
+
+
+def test_receive_marked_reports_bulk():
+    a, b = socket.socketpair()
+    with a, b:
+        sender = StreamMux(a, chunk_size=4)
+        assert a.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF) <= 2 * SEND_BUFFER # linux doubles what it is given
+        sender.send(b"history backfill", 2, 1)
+        sender.send(b"hi", 1)
+        receiver = StreamMux(b)
+        assert receiver.receive_marked() == (b"history backfill", True)
+        assert receiver.receive_marked() == (b"hi", False)
+
+
+def test_interleaved_streams_reassemble():
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall(pack_chunk(1, 0, b"big ") + pack_chunk(2, FIN, b"small") + pack_chunk(1, 0, b"bulk ") + pack_chunk(1, FIN, b"frame"))
+        mux = StreamMux(b)
+        assert mux.receive() == b"small"
+        assert mux.receive() == b"big bulk frame"
+        assert mux.inbound == {} and mux.inbound_bytes == {}
+
+
+def test_send_receive_over_socket():
+    a, b = socket.socketpair()
+    with a, b:
+        StreamMux(a, chunk_size=3).send(b"split into chunks")
+        assert StreamMux(b).receive() == b"split into chunks"
+
+
+def test_too_many_open_streams_fails():
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall(b"".join(pack_chunk(stream_id, 0, b"x") for stream_id in range(1, 5)))
+        with pytest.raises(ConnectionError):
+            StreamMux(b, max_streams=3).receive()
+
+
+def test_oversized_stream_fails():
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall(pack_chunk(1, 0, b"x" * 60) + pack_chunk(1, FIN, b"x" * 60))
+        with pytest.raises(ConnectionError):
+            StreamMux(b, max_bytes=100).receive()
+
+
+def test_snapshot_restore_keeps_partial_streams():
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall(pack_chunk(1, 0, b"half "))
+        a.sendall(pack_chunk(2, FIN, b"done"))
+        old = StreamMux(b)
+        assert old.receive() == b"done"
+        new = StreamMux(b)
+        new.restore(old.snapshot())
+        assert new.inbound_bytes == {1 : 5}
+        a.sendall(pack_chunk(1, FIN, b"whole"))
+        assert new.receive() == b"half whole"